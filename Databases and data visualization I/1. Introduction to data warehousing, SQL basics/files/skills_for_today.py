@@ -1,18 +1,32 @@
-import sqlite3
 import datetime
 import os
+import sys
+
+# Make the shared warehouse package importable from the lesson folder
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from warehouse import loader, lookups
 
 # Delete the existing database file if it exists
 if os.path.exists("example.db"):
     os.remove("example.db")
     print("Existing database deleted.")
+# WAL mode keeps two side files next to the database
+for suffix in ("-wal", "-shm"):
+    if os.path.exists("example.db" + suffix):
+        os.remove("example.db" + suffix)
 
 # Create a new connection to a SQLite database
-# This will create a new database file if it doesn't exist
+# This will create a new database file if it doesn't exist.
+# loader.connect() also switches on WAL mode and the other tuned pragmas.
 print("Creating new database: example.db")
-conn = sqlite3.connect("example.db")
+conn = loader.connect("example.db")
 cursor = conn.cursor()
 
+# All changes below run in one transaction that is committed once at the
+# end, instead of paying for a commit (and a disk sync) after every statement.
+# The connection always sees its own uncommitted changes, so the SELECTs
+# in between already return the updated data.
+
 # =====================================
 # 1. TABLE CREATION
 # =====================================
@@ -30,7 +44,6 @@ cursor.execute("""
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP  -- Automatically set timestamp
     );
 """)
-conn.commit()  # Save the changes to the database
 
 # =====================================
 # 2. DATA INSERTION
@@ -47,7 +60,6 @@ cursor.executemany("""
     ('David', 'david@example.com'),
     ('Eve', 'eve@example.com')
 ])
-conn.commit()
 
 # =====================================
 # 3. BASIC SELECT WITH ORDERING
@@ -85,7 +97,6 @@ cursor.execute("""
     SET email = 'alice_new@example.com'
     WHERE name = 'Alice';
 """)
-conn.commit()
 
 # Verify the update with ordered results
 cursor.execute("""
@@ -104,7 +115,6 @@ print(updated_alice)
 # Remove Bob's record from the database
 print("\nDeleting user data...")
 cursor.execute("DELETE FROM users WHERE name = 'Bob';")
-conn.commit()
 
 # =====================================
 # 7. ALTER TABLE
@@ -112,7 +122,6 @@ conn.commit()
 # Add a new column to the existing users table
 print("\nAdding new column to users table...")
 cursor.execute("ALTER TABLE users ADD COLUMN phone TEXT;")
-conn.commit()
 
 # =====================================
 # 8. CREATE VIEW
@@ -126,7 +135,6 @@ cursor.execute("""
     FROM users
     ORDER BY name;  -- The view will always return results ordered by name
 """)
-conn.commit()
 
 # =====================================
 # 9. USE VIEW
@@ -152,7 +160,6 @@ cursor.execute("""
         stock INTEGER NOT NULL                        -- Stock quantity (required)
     );
 """)
-conn.commit()
 
 # =====================================
 # 11. INSERT PRODUCTS
@@ -168,7 +175,6 @@ cursor.executemany("""
     ('Monitor', 300.00, 20),
     ('Keyboard', 50.00, 30)
 ])
-conn.commit()
 
 # =====================================
 # 12. COMPLEX ORDERING
@@ -209,13 +215,34 @@ print("Products with stock status (ordered by status and price):")
 for product in products_with_status:
     print(product)
 
+# The same ranges can live in a small stock_levels lookup table instead,
+# joined by range. The labels are then changed in one place rather than in
+# every query that repeats the CASE.
+print("\nQuerying products with a stock_levels lookup table...")
+lookups.create(conn, lookups.STOCK_LEVELS)
+cursor.execute("""
+    SELECT 
+        p.product_name, 
+        p.price, 
+        p.stock,
+        l.stock_status                          -- Label of the stock range
+    FROM products AS p
+    JOIN stock_levels AS l
+      ON (l.min_stock IS NULL OR p.stock >= l.min_stock)  -- No lower bound for Low Stock
+     AND (l.max_stock IS NULL OR p.stock < l.max_stock)   -- No upper bound for High Stock
+    ORDER BY stock_status,  -- First order by stock status
+             price;         -- Then by price
+""")
+products_with_lookup = cursor.fetchall()
+print("Same rows as the CASE query:", products_with_lookup == products_with_status)
+
 # =====================================
 # 14. CLEANUP
 # =====================================
 # Drop the products table and close the database connection
 print("\nCleaning up...")
 cursor.execute("DROP TABLE IF EXISTS products;")
-conn.commit()
+conn.commit()  # Save all changes to the database at once
 
 # Close the database connection
 conn.close()
@@ -1,22 +1,34 @@
-import sqlite3
+import os
+import sys
 from datetime import datetime
 
-def create_database():
+# Make the shared warehouse package importable from the lesson folder
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from warehouse import analytics, approx, datagen, loader, stream
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS employees (
+        id INTEGER PRIMARY KEY,
+        name VARCHAR(100),
+        department VARCHAR(50),
+        job_title VARCHAR(100),
+        salary DECIMAL(10,2),
+        hire_date DATE
+    );
+'''
+
+def create_database(scale=None):
     # Connect to SQLite database
-    conn = sqlite3.connect('aggregation_guide.db')
+    conn = loader.connect('aggregation_guide.db')
     cursor = conn.cursor()
     
     # Create employees table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS employees (
-            id INTEGER PRIMARY KEY,
-            name VARCHAR(100),
-            department VARCHAR(50),
-            job_title VARCHAR(100),
-            salary DECIMAL(10,2),
-            hire_date DATE
-        )
-    ''')
+    cursor.executescript(SCHEMA)
+    
+    # Optionally fill the table with generated data instead of the samples
+    if scale:
+        datagen.populate(conn, 'aggregation', scale)
+        return conn
     
     # Sample employee data
     employees_data = [
@@ -32,96 +44,103 @@ def create_database():
         (10, 'Ivy Chen', 'Sales', 'Sales Representative', 54000.00, '2022-05-15')
     ]
     
-    # Insert sample data
-    cursor.executemany('''
-        INSERT OR REPLACE INTO employees 
-        (id, name, department, job_title, salary, hire_date) 
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', employees_data)
+    # Insert sample data, updating only rows that changed since the last run
+    loader.upsert(conn, 'employees', employees_data, ['id'])
     
     conn.commit()
     return conn
 
-def demonstrate_aggregations(conn):
-    cursor = conn.cursor()
-    
-    examples = {
-        "Basic COUNT Examples": [
-            ("Count all employees", 
-             "SELECT COUNT(*) FROM employees"),
-            ("Count employees with salary (non-NULL)", 
-             "SELECT COUNT(salary) FROM employees"),
-            ("Count distinct departments", 
-             "SELECT COUNT(DISTINCT department) FROM employees")
-        ],
-        
-        "NULL Handling": [
-            ("Find NULL salaries", 
-             "SELECT name FROM employees WHERE salary IS NULL"),
-            ("Replace NULL with 0 using COALESCE", 
-             "SELECT name, COALESCE(salary, 0) AS salary FROM employees"),
-            ("Compare total count vs non-NULL salary count", 
-             """SELECT COUNT(*) as total_count,
-                      COUNT(salary) as salary_count 
-                FROM employees""")
-        ],
-        
-        "ROUND Functions": [
-            ("Round salaries to nearest integer", 
-             "SELECT name, ROUND(salary) FROM employees WHERE salary IS NOT NULL"),
-            ("Round salaries to 2 decimal places", 
-             "SELECT name, ROUND(salary, 2) FROM employees WHERE salary IS NOT NULL")
-        ],
-        
-        "Arithmetic Operations": [
-            ("Calculate monthly salaries", 
-             """SELECT name, 
-                      ROUND(salary/12, 2) as monthly_salary 
-                FROM employees 
-                WHERE salary IS NOT NULL"""),
-            ("Apply 10% raise", 
-             """SELECT name, 
-                      salary as current_salary,
-                      ROUND(salary * 1.1, 2) as salary_with_raise 
-                FROM employees 
-                WHERE salary IS NOT NULL""")
-        ],
-        
-        "GROUP BY Examples": [
-            ("Count employees by department", 
-             """SELECT department, 
-                      COUNT(*) as employee_count 
-                FROM employees 
-                GROUP BY department"""),
-            ("Department salary statistics", 
-             """SELECT department,
-                      COUNT(*) as employee_count,
-                      ROUND(AVG(salary), 2) as avg_salary,
-                      MAX(salary) as max_salary,
-                      MIN(salary) as min_salary
-                FROM employees
-                GROUP BY department"""),
-            ("Departments with more than 2 employees", 
-             """SELECT department, 
-                      COUNT(*) as employee_count
-                FROM employees
-                GROUP BY department
-                HAVING COUNT(*) > 2""")
-        ]
-    }
+# Example queries grouped by topic: {category: [(description, query), ...]}
+EXAMPLES = {
+    "Basic COUNT Examples": [
+        ("Count all employees", 
+         "SELECT COUNT(*) FROM employees"),
+        ("Count employees with salary (non-NULL)", 
+         "SELECT COUNT(salary) FROM employees"),
+        ("Count distinct departments", 
+         "SELECT COUNT(DISTINCT department) FROM employees")
+    ],
+
+    "NULL Handling": [
+        ("Find NULL salaries", 
+         "SELECT name FROM employees WHERE salary IS NULL"),
+        ("Replace NULL with 0 using COALESCE", 
+         "SELECT name, COALESCE(salary, 0) AS salary FROM employees"),
+        ("Compare total count vs non-NULL salary count", 
+         """SELECT COUNT(*) as total_count,
+                  COUNT(salary) as salary_count 
+            FROM employees""")
+    ],
+
+    "ROUND Functions": [
+        ("Round salaries to nearest integer", 
+         "SELECT name, ROUND(salary) FROM employees WHERE salary IS NOT NULL"),
+        ("Round salaries to 2 decimal places", 
+         "SELECT name, ROUND(salary, 2) FROM employees WHERE salary IS NOT NULL")
+    ],
+
+    "Arithmetic Operations": [
+        ("Calculate monthly salaries", 
+         """SELECT name, 
+                  ROUND(salary/12, 2) as monthly_salary 
+            FROM employees 
+            WHERE salary IS NOT NULL"""),
+        ("Apply 10% raise", 
+         """SELECT name, 
+                  salary as current_salary,
+                  ROUND(salary * 1.1, 2) as salary_with_raise 
+            FROM employees 
+            WHERE salary IS NOT NULL""")
+    ],
+
+    "GROUP BY Examples": [
+        ("Count employees by department", 
+         """SELECT department, 
+                  COUNT(*) as employee_count 
+            FROM employees 
+            GROUP BY department"""),
+        ("Department salary statistics", 
+         """SELECT department,
+                  COUNT(*) as employee_count,
+                  ROUND(AVG(salary), 2) as avg_salary,
+                  MAX(salary) as max_salary,
+                  MIN(salary) as min_salary
+            FROM employees
+            GROUP BY department"""),
+        ("Departments with more than 2 employees", 
+         """SELECT department, 
+                  COUNT(*) as employee_count
+            FROM employees
+            GROUP BY department
+            HAVING COUNT(*) > 2""")
+    ]
+}
+
+def demonstrate_aggregations(conn, cache=None, executor=None):
+    # With a warehouse.cache.QueryCache, unchanged results come from the cache.
+    # With a warehouse.pool.QueryExecutor, all queries run concurrently first
+    # and are printed in order afterwards.
+    cursor = cache.cursor() if cache else conn.cursor()
+    prefetched = None
+    if executor:
+        prefetched = iter(executor.map([query for queries in EXAMPLES.values()
+                                        for _, query in queries]))
     
     # Run and display all examples
     print("\nSQL Aggregation Functions Examples:")
     print("=" * 50)
     
-    for category, queries in examples.items():
+    for category, queries in EXAMPLES.items():
         print(f"\n{category}")
         print("-" * len(category))
         
         for description, query in queries:
             print(f"\n{description}:")
-            cursor.execute(query)
-            results = cursor.fetchall()
+            if prefetched:
+                results = next(prefetched)
+            else:
+                cursor.execute(query)
+                results = stream.rows(cursor)
             
             # Format and display results
             for row in results:
@@ -130,6 +149,34 @@ def demonstrate_aggregations(conn):
                 else:
                     print(row)
 
+def demonstrate_window_functions(conn):
+    # GROUP BY gives one row per group; window functions keep every row
+    # and add a value computed over its group
+    print("\nWindow Function Examples:")
+    print("=" * 50)
+    for report in analytics.REPORTS['aggregation'][:3]:
+        print(f"\n{report.name}:")
+        for row in conn.execute(report.window):
+            print(row)
+
+def demonstrate_approximate_aggregates(conn):
+    # Sketch-based aggregates give up exactness for a fixed amount of memory;
+    # on a few rows they match the exact answers
+    approx.register(conn)
+    print("\nApproximate Aggregate Examples:")
+    print("=" * 50)
+    # A whole-column distinct count comes from the stored sketch, rebuilt
+    # only after employees changes; approx_count_distinct() would feed every
+    # row through Python and be far slower than SQLite's COUNT(DISTINCT)
+    print("\nDistinct departments:")
+    print(approx.count_distinct(conn, [('employees', 'department')]))
+    print("\nMedian salary per department:")
+    for row in conn.execute('''
+        SELECT department, approx_percentile(salary, 0.5) AS median_salary
+        FROM employees GROUP BY department
+    '''):
+        print(row)
+
 def main():
     print("Creating database with sample data...")
     conn = create_database()
@@ -137,6 +184,8 @@ def main():
     
     print("\nDemonstrating SQL aggregation functions...")
     demonstrate_aggregations(conn)
+    demonstrate_window_functions(conn)
+    demonstrate_approximate_aggregates(conn)
     
     conn.close()
     print("\nDatabase connection closed.")
@@ -1,75 +1,87 @@
-import sqlite3
+import os
+import sys
 from datetime import datetime
 
-def create_database():
+# Make the shared warehouse package importable from the lesson folder
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from warehouse import datagen, loader, segments, stream
+
+SCHEMA = '''
+    -- Basic tables for join examples
+    CREATE TABLE IF NOT EXISTS customers (
+        customer_id INTEGER PRIMARY KEY,
+        name VARCHAR(100),
+        email VARCHAR(100)
+    );
+
+    CREATE TABLE IF NOT EXISTS orders (
+        order_id INTEGER PRIMARY KEY,
+        customer_id INTEGER,
+        order_date DATE,
+        amount DECIMAL(10,2)
+    );
+    
+    -- Additional tables for advanced examples
+    CREATE TABLE IF NOT EXISTS employees (
+        emp_id INTEGER PRIMARY KEY,
+        name VARCHAR(100),
+        manager_id INTEGER
+    );
+    
+    CREATE TABLE IF NOT EXISTS products (
+        product_id INTEGER PRIMARY KEY,
+        product_name VARCHAR(100),
+        category VARCHAR(50)
+    );
+    
+    -- Tables for set operations
+    CREATE TABLE IF NOT EXISTS orders_2023 (
+        customer_id INTEGER,
+        amount DECIMAL(10,2)
+    );
+    
+    CREATE TABLE IF NOT EXISTS orders_2024 (
+        customer_id INTEGER,
+        amount DECIMAL(10,2)
+    );
+    
+    CREATE TABLE IF NOT EXISTS active_customers (
+        customer_id INTEGER PRIMARY KEY
+    );
+    
+    CREATE TABLE IF NOT EXISTS premium_members (
+        customer_id INTEGER PRIMARY KEY
+    );
+    
+    CREATE TABLE IF NOT EXISTS all_customers (
+        customer_id INTEGER PRIMARY KEY
+    );
+    
+    CREATE TABLE IF NOT EXISTS opted_out_customers (
+        customer_id INTEGER PRIMARY KEY
+    );
+    
+    CREATE TABLE IF NOT EXISTS north_sales (
+        amount DECIMAL(10,2)
+    );
+    
+    CREATE TABLE IF NOT EXISTS south_sales (
+        amount DECIMAL(10,2)
+    );
+'''
+
+def create_database(scale=None):
     # Connect to SQLite database (creates it if it doesn't exist)
-    conn = sqlite3.connect('joins_guide.db')
+    conn = loader.connect('joins_guide.db')
     cursor = conn.cursor()
     
     # Create basic tables
-    cursor.executescript('''
-        -- Basic tables for join examples
-        CREATE TABLE IF NOT EXISTS customers (
-            customer_id INTEGER PRIMARY KEY,
-            name VARCHAR(100),
-            email VARCHAR(100)
-        );
+    cursor.executescript(SCHEMA)
 
-        CREATE TABLE IF NOT EXISTS orders (
-            order_id INTEGER PRIMARY KEY,
-            customer_id INTEGER,
-            order_date DATE,
-            amount DECIMAL(10,2)
-        );
-        
-        -- Additional tables for advanced examples
-        CREATE TABLE IF NOT EXISTS employees (
-            emp_id INTEGER PRIMARY KEY,
-            name VARCHAR(100),
-            manager_id INTEGER
-        );
-        
-        CREATE TABLE IF NOT EXISTS products (
-            product_id INTEGER PRIMARY KEY,
-            product_name VARCHAR(100),
-            category VARCHAR(50)
-        );
-        
-        -- Tables for set operations
-        CREATE TABLE IF NOT EXISTS orders_2023 (
-            customer_id INTEGER,
-            amount DECIMAL(10,2)
-        );
-        
-        CREATE TABLE IF NOT EXISTS orders_2024 (
-            customer_id INTEGER,
-            amount DECIMAL(10,2)
-        );
-        
-        CREATE TABLE IF NOT EXISTS active_customers (
-            customer_id INTEGER PRIMARY KEY
-        );
-        
-        CREATE TABLE IF NOT EXISTS premium_members (
-            customer_id INTEGER PRIMARY KEY
-        );
-        
-        CREATE TABLE IF NOT EXISTS all_customers (
-            customer_id INTEGER PRIMARY KEY
-        );
-        
-        CREATE TABLE IF NOT EXISTS opted_out_customers (
-            customer_id INTEGER PRIMARY KEY
-        );
-        
-        CREATE TABLE IF NOT EXISTS north_sales (
-            amount DECIMAL(10,2)
-        );
-        
-        CREATE TABLE IF NOT EXISTS south_sales (
-            amount DECIMAL(10,2)
-        );
-    ''')
+    # Optionally fill the tables with generated data instead of the samples
+    if scale:
+        datagen.populate(conn, 'joins', scale)
+        return conn
 
     # Sample data insertion
     sample_data = {
@@ -96,11 +108,11 @@ def create_database():
         ]
     }
 
-    # Insert sample data
-    cursor.executemany('INSERT OR REPLACE INTO customers VALUES (?,?,?)', sample_data['customers'])
-    cursor.executemany('INSERT OR REPLACE INTO orders VALUES (?,?,?,?)', sample_data['orders'])
-    cursor.executemany('INSERT OR REPLACE INTO employees VALUES (?,?,?)', sample_data['employees'])
-    cursor.executemany('INSERT OR REPLACE INTO products VALUES (?,?,?)', sample_data['products'])
+    # Insert sample data, updating only rows that changed since the last run
+    loader.upsert(conn, 'customers', sample_data['customers'], ['customer_id'])
+    loader.upsert(conn, 'orders', sample_data['orders'], ['order_id'])
+    loader.upsert(conn, 'employees', sample_data['employees'], ['emp_id'])
+    loader.upsert(conn, 'products', sample_data['products'], ['product_id'])
 
     # Sample data for set operations
     set_operations_data = {
@@ -114,73 +126,84 @@ def create_database():
         'south_sales': [(800.00,), (900.00,)]
     }
 
+    # Tables without a key have nothing to upsert on, so they are only
+    # filled while empty; otherwise every run would add the rows again
     for table, data in set_operations_data.items():
-        if table in ['orders_2023', 'orders_2024']:
-            cursor.executemany(f'INSERT OR REPLACE INTO {table} VALUES (?,?)', data)
-        elif table in ['north_sales', 'south_sales']:
-            cursor.executemany(f'INSERT OR REPLACE INTO {table} VALUES (?)', data)
+        if table in ['orders_2023', 'orders_2024', 'north_sales', 'south_sales']:
+            if not cursor.execute(f'SELECT EXISTS (SELECT 1 FROM {table})').fetchone()[0]:
+                placeholders = ','.join('?' for _ in data[0])
+                cursor.executemany(f'INSERT INTO {table} VALUES ({placeholders})', data)
         else:
-            cursor.executemany(f'INSERT OR REPLACE INTO {table} VALUES (?)', data)
+            loader.upsert(conn, table, data, ['customer_id'])
 
     conn.commit()
     return conn
 
-def run_example_queries(conn):
-    cursor = conn.cursor()
-    
-    # Dictionary of example queries
-    example_queries = {
-        'INNER JOIN': '''
-            SELECT 
-                c.name,
-                o.order_id,
-                o.amount
-            FROM customers c
-            INNER JOIN orders o ON c.customer_id = o.customer_id
-        ''',
-        'LEFT JOIN': '''
-            SELECT 
-                c.name,
-                COUNT(o.order_id) as order_count
-            FROM customers c
-            LEFT JOIN orders o ON c.customer_id = o.customer_id
-            GROUP BY c.name
-        ''',
-        'CROSS JOIN': '''
-            SELECT 
-                c.name,
-                p.product_name
-            FROM customers c
-            CROSS JOIN products p
-            WHERE p.category = 'Electronics'
-        ''',
-        'SELF JOIN': '''
-            SELECT 
-                e1.name as employee,
-                e2.name as manager
-            FROM employees e1
-            LEFT JOIN employees e2 ON e1.manager_id = e2.emp_id
-        ''',
-        'UNION': '''
-            SELECT customer_id FROM orders_2023
-            UNION
-            SELECT customer_id FROM orders_2024
-        '''
-    }
+# Dictionary of example queries
+EXAMPLE_QUERIES = {
+    'INNER JOIN': '''
+        SELECT 
+            c.name,
+            o.order_id,
+            o.amount
+        FROM customers c
+        INNER JOIN orders o ON c.customer_id = o.customer_id
+    ''',
+    'LEFT JOIN': '''
+        SELECT 
+            c.name,
+            COUNT(o.order_id) as order_count
+        FROM customers c
+        LEFT JOIN orders o ON c.customer_id = o.customer_id
+        GROUP BY c.name
+    ''',
+    'CROSS JOIN': '''
+        SELECT 
+            c.name,
+            p.product_name
+        FROM customers c
+        CROSS JOIN products p
+        WHERE p.category = 'Electronics'
+    ''',
+    'SELF JOIN': '''
+        SELECT 
+            e1.name as employee,
+            e2.name as manager
+        FROM employees e1
+        LEFT JOIN employees e2 ON e1.manager_id = e2.emp_id
+    ''',
+    'UNION': '''
+        SELECT customer_id FROM orders_2023
+        UNION
+        SELECT customer_id FROM orders_2024
+    '''
+}
+
+def run_example_queries(conn, cache=None):
+    # With a warehouse.cache.QueryCache, unchanged results come from the cache
+    cursor = cache.cursor() if cache else conn.cursor()
     
     # Run and print results for each example query
     print("\nRunning example queries:")
-    for query_name, query in example_queries.items():
+    for query_name, query in EXAMPLE_QUERIES.items():
         print(f"\n{query_name} Example:")
         cursor.execute(query)
-        results = cursor.fetchall()
-        for row in results:
+        for row in stream.rows(cursor):
             print(row)
 
+def run_segment_examples(conn):
+    # INTERSECT and EXCEPT of the segment tables, evaluated on bitmaps
+    store = segments.SegmentStore(conn)
+    for expression in ['active_customers AND premium_members',
+                       'all_customers AND NOT opted_out_customers']:
+        print(f"\n{expression}:")
+        print(list(store.evaluate(expression)))
+
 def main():
     print("Creating database and sample data...")
     conn = create_database()
     run_example_queries(conn)
+    run_segment_examples(conn)
     print("\nDatabase 'joins_guide.db' has been created with all sample tables and data.")
     conn.close()
 
@@ -1,41 +1,57 @@
-import sqlite3
+import os
+import sys
 from datetime import datetime, date
 
-def create_database():
+# Make the shared warehouse package importable from the lesson folder
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from warehouse import datagen, hierarchy, loader, stream
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS employees (
+        emp_id INTEGER PRIMARY KEY,
+        name VARCHAR(50),
+        salary DECIMAL(10,2),
+        department_id INTEGER,
+        manager_id INTEGER,
+        hire_date DATE
+    );
+
+    CREATE TABLE IF NOT EXISTS departments (
+        dept_id INTEGER PRIMARY KEY,
+        dept_name VARCHAR(50),
+        location VARCHAR(50)
+    );
+
+    CREATE TABLE IF NOT EXISTS projects (
+        project_id INTEGER PRIMARY KEY,
+        project_name VARCHAR(50),
+        budget DECIMAL(10,2),
+        dept_id INTEGER
+    );
+
+    CREATE TABLE IF NOT EXISTS employee_projects (
+        emp_id INTEGER,
+        project_id INTEGER,
+        hours_worked DECIMAL(10,2)
+    );
+'''
+
+def create_database(scale=None):
     # Connect to SQLite database (creates it if it doesn't exist)
-    conn = sqlite3.connect('practice.db')
+    conn = loader.connect('practice.db')
     cursor = conn.cursor()
 
     # Create tables
-    cursor.executescript('''
-        CREATE TABLE IF NOT EXISTS employees (
-            emp_id INTEGER PRIMARY KEY,
-            name VARCHAR(50),
-            salary DECIMAL(10,2),
-            department_id INTEGER,
-            manager_id INTEGER,
-            hire_date DATE
-        );
-
-        CREATE TABLE IF NOT EXISTS departments (
-            dept_id INTEGER PRIMARY KEY,
-            dept_name VARCHAR(50),
-            location VARCHAR(50)
-        );
-
-        CREATE TABLE IF NOT EXISTS projects (
-            project_id INTEGER PRIMARY KEY,
-            project_name VARCHAR(50),
-            budget DECIMAL(10,2),
-            dept_id INTEGER
-        );
-
-        CREATE TABLE IF NOT EXISTS employee_projects (
-            emp_id INTEGER,
-            project_id INTEGER,
-            hours_worked DECIMAL(10,2)
-        );
-    ''')
+    cursor.executescript(SCHEMA)
+
+    # Optionally fill the tables with generated data instead of the samples
+    if scale:
+        # Refilling employees through the closure triggers of an earlier
+        # run costs a trigger per row; one rebuild afterwards is far cheaper
+        hierarchy.drop(conn)
+        datagen.populate(conn, 'tasks', scale)
+        hierarchy.install(conn)
+        return conn
 
     # Sample data
     departments_data = [
@@ -69,66 +85,61 @@ def create_database():
         (5, 4, 90.0)
     ]
 
-    # Insert sample data
-    cursor.executemany('INSERT OR REPLACE INTO departments VALUES (?,?,?)', departments_data)
-    cursor.executemany('INSERT OR REPLACE INTO employees VALUES (?,?,?,?,?,?)', employees_data)
-    cursor.executemany('INSERT OR REPLACE INTO projects VALUES (?,?,?,?)', projects_data)
-    cursor.executemany('INSERT OR REPLACE INTO employee_projects VALUES (?,?,?)', employee_projects_data)
+    # Insert sample data, updating only rows that changed since the last run
+    loader.upsert(conn, 'departments', departments_data, ['dept_id'])
+    loader.upsert(conn, 'employees', employees_data, ['emp_id'])
+    loader.upsert(conn, 'projects', projects_data, ['project_id'])
+    # employee_projects has no key to upsert on, so fill it only while empty
+    if not cursor.execute('SELECT EXISTS (SELECT 1 FROM employee_projects)').fetchone()[0]:
+        cursor.executemany('INSERT INTO employee_projects VALUES (?,?,?)', employee_projects_data)
+
+    # Closure table of the manager_id tree, kept current by triggers
+    hierarchy.install(conn)
 
     # Commit changes and close connection
     conn.commit()
     return conn
 
-def run_tasks(conn):
-    cursor = conn.cursor()
-    
+# Practice task queries in order: [(title, query), ...]
+TASKS = [
     # Task 1: Basic COUNT and NULL Handling
-    print("\nTask 1 - Employee Counts:")
-    cursor.execute('''
+    ("Task 1 - Employee Counts", '''
         SELECT 
             COUNT(*) as total_employees,
             COUNT(salary) as employees_with_salary
         FROM employees
-    ''')
-    print(cursor.fetchall())
+    '''),
 
     # Task 2: Simple Arithmetic and ROUND
-    print("\nTask 2 - Monthly Salaries:")
-    cursor.execute('''
+    ("Task 2 - Monthly Salaries", '''
         SELECT 
             name,
             ROUND(salary/12.0, 2) as monthly_salary
         FROM employees
-    ''')
-    print(cursor.fetchall())
+    '''),
 
     # Task 3: Basic JOIN and GROUP BY
-    print("\nTask 3 - Employees per Department:")
-    cursor.execute('''
+    ("Task 3 - Employees per Department", '''
         SELECT 
             d.dept_name,
             COUNT(e.emp_id) as employee_count
         FROM departments d
         LEFT JOIN employees e ON d.dept_id = e.department_id
         GROUP BY d.dept_name
-    ''')
-    print(cursor.fetchall())
+    '''),
 
     # Task 4: Multiple JOINs with NULL Handling
-    print("\nTask 4 - Project Employee Hours:")
-    cursor.execute('''
+    ("Task 4 - Project Employee Hours", '''
         SELECT 
             p.project_name,
             COALESCE(SUM(ep.hours_worked), 0) as total_hours
         FROM projects p
         LEFT JOIN employee_projects ep ON p.project_id = ep.project_id
         GROUP BY p.project_name
-    ''')
-    print(cursor.fetchall())
+    '''),
 
     # Task 5: Self Join with Aggregation
-    print("\nTask 5 - Manager Reports:")
-    cursor.execute('''
+    ("Task 5 - Manager Reports", '''
         SELECT 
             e1.name as employee,
             e2.name as manager,
@@ -137,14 +148,34 @@ def run_tasks(conn):
         LEFT JOIN employees e2 ON e1.manager_id = e2.emp_id
         LEFT JOIN employees e3 ON e2.emp_id = e3.manager_id
         GROUP BY e1.emp_id
-    ''')
-    print(cursor.fetchall())
+    '''),
 
     # Additional tasks can be added as needed
+]
+
+def run_tasks(conn, cache=None):
+    # With a warehouse.cache.QueryCache, unchanged results come from the cache
+    cursor = cache.cursor() if cache else conn.cursor()
+    
+    for title, query in TASKS:
+        print(f"\n{title}:")
+        cursor.execute(query)
+        stream.print_list(stream.rows(cursor))
+
+def run_hierarchy_examples(conn):
+    # Task 5 sees one level of the tree per self join; the closure table
+    # answers for every level at once
+    print("\nEveryone reporting to John Doe:")
+    stream.print_list(hierarchy.reports(conn, 1))
+    print("\nChain of command above Alice Brown:")
+    stream.print_list(hierarchy.chain_of_command(conn, 4))
+    print("\nSpan of control of John Doe:")
+    print(hierarchy.span_of_control(conn, 1))
     
 def main():
     conn = create_database()
     run_tasks(conn)
+    run_hierarchy_examples(conn)
     conn.close()
 
 if __name__ == "__main__":
@@ -1,13 +1,13 @@
-import sqlite3
+import os
+import sys
 from datetime import datetime
 
-def create_database():
-    # Connect to SQLite database (creates it if it doesn't exist)
-    conn = sqlite3.connect('string_manipulation.db')
-    cursor = conn.cursor()
-    
-    # Create tables
-    cursor.executescript('''
+# Make the shared warehouse package importable from the lesson folder
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from warehouse import cleanse, datagen, generated, loader, lookups, stream
+
+# Order status codes and their display text (order_statuses)
+SCHEMA = lookups.sql(lookups.ORDER_STATUSES) + '''
     -- Customers table
     CREATE TABLE IF NOT EXISTS customers (
         customer_id INTEGER PRIMARY KEY,
@@ -16,23 +16,41 @@ def create_database():
         email TEXT NOT NULL,
         phone TEXT
     );
-    
+
     -- Products table
     CREATE TABLE IF NOT EXISTS products (
         product_id INTEGER PRIMARY KEY,
         product_name TEXT NOT NULL,
         price REAL NOT NULL
     );
-    
+
     -- Orders table
     CREATE TABLE IF NOT EXISTS orders (
         order_id INTEGER PRIMARY KEY,
         customer_id INTEGER,
-        order_status TEXT NOT NULL,
+        status_code INTEGER NOT NULL REFERENCES order_statuses (status_code),
         order_date TEXT NOT NULL,
         FOREIGN KEY (customer_id) REFERENCES customers (customer_id)
     );
-    ''')
+'''
+
+def create_database(scale=None):
+    # Connect to SQLite database (creates it if it doesn't exist)
+    conn = loader.connect('string_manipulation.db')
+    cursor = conn.cursor()
+    
+    # Create tables
+    cursor.executescript(SCHEMA)
+    # Full name, email domain and area code as indexed generated columns
+    generated.install(conn, 'commands')
+    # Integer status codes, also in databases made when orders stored strings
+    lookups.install(conn, 'commands')
+    
+    # Optionally fill the tables with generated data instead of the samples
+    if scale:
+        datagen.populate(conn, 'commands', scale)
+        cleanse.cleanse_schema(conn, 'commands')
+        return conn
     
     # Sample data for customers
     customers_data = [
@@ -56,61 +74,67 @@ def create_database():
         (3, 3, 'Delivered', '2024-01-03')
     ]
     
-    # Insert sample data
-    cursor.executemany('INSERT OR REPLACE INTO customers VALUES (?, ?, ?, ?, ?)', customers_data)
-    cursor.executemany('INSERT OR REPLACE INTO products VALUES (?, ?, ?)', products_data)
-    cursor.executemany('INSERT OR REPLACE INTO orders VALUES (?, ?, ?, ?)', orders_data)
+    # Insert sample data, updating only rows that changed since the last run
+    loader.upsert(conn, 'customers', customers_data, ['customer_id'],
+                  columns=['customer_id', 'first_name', 'last_name', 'email', 'phone'])
+    loader.upsert(conn, 'products', products_data, ['product_id'])
+    loader.upsert(conn, 'orders', lookups.encode_rows(lookups.ORDER_STATUSES, orders_data, 2),
+                  ['order_id'], columns=['order_id', 'customer_id', 'status_code', 'order_date'])
     
-    # Commit changes and close connection
+    # Commit changes and keep the connection open for the examples
     conn.commit()
-    conn.close()
+    
+    # Store full names, area codes etc. of new or changed customers
+    cleanse.cleanse_schema(conn, 'commands')
+    return conn
 
-def demonstrate_string_operations():
-    conn = sqlite3.connect('string_manipulation.db')
+def demonstrate_string_operations(conn):
     cursor = conn.cursor()
     
     print("=== String Manipulation Examples ===\n")
     
     # Concatenation example
     print("1. Name Concatenation:")
+    # first_name || ' ' || last_name, a generated column
     cursor.execute('''
-        SELECT first_name || ' ' || last_name AS full_name 
+        SELECT full_name
         FROM customers
     ''')
-    for row in cursor.fetchall():
+    for row in stream.rows(cursor):
         print(f"  Full name: {row[0]}")
     
     # Substring position example
     print("\n2. Email @ Position:")
+    # instr(email, '@'), a generated column
     cursor.execute('''
-        SELECT email, instr(email, '@') AS at_position 
+        SELECT email, email_at AS at_position
         FROM customers
     ''')
-    for row in cursor.fetchall():
+    for row in stream.rows(cursor):
         print(f"  Email: {row[0]}, @ position: {row[1]}")
     
     # Substring extraction example
     print("\n3. Phone Area Codes:")
+    # substr(phone, 1, 3), a generated column
     cursor.execute('''
-        SELECT phone, substr(phone, 1, 3) AS area_code 
+        SELECT phone, area_code
         FROM customers
     ''')
-    for row in cursor.fetchall():
+    for row in stream.rows(cursor):
         print(f"  Phone: {row[0]}, Area Code: {row[1]}")
     
     # CASE expression example
     print("\n4. Order Status Text:")
+    # The status text comes from the order_statuses lookup table by code
+    # instead of a CASE over the status strings
     cursor.execute('''
-        SELECT order_id,
-               CASE order_status
-                   WHEN 'Pending' THEN 'Open'
-                   WHEN 'Shipping' THEN 'In Progress'
-                   WHEN 'Delivered' THEN 'Closed'
-                   ELSE 'Unknown'
-               END AS order_status_text
-        FROM orders
+        SELECT o.order_id,
+               COALESCE(s.status_text, 'Unknown') AS order_status_text
+        FROM orders AS o
+        LEFT JOIN order_statuses AS s USING (status_code)
+        ORDER BY o.order_id
     ''')
-    for row in cursor.fetchall():
+    for row in stream.rows(cursor):
         print(f"  Order ID: {row[0]}, Status: {row[1]}")
     
     # Product categorization example
@@ -125,14 +149,25 @@ def demonstrate_string_operations():
                END AS product_category
         FROM products
     ''')
-    for row in cursor.fetchall():
+    for row in stream.rows(cursor):
         print(f"  Product: {row[0]}, Category: {row[1]}")
     
-    conn.close()
+    # Filtering on a derived value
+    print("\n6. Customers in Area Code 234:")
+    # Rewritten to area_code = '234', which is looked up in the index on
+    # area_code instead of computing substr() for every customer
+    cursor = generated.query(conn, '''
+        SELECT full_name, phone
+        FROM customers
+        WHERE substr(phone, 1, 3) = '234'
+    ''', 'commands')
+    for row in stream.rows(cursor):
+        print(f"  Customer: {row[0]}, Phone: {row[1]}")
 
 if __name__ == '__main__':
     # Create the database and insert sample data
-    create_database()
+    conn = create_database()
     
-    # Run the demonstration
-    demonstrate_string_operations()
\ No newline at end of file
+    # Run the demonstration on the same connection
+    demonstrate_string_operations(conn)
+    conn.close()
\ No newline at end of file
@@ -1,81 +1,97 @@
-import sqlite3
+import os
 import random
+import sys
 from datetime import datetime, timedelta
 
-def create_database():
+# Make the shared warehouse package importable from the lesson folder
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from warehouse import cleanse, datagen, generated, loader, lookups, search, stream, tags
+
+# Order status codes and their display text (order_statuses)
+SCHEMA = lookups.sql(lookups.ORDER_STATUSES) + '''
+    CREATE TABLE IF NOT EXISTS customers (
+        customer_id INTEGER PRIMARY KEY,
+        first_name TEXT,
+        last_name TEXT,
+        email TEXT,
+        phone TEXT,
+        address TEXT
+    );
+    
+    CREATE TABLE IF NOT EXISTS products (
+        product_id INTEGER PRIMARY KEY,
+        product_name TEXT,
+        description TEXT,
+        product_code TEXT,
+        tags TEXT,
+        in_stock INTEGER
+    );
+    
+    CREATE TABLE IF NOT EXISTS orders (
+        order_id INTEGER PRIMARY KEY,
+        customer_id INTEGER,
+        status_code INTEGER REFERENCES order_statuses (status_code),
+        ship_method TEXT,
+        FOREIGN KEY (customer_id) REFERENCES customers (customer_id)
+    );
+'''
+
+def create_database(scale=None):
     # Connect to SQLite database (creates it if it doesn't exist)
-    conn = sqlite3.connect('text_manipulation_demo.db')
+    conn = loader.connect('text_manipulation_demo.db')
     cursor = conn.cursor()
     
-    # Create tables
-    cursor.executescript('''
-        DROP TABLE IF EXISTS customers;
-        DROP TABLE IF EXISTS products;
-        DROP TABLE IF EXISTS orders;
-        
-        CREATE TABLE customers (
-            customer_id INTEGER PRIMARY KEY,
-            first_name TEXT,
-            last_name TEXT,
-            email TEXT,
-            phone TEXT,
-            address TEXT
-        );
-        
-        CREATE TABLE products (
-            product_id INTEGER PRIMARY KEY,
-            product_name TEXT,
-            description TEXT,
-            product_code TEXT,
-            tags TEXT,
-            in_stock INTEGER
-        );
-        
-        CREATE TABLE orders (
-            order_id INTEGER PRIMARY KEY,
-            customer_id INTEGER,
-            order_status TEXT,
-            ship_method TEXT,
-            FOREIGN KEY (customer_id) REFERENCES customers (customer_id)
-        );
-    ''')
+    # Create tables (kept between runs; the samples below are upserted by id)
+    cursor.executescript(SCHEMA)
+    # Full-text index over the product text, kept in sync by triggers
+    search.create_index(conn)
+    # Tags split into a tag table and a product_tags bridge, also by triggers
+    tags.migrate(conn)
+    # Lower-case emails and email domains as indexed generated columns
+    generated.install(conn, 'text')
+    # Integer status codes, also in databases made when orders stored strings
+    lookups.install(conn, 'text')
+    
+    # Optionally fill the tables with generated data instead of the samples
+    if scale:
+        datagen.populate(conn, 'text', scale)
+        cleanse.cleanse_schema(conn, 'text')
+        return conn
     
     # Insert sample data
     sample_customers = [
-        ('John', 'Doe', 'john.DOE@example.com', '5551234567', '  123 Main St  '),
-        ('Jane', 'Smith', 'jane.SMITH@example.com', '5559876543', '  456 Oak Ave  '),
-        ('Bob', 'Johnson', 'bob.JOHNSON@example.com', '5554567890', '  789 Pine Rd  ')
+        (1, 'John', 'Doe', 'john.DOE@example.com', '5551234567', '  123 Main St  '),
+        (2, 'Jane', 'Smith', 'jane.SMITH@example.com', '5559876543', '  456 Oak Ave  '),
+        (3, 'Bob', 'Johnson', 'bob.JOHNSON@example.com', '5554567890', '  789 Pine Rd  ')
     ]
     
-    cursor.executemany('''
-        INSERT INTO customers (first_name, last_name, email, phone, address)
-        VALUES (?, ?, ?, ?, ?)
-    ''', sample_customers)
+    loader.upsert(conn, 'customers', sample_customers, ['customer_id'],
+                  columns=['customer_id', 'first_name', 'last_name', 'email', 'phone', 'address'])
     
     sample_products = [
-        ('Digital Camera Pro', 'High-end digital camera with 4K recording', 'CAM', 'camera,electronics,pro', 10),
-        ('Wide Angle Lens', 'Professional wide angle lens', 'LENS', 'lens,camera,accessories', 5),
-        ('Carbon Fiber Tripod', 'Lightweight tripod for stability', 'TRI', 'tripod,accessories', 0)
+        (1, 'Digital Camera Pro', 'High-end digital camera with 4K recording', 'CAM', 'camera,electronics,pro', 10),
+        (2, 'Wide Angle Lens', 'Professional wide angle lens', 'LENS', 'lens,camera,accessories', 5),
+        (3, 'Carbon Fiber Tripod', 'Lightweight tripod for stability', 'TRI', 'tripod,accessories', 0)
     ]
     
-    cursor.executemany('''
-        INSERT INTO products (product_name, description, product_code, tags, in_stock)
-        VALUES (?, ?, ?, ?, ?)
-    ''', sample_products)
+    loader.upsert(conn, 'products', sample_products, ['product_id'],
+                  columns=['product_id', 'product_name', 'description', 'product_code', 'tags', 'in_stock'])
     
     sample_orders = [
-        (1, 'Pending', 'FedEx'),
-        (2, 'Shipping', 'USPS'),
-        (3, 'Delivered', 'FedEx')
+        (1, 1, 'Pending', 'FedEx'),
+        (2, 2, 'Shipping', 'USPS'),
+        (3, 3, 'Delivered', 'FedEx')
     ]
     
-    cursor.executemany('''
-        INSERT INTO orders (customer_id, order_status, ship_method)
-        VALUES (?, ?, ?)
-    ''', sample_orders)
+    loader.upsert(conn, 'orders', lookups.encode_rows(lookups.ORDER_STATUSES, sample_orders, 2),
+                  ['order_id'], columns=['order_id', 'customer_id', 'status_code', 'ship_method'])
     
     # Commit changes
     conn.commit()
+    
+    # Store the cleaned-up names, addresses, emails and phones of new or
+    # changed customers, so the examples read them instead of computing them
+    cleanse.cleanse_schema(conn, 'text')
     return conn
 
 def demonstrate_text_manipulation(conn):
@@ -85,11 +101,12 @@ def demonstrate_text_manipulation(conn):
     
     # 1. Concatenating Text Columns
     print("Full Names using CONCAT:")
+    # first_name || ' ' || last_name, stored by warehouse.cleanse
     cursor.execute('''
-        SELECT first_name || ' ' || last_name AS full_name
+        SELECT full_name
         FROM customers;
     ''')
-    print(cursor.fetchall())
+    stream.print_list(stream.rows(cursor))
     
     # 2. Extracting Substrings
     print("\nFirst 5 characters of email:")
@@ -97,7 +114,7 @@ def demonstrate_text_manipulation(conn):
         SELECT SUBSTR(email, 1, 5) AS first_5_chars
         FROM customers;
     ''')
-    print(cursor.fetchall())
+    stream.print_list(stream.rows(cursor))
     
     # 3. Converting Text Case
     print("\nUppercase first names:")
@@ -105,37 +122,39 @@ def demonstrate_text_manipulation(conn):
         SELECT UPPER(first_name) AS uppercase_first_name
         FROM customers;
     ''')
-    print(cursor.fetchall())
+    stream.print_list(stream.rows(cursor))
     
     # 4. Trimming Whitespace
     print("\nTrimmed addresses:")
+    # TRIM(address), stored by warehouse.cleanse
     cursor.execute('''
-        SELECT TRIM(address) AS trimmed_address
+        SELECT trimmed_address
         FROM customers;
     ''')
-    print(cursor.fetchall())
+    stream.print_list(stream.rows(cursor))
     
     # 5. Replacing Text
     print("\nExtracting usernames from emails:")
+    # REPLACE(email, '@example.com', ''): the part before the @, stored
+    # by warehouse.cleanse
     cursor.execute('''
-        SELECT REPLACE(email, '@example.com', '') AS username
+        SELECT email_user AS username
         FROM customers;
     ''')
-    print(cursor.fetchall())
+    stream.print_list(stream.rows(cursor))
     
-    # 6. Using CASE Expression
+    # 6. Lookup Table Instead of a CASE Expression
     print("\nOrder status with friendly names:")
+    # The status text comes from the order_statuses lookup table by code
+    # instead of a CASE over the status strings
     cursor.execute('''
-        SELECT order_id,
-               CASE order_status
-                   WHEN 'Pending' THEN 'Open'
-                   WHEN 'Shipping' THEN 'In Progress'
-                   WHEN 'Delivered' THEN 'Closed'
-                   ELSE 'Unknown'
-               END AS order_status_text
-        FROM orders;
+        SELECT o.order_id,
+               COALESCE(s.status_text, 'Unknown') AS order_status_text
+        FROM orders AS o
+        LEFT JOIN order_statuses AS s USING (status_code)
+        ORDER BY o.order_id;
     ''')
-    print(cursor.fetchall())
+    stream.print_list(stream.rows(cursor))
     
     # 7. Product Categorization
     print("\nProduct categories based on name:")
@@ -149,29 +168,50 @@ def demonstrate_text_manipulation(conn):
                END AS product_category
         FROM products;
     ''')
-    print(cursor.fetchall())
+    stream.print_list(stream.rows(cursor))
     
     # 8. Formatting Phone Numbers
     print("\nFormatted phone numbers:")
+    # '(' || SUBSTR(phone, 1, 3) || ') ' || SUBSTR(phone, 4, 3) || '-' ||
+    # SUBSTR(phone, 7), stored by warehouse.cleanse
     cursor.execute('''
-        SELECT phone,
-               '(' || SUBSTR(phone, 1, 3) || ') ' ||
-               SUBSTR(phone, 4, 3) || '-' ||
-               SUBSTR(phone, 7) AS formatted_phone
+        SELECT phone, formatted_phone
         FROM customers;
     ''')
-    print(cursor.fetchall())
+    stream.print_list(stream.rows(cursor))
     
     # 9. Proper Case Names
     print("\nProper case names:")
+    # UPPER(SUBSTR(name, 1, 1)) || LOWER(SUBSTR(name, 2)), stored by
+    # warehouse.cleanse
     cursor.execute('''
-        SELECT UPPER(SUBSTR(first_name, 1, 1)) || 
-               LOWER(SUBSTR(first_name, 2)) AS proper_first_name,
-               UPPER(SUBSTR(last_name, 1, 1)) || 
-               LOWER(SUBSTR(last_name, 2)) AS proper_last_name
+        SELECT proper_first_name, proper_last_name
         FROM customers;
     ''')
-    print(cursor.fetchall())
+    stream.print_list(stream.rows(cursor))
+    
+    # 10. Full-Text Search
+    # LIKE '%Camera%' has to read every product name; the FTS5 index looks
+    # the word up directly and ranks the matches
+    print("\nProducts matching 'camera' (full-text index, best match first):")
+    stream.print_list((key, name) for key, name, _ in search.search(conn, 'camera'))
+
+    # 11. Tag Filtering
+    # Each tag's products as a compressed bitmap: AND/OR/NOT of tags are set
+    # operations in memory instead of LIKE on the packed tags string
+    print("\nProducts tagged 'accessories' but not 'camera' (tag bitmaps):")
+    print(list(tags.TagIndex(conn).query('accessories AND NOT camera')))
+    
+    # 12. Filtering on a Derived Value
+    # Rewritten to email_domain = 'example.com', an index lookup on the
+    # generated column instead of a LIKE over every email
+    print("\nCustomers with example.com emails (generated column index):")
+    cursor = generated.query(conn, '''
+        SELECT customer_id, email
+        FROM customers
+        WHERE email LIKE '%@example.com';
+    ''', 'text')
+    stream.print_list(stream.rows(cursor))
 
 def main():
     # Create database and insert sample data
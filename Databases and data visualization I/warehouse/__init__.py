@@ -0,0 +1,2 @@
+# Shared tooling for the course databases: data generation, loading and
+# benchmarking helpers used by the lesson scripts in the numbered folders.
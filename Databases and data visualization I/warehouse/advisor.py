@@ -0,0 +1,240 @@
+import argparse
+import os
+import re
+import tempfile
+from collections import namedtuple
+
+from warehouse import bench, datagen, lessons, loader
+
+# Proposed index: key columns first, then extra columns that make it covering
+IndexProposal = namedtuple('IndexProposal', ['table', 'columns', 'reason', 'queries'])
+
+# Wider indexes cost more to maintain than they save on reads
+MAX_INDEX_COLUMNS = 4
+
+SQL_KEYWORDS = {'on', 'where', 'left', 'right', 'inner', 'outer', 'cross', 'full', 'join',
+                'group', 'order', 'union', 'intersect', 'except', 'limit', 'having',
+                'natural', 'using', 'select'}
+
+TABLE_REF = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+COLUMN_REF = re.compile(r'\b(\w+)\.(\w+)\b')
+JOIN_PREDICATE = re.compile(r'\b(\w+)\.(\w+)\s*=\s*(\w+)\.(\w+)\b')
+GROUP_BY = re.compile(r'\bGROUP\s+BY\s+(.+?)(?=\bHAVING\b|\bORDER\s+BY\b|\bLIMIT\b|\)|$)',
+                      re.IGNORECASE | re.DOTALL)
+WHERE = re.compile(r'\bWHERE\s+(.+?)(?=\bGROUP\s+BY\b|\bORDER\s+BY\b|\bHAVING\b|\bLIMIT\b|\)|$)',
+                   re.IGNORECASE | re.DOTALL)
+# Filters an index can serve; IS NOT NULL and functions of a column cannot
+FILTER = re.compile(r'(?:\b(\w+)\.)?\b(\w+)\s*(?:=|<=|>=|<|>|\bIS\s+NULL\b|\bIN\b|\bBETWEEN\b)',
+                    re.IGNORECASE)
+COUNT_DISTINCT = re.compile(r'COUNT\s*\(\s*DISTINCT\s+(?:(\w+)\.)?(\w+)\s*\)', re.IGNORECASE)
+
+PLAN_SCAN = re.compile(r'^SCAN (\w+)(?: USING (?:COVERING )?INDEX (\w+))?')
+PLAN_AUTOMATIC = re.compile(r'^SEARCH (\w+) USING AUTOMATIC (?:PARTIAL )?(?:COVERING )?INDEX \((.*?)\)')
+
+def explain(conn, sql, params=()):
+    # EXPLAIN QUERY PLAN rows are (id, parent, notused, detail)
+    return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+
+def table_columns(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+def rowid_column(conn, table):
+    # An INTEGER PRIMARY KEY is the rowid and part of every index already
+    for _, name, type_, _, _, pk in conn.execute(f'PRAGMA table_info({table})'):
+        if pk == 1 and type_.upper() == 'INTEGER':
+            return name
+    return None
+
+def aliases(sql):
+    # {alias: table} for every table in FROM/JOIN clauses (a table is its own alias)
+    found = {}
+    for table, alias in TABLE_REF.findall(sql):
+        found[table] = table
+        if alias and alias.lower() not in SQL_KEYWORDS:
+            found[alias] = table
+    return found
+
+def single_table(sql):
+    # Only single-table queries may refer to their columns without an alias
+    return len(TABLE_REF.findall(sql)) == 1
+
+def _columns_for(conn, sql, alias, tables, fragment):
+    # Columns of `alias` referenced in fragment, qualified or (for single-table
+    # queries) bare
+    known = table_columns(conn, tables[alias])
+    columns = [col for a, col in COLUMN_REF.findall(fragment) if a == alias and col in known]
+    if single_table(sql):
+        words = re.findall(r'\b\w+\b', fragment)
+        columns += [w for w in words if w in known]
+    return list(dict.fromkeys(columns))
+
+def _proposal(conn, sql, alias, tables, keys, reason, name):
+    table = tables[alias]
+    rowid = rowid_column(conn, table)
+    keys = [c for c in keys if c != rowid]
+    if not keys:
+        return None
+    # Add the other columns the query reads so the index alone answers it
+    extra = [c for c in _columns_for(conn, sql, alias, tables, sql) if c not in keys and c != rowid]
+    columns = keys + extra if len(keys) + len(extra) <= MAX_INDEX_COLUMNS else keys
+    return IndexProposal(table, tuple(columns), reason, [name])
+
+def advise_query(conn, name, sql):
+    # Find plan steps that scan (or build a throwaway index on) join, filter or
+    # grouping keys and propose a permanent index for each
+    tables = aliases(sql)
+    plan = explain(conn, sql)
+    proposals = []
+    scanned = []
+    for detail in plan:
+        automatic = PLAN_AUTOMATIC.match(detail)
+        if automatic and automatic.group(1) in tables:
+            alias = automatic.group(1)
+            keys = [part.split('=')[0].strip() for part in automatic.group(2).split(' AND ')]
+            proposals.append(_proposal(conn, sql, alias, tables, keys,
+                                       'automatic index rebuilt on every run', name))
+            continue
+        scan = PLAN_SCAN.match(detail)
+        if not scan or scan.group(1) not in tables:
+            continue
+        alias = scan.group(1)
+        scanned.append(alias)
+        # An inner loop that scans is a nested-loop join without an index
+        if len(scanned) > 1:
+            keys = [col for a1, c1, a2, c2 in JOIN_PREDICATE.findall(sql)
+                    for a, col in ((a1, c1), (a2, c2)) if a == alias and a1 != a2]
+            if keys:
+                proposals.append(_proposal(conn, sql, alias, tables, keys[:1],
+                                           'full scan inside a join', name))
+                continue
+        if scan.group(2):
+            continue
+        where = WHERE.search(sql)
+        if where:
+            joins = {(a, c) for a1, c1, a2, c2 in JOIN_PREDICATE.findall(where.group(1))
+                     for a, c in ((a1, c1), (a2, c2))}
+            keys = [col for a, col in FILTER.findall(where.group(1))
+                    if (a == alias or (not a and single_table(sql)))
+                    and (a, col) not in joins
+                    and col in table_columns(conn, tables[alias])
+                    and not re.search(rf'\b{col}\s+IS\s+NOT\s+NULL', where.group(1), re.IGNORECASE)]
+            if keys:
+                proposals.append(_proposal(conn, sql, alias, tables, keys[:1],
+                                           'full scan to evaluate a filter', name))
+                continue
+        group_by = GROUP_BY.search(sql)
+        if group_by and any('TEMP B-TREE FOR GROUP BY' in d for d in plan) and len(scanned) == 1:
+            keys = _columns_for(conn, sql, alias, tables, group_by.group(1))
+            if keys:
+                proposals.append(_proposal(conn, sql, alias, tables, keys,
+                                           'sort for GROUP BY', name))
+                continue
+        distinct = COUNT_DISTINCT.search(sql)
+        if distinct and (distinct.group(1) in (None, '', alias)):
+            proposals.append(_proposal(conn, sql, alias, tables, [distinct.group(2)],
+                                       'sort for COUNT(DISTINCT)', name))
+    return [p for p in proposals if p]
+
+def index_name(proposal):
+    return f"idx_{proposal.table}_{'_'.join(proposal.columns)}"
+
+def create_sql(proposal):
+    return (f'CREATE INDEX IF NOT EXISTS {index_name(proposal)} '
+            f'ON {proposal.table} ({", ".join(proposal.columns)})')
+
+def merge(proposals):
+    # One index serves every query whose key columns are a prefix of it
+    merged = {}
+    for proposal in proposals:
+        key = (proposal.table, proposal.columns)
+        if key in merged:
+            merged[key].queries.extend(q for q in proposal.queries if q not in merged[key].queries)
+        else:
+            merged[key] = IndexProposal(proposal.table, proposal.columns, proposal.reason,
+                                        list(proposal.queries))
+    result = []
+    for key, proposal in merged.items():
+        wider = [other for other_key, other in merged.items()
+                 if other_key != key and other.table == proposal.table
+                 and other.columns[:len(proposal.columns)] == proposal.columns]
+        if wider:
+            wider[0].queries.extend(q for q in proposal.queries if q not in wider[0].queries)
+        else:
+            result.append(proposal)
+    return result
+
+def is_used(conn, proposal, queries):
+    # What-if check: create the index inside a transaction, see whether any
+    # of its queries picks it up, then roll back
+    conn.execute('BEGIN')
+    try:
+        conn.execute(create_sql(proposal))
+        name = index_name(proposal)
+        return any(name in detail for query_name, sql in queries
+                   if query_name in proposal.queries for detail in explain(conn, sql))
+    finally:
+        conn.rollback()
+
+def advise(conn, queries, verify=True):
+    proposals = []
+    for name, sql in queries:
+        proposals.extend(advise_query(conn, name, sql))
+    proposals = merge(proposals)
+    if verify:
+        proposals = [p for p in proposals if is_used(conn, p, queries)]
+    return proposals
+
+def apply(conn, proposals):
+    for proposal in proposals:
+        conn.execute(create_sql(proposal))
+    # Fresh statistics let the planner weigh the new indexes correctly
+    conn.execute('ANALYZE')
+    conn.commit()
+
+def compare_timings(conn, queries, proposals, runs):
+    before = {name: bench.time_query(conn, sql, runs) for name, sql in queries}
+    apply(conn, proposals)
+    after = {name: bench.time_query(conn, sql, runs) for name, sql in queries}
+    print(f"\n{'Query':<55} {'before':>12} {'after':>12} {'speedup':>9}")
+    for name, _ in queries:
+        old, new = before[name]['p50_ms'], after[name]['p50_ms']
+        speedup = old / new if new else float('inf')
+        print(f"{name[:55]:<55} {old:>9.2f} ms {new:>9.2f} ms {speedup:>8.1f}x")
+    return before, after
+
+def main():
+    parser = argparse.ArgumentParser(description='Propose indexes for the lesson example queries.')
+    parser.add_argument('--schemas', nargs='+', choices=lessons.QUERY_SETS, default=lessons.QUERY_SETS)
+    parser.add_argument('--scale', type=datagen.parse_scale, default=100000)
+    parser.add_argument('--data-dir', default=bench.DATA_DIR)
+    parser.add_argument('--apply', action='store_true',
+                        help='create the indexes on a copy of the database and re-benchmark the queries')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    for schema in args.schemas:
+        path = bench.database_for(schema, args.scale, args.data_dir)
+        # Work on a copy: loader.connect() would switch the shared database
+        # to WAL, the what-if checks need to write, and --apply's indexes
+        # and ANALYZE statistics would change what other benchmarks see.
+        # The original is only read.
+        with tempfile.TemporaryDirectory() as directory:
+            source = bench.open_read_only(path)
+            conn = loader.connect(os.path.join(directory, os.path.basename(path)))
+            source.backup(conn)
+            source.close()
+            queries = lessons.queries(schema)
+            proposals = advise(conn, queries)
+
+            print(f"\n=== {schema} ({args.scale:,}) ===")
+            if not proposals:
+                print("No missing indexes found.")
+            for proposal in proposals:
+                print(f"\n-- {proposal.reason}: {', '.join(proposal.queries)}")
+                print(create_sql(proposal) + ';')
+            if args.apply and proposals:
+                compare_timings(conn, queries, proposals, args.runs)
+            conn.close()
+
+if __name__ == '__main__':
+    main()
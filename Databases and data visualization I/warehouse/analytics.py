@@ -0,0 +1,273 @@
+import argparse
+from collections import namedtuple
+
+from warehouse import bench, datagen, loader, partition
+
+# A report written with window functions, and the same report as the
+# lessons would write it without them: a correlated subquery per row or a
+# join to a grouped copy of the table. Both return the same rows.
+Report = namedtuple('Report', ['name', 'window', 'naive'])
+
+# Each builder below takes table and column names and returns the window
+# and naive SQL of one kind of report. key is a unique column that breaks
+# ties so every row has one well-defined position.
+
+# PARTITION BY puts all NULLs in one partition and ORDER BY sorts them
+# first, but = and < are never true for a NULL. The naive versions compare
+# partitions with IS and order rows with after().
+
+def after(first, second, columns, or_same=False):
+    # True if row first sorts after row second by columns, ascending with
+    # NULLs first like ORDER BY. The last column must be unique and not NULL.
+    *columns, last = columns
+    sql = f"{first}.{last} {'>=' if or_same else '>'} {second}.{last}"
+    for column in reversed(columns):
+        a, b = f'{first}.{column}', f'{second}.{column}'
+        sql = f'({a} > {b} OR ({a} IS NOT NULL AND {b} IS NULL) OR ({a} IS {b} AND {sql}))'
+    return sql
+
+def running_total(name, table, value, partition, order, key):
+    # SUM(value) of the partition's rows up to and including this one
+    return Report(name, f'''
+        SELECT {key}, {partition}, {order}, {value},
+               SUM({value}) OVER (PARTITION BY {partition} ORDER BY {order}, {key}
+                                  ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW) AS running_total
+        FROM {table}
+        ORDER BY {partition}, {order}, {key}
+    ''', f'''
+        SELECT t.{key}, t.{partition}, t.{order}, t.{value},
+               (SELECT SUM(s.{value}) FROM {table} AS s
+                WHERE s.{partition} IS t.{partition} AND {after('t', 's', [order, key], True)}) AS running_total
+        FROM {table} AS t
+        ORDER BY t.{partition}, t.{order}, t.{key}
+    ''')
+
+def moving_average(name, table, value, partition, order, key, rows=3):
+    # AVG(value) of this row and the rows - 1 before it in the partition
+    return Report(name, f'''
+        SELECT {key}, {partition}, {order}, {value},
+               AVG({value}) OVER (PARTITION BY {partition} ORDER BY {order}, {key}
+                                  ROWS BETWEEN {rows - 1} PRECEDING AND CURRENT ROW) AS moving_average
+        FROM {table}
+        ORDER BY {partition}, {order}, {key}
+    ''', f'''
+        SELECT t.{key}, t.{partition}, t.{order}, t.{value},
+               (SELECT AVG({value}) FROM (
+                    SELECT s.{value} FROM {table} AS s
+                    WHERE s.{partition} IS t.{partition} AND {after('t', 's', [order, key], True)}
+                    ORDER BY s.{order} DESC, s.{key} DESC LIMIT {rows})) AS moving_average
+        FROM {table} AS t
+        ORDER BY t.{partition}, t.{order}, t.{key}
+    ''')
+
+# Rows ranked before a row s, for ORDER BY value DESC; ROW_NUMBER also
+# breaks ties by key
+BEFORE = {
+    'RANK': 'COUNT(*) FROM {table} AS s WHERE s.{partition} IS t.{partition} AND s.{value} > t.{value}',
+    'DENSE_RANK': 'COUNT(DISTINCT s.{value}) FROM {table} AS s '
+                  'WHERE s.{partition} IS t.{partition} AND s.{value} > t.{value}',
+    'ROW_NUMBER': 'COUNT(*) FROM {table} AS s WHERE s.{partition} IS t.{partition} '
+                  'AND (s.{value} > t.{value} OR (s.{value} = t.{value} AND s.{key} < t.{key}))',
+}
+
+def rank(name, table, value, partition, key, function='RANK'):
+    # Position of each row by value, highest first, within its partition.
+    # Rows without a value are left out.
+    before = BEFORE[function].format(table=table, value=value, partition=partition, key=key)
+    # RANK and DENSE_RANK give ties the same position
+    order = f'{value} DESC, {key}' if function == 'ROW_NUMBER' else f'{value} DESC'
+    return Report(name, f'''
+        SELECT {key}, {partition}, {value},
+               {function}() OVER (PARTITION BY {partition} ORDER BY {order}) AS position
+        FROM {table}
+        WHERE {value} IS NOT NULL
+        ORDER BY {partition}, position, {key}
+    ''', f'''
+        SELECT t.{key}, t.{partition}, t.{value}, 1 + (SELECT {before}) AS position
+        FROM {table} AS t
+        WHERE t.{value} IS NOT NULL
+        ORDER BY t.{partition}, position, t.{key}
+    ''')
+
+def top_n(name, table, value, partition, key, n=3):
+    # The n rows with the highest value of every partition
+    before = BEFORE['ROW_NUMBER'].format(table=table, value=value, partition=partition, key=key)
+    return Report(name, f'''
+        SELECT * FROM (
+            SELECT {key}, {partition}, {value},
+                   ROW_NUMBER() OVER (PARTITION BY {partition} ORDER BY {value} DESC, {key}) AS position
+            FROM {table}
+            WHERE {value} IS NOT NULL
+        )
+        WHERE position <= {n}
+        ORDER BY {partition}, position
+    ''', f'''
+        SELECT * FROM (
+            SELECT t.{key}, t.{partition}, t.{value}, 1 + (SELECT {before}) AS position
+            FROM {table} AS t
+            WHERE t.{value} IS NOT NULL
+        )
+        WHERE position <= {n}
+        ORDER BY {partition}, position
+    ''')
+
+def next_value(name, table, column, partition, key):
+    # The partition's next value of column after this row (LEAD)
+    return Report(name, f'''
+        SELECT {key}, {partition}, {column},
+               LEAD({column}) OVER (PARTITION BY {partition} ORDER BY {column}, {key}) AS next_{column}
+        FROM {table}
+        ORDER BY {partition}, {column}, {key}
+    ''', f'''
+        SELECT t.{key}, t.{partition}, t.{column},
+               (SELECT s.{column} FROM {table} AS s
+                WHERE s.{partition} IS t.{partition} AND {after('s', 't', [column, key])}
+                ORDER BY s.{column}, s.{key} LIMIT 1) AS next_{column}
+        FROM {table} AS t
+        ORDER BY t.{partition}, t.{column}, t.{key}
+    ''')
+
+def period_change(name, table, date, value, period='%Y-%m'):
+    # SUM(value) per period of date and the change from the period before
+    # (LAG). value '1' counts rows.
+    periods = f'''
+        WITH periods AS (
+            SELECT strftime('{period}', {date}) AS period, SUM({value}) AS total
+            FROM {table}
+            WHERE {date} IS NOT NULL
+            GROUP BY period
+        )'''
+    return Report(name, f'''{periods}
+        SELECT period, total, total - LAG(total) OVER (ORDER BY period) AS change
+        FROM periods
+        ORDER BY period
+    ''', f'''{periods}
+        SELECT p.period, p.total,
+               p.total - (SELECT q.total FROM periods AS q WHERE q.period < p.period
+                          ORDER BY q.period DESC LIMIT 1) AS change
+        FROM periods AS p
+        ORDER BY p.period
+    ''')
+
+def share_of_total(name, table, value, partition, key):
+    # Each row's value as a share of its partition's SUM(value)
+    return Report(name, f'''
+        SELECT {key}, {partition}, {value},
+               ROUND({value} * 1.0 / SUM({value}) OVER (PARTITION BY {partition}), 6) AS share
+        FROM {table}
+        WHERE {value} IS NOT NULL
+        ORDER BY {partition}, {key}
+    ''', f'''
+        SELECT t.{key}, t.{partition}, t.{value}, ROUND(t.{value} * 1.0 / totals.total, 6) AS share
+        FROM {table} AS t
+        JOIN (SELECT {partition}, SUM({value}) AS total FROM {table} GROUP BY {partition}) AS totals
+          ON totals.{partition} IS t.{partition}
+        WHERE t.{value} IS NOT NULL
+        ORDER BY t.{partition}, t.{key}
+    ''')
+
+# =====================================
+# Reports over the course schemas
+# =====================================
+REPORTS = {
+    'joins': [
+        running_total('Running revenue per customer', 'orders', 'amount', 'customer_id', 'order_date', 'order_id'),
+        moving_average('3-order moving average', 'orders', 'amount', 'customer_id', 'order_date', 'order_id'),
+        next_value('Next order date per customer', 'orders', 'order_date', 'customer_id', 'order_id'),
+        top_n('Top 3 orders per customer', 'orders', 'amount', 'customer_id', 'order_id'),
+        period_change('Month-over-month revenue', 'orders', 'order_date', 'amount'),
+    ],
+    'aggregation': [
+        rank('Salary rank within department', 'employees', 'salary', 'department', 'id'),
+        top_n('Top 3 salaries per department', 'employees', 'salary', 'department', 'id'),
+        share_of_total('Share of department payroll', 'employees', 'salary', 'department', 'id'),
+        period_change('Hires per month', 'employees', 'hire_date', '1'),
+    ],
+    'tasks': [
+        rank('Salary rank within department', 'employees', 'salary', 'department_id', 'emp_id'),
+        rank('Dense salary rank', 'employees', 'salary', 'department_id', 'emp_id', 'DENSE_RANK'),
+        running_total('Running hours per employee', 'employee_projects', 'hours_worked', 'emp_id',
+                      'project_id', 'rowid'),
+        share_of_total('Share of department payroll', 'employees', 'salary', 'department_id', 'emp_id'),
+    ],
+}
+
+# Indexes both versions can use: the partition, then the sort column
+INDEXES = {
+    'joins': [('idx_orders_customer_date', 'orders', 'customer_id, order_date'),
+              ('idx_orders_customer_amount', 'orders', 'customer_id, amount')],
+    'aggregation': [('idx_employees_department_salary', 'employees', 'department, salary')],
+    'tasks': [('idx_employees_department_id_salary', 'employees', 'department_id, salary'),
+              ('idx_employee_projects_emp_project', 'employee_projects', 'emp_id, project_id')],
+}
+
+def create_indexes(conn, schema):
+    # On the partitions of a table split by warehouse.partition. The caller
+    # commits or rolls back.
+    for name, table, columns in INDEXES[schema]:
+        partition.create_index(conn, name, table, columns)
+
+def _rounded(rows):
+    # A running SUM() adds in another order than a fresh one
+    return [tuple(round(v, 6) if isinstance(v, float) else v for v in row) for row in rows]
+
+def check(conn, report):
+    # True if both versions return the same rows
+    return _rounded(conn.execute(report.window).fetchall()) == _rounded(conn.execute(report.naive).fetchall())
+
+def compare(conn, schema, runs=3, max_seconds=60, verify=True):
+    # Time every report of a schema with and without window functions; a
+    # naive version slower than max_seconds is stopped. The indexes exist
+    # only inside a transaction that is rolled back afterwards, so the
+    # database (often a shared generated one) keeps its schema.
+    conn.execute('BEGIN')
+    try:
+        create_indexes(conn, schema)
+        print(f"{'Report':<34} {'window':>12} {'naive':>14} {'speedup':>9} {'agrees':>7}")
+        for report in REPORTS[schema]:
+            window = bench.time_query(conn, report.window, runs, max_seconds=max_seconds)
+            naive = bench.time_query(conn, report.naive, runs, max_seconds=max_seconds)
+            if naive.get('timed_out'):
+                agrees = '-'
+                naive_text = f"> {max_seconds * 1000:>8.0f} ms"
+                speedup = f"> {max_seconds * 1000 / window['p50_ms']:.0f}x"
+            else:
+                agrees = ('yes' if check(conn, report) else 'NO') if verify else '-'
+                naive_text = f"{naive['p50_ms']:>11.2f} ms"
+                speedup = f"{naive['p50_ms'] / window['p50_ms']:.1f}x"
+            print(f"{report.name:<34} {window['p50_ms']:>9.2f} ms {naive_text} {speedup:>9} {agrees:>7}")
+    finally:
+        conn.rollback()
+
+def main():
+    parser = argparse.ArgumentParser(description='Window-function reports against self-join/subquery versions.')
+    parser.add_argument('--schema', choices=REPORTS, default='joins')
+    parser.add_argument('--db', help='lesson database (default: generated at --scale)')
+    parser.add_argument('--scale', type=datagen.parse_scale, default=200000)
+    parser.add_argument('--data-dir', default=bench.DATA_DIR)
+    parser.add_argument('--report', help='print the rows of one report')
+    parser.add_argument('--sql', action='store_true', help='print the SQL of both versions of every report')
+    parser.add_argument('--max-seconds', type=float, default=60,
+                        help='stop a query after this long (default: 60)')
+    parser.add_argument('--no-verify', dest='verify', action='store_false',
+                        help='skip comparing the rows of both versions')
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.sql:
+        for report in REPORTS[args.schema]:
+            print(f"-- {report.name}, window functions{report.window};\n"
+                  f"-- {report.name}, without{report.naive};\n")
+        return
+    path = args.db or bench.database_for(args.schema, args.scale, args.data_dir)
+    conn = loader.connect(path)
+    if args.report:
+        report = {r.name: r for r in REPORTS[args.schema]}[args.report]
+        for row in conn.execute(f'SELECT * FROM ({report.window}) LIMIT 20'):
+            print(row)
+        return
+    compare(conn, args.schema, args.runs, args.max_seconds, args.verify)
+    conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+import argparse
+import math
+import re
+import time
+from collections import namedtuple
+from statistics import NormalDist
+
+from warehouse import bench, cache, datagen, loader
+from warehouse.sketch import HyperLogLog, TDigest
+
+# An approximate answer and its bounds at the requested confidence; rows
+# is the number of sample rows it was computed from (None for sketches of
+# the whole column)
+Estimate = namedtuple('Estimate', ['value', 'low', 'high', 'rows'])
+
+DEFAULT_CONFIDENCE = 0.95
+
+def _z(confidence):
+    return NormalDist().inv_cdf((1 + confidence) / 2)
+
+# =====================================
+# SQLite aggregate functions
+# =====================================
+class ApproxCountDistinct:
+    # approx_count_distinct(x): COUNT(DISTINCT x) from a HyperLogLog
+    def __init__(self):
+        self.sketch = HyperLogLog()
+
+    def step(self, value):
+        if value is not None:
+            self.sketch.add(value)
+
+    def finalize(self):
+        return self.sketch.count()
+
+class HllSketch(ApproxCountDistinct):
+    # hll_sketch(x): the HyperLogLog itself, to store or merge
+    def finalize(self):
+        return self.sketch.to_bytes()
+
+class HllMerge:
+    # hll_merge(sketch): union of the sketches of several groups
+    def __init__(self):
+        self.sketch = None
+
+    def step(self, data):
+        if data is not None:
+            sketch = HyperLogLog.from_bytes(data)
+            self.sketch = sketch if self.sketch is None else self.sketch.merge(sketch)
+
+    def finalize(self):
+        return None if self.sketch is None else self.sketch.to_bytes()
+
+class ApproxPercentile:
+    # approx_percentile(x, q): the q quantile of x (0.5 is the median) from
+    # a t-digest
+    def __init__(self):
+        self.digest = TDigest()
+        self.q = None
+
+    def step(self, value, q):
+        self.q = q
+        if value is not None:
+            self.digest.add(value)
+
+    def finalize(self):
+        return None if self.q is None else self.digest.quantile(self.q)
+
+def hll_count(data):
+    return None if data is None else HyperLogLog.from_bytes(data).count()
+
+def register(conn):
+    conn.create_aggregate('approx_count_distinct', 1, ApproxCountDistinct)
+    conn.create_aggregate('hll_sketch', 1, HllSketch)
+    conn.create_aggregate('hll_merge', 1, HllMerge)
+    conn.create_aggregate('approx_percentile', 2, ApproxPercentile)
+    conn.create_function('hll_count', 1, hll_count, deterministic=True)
+
+COUNT_DISTINCT = re.compile(r'\bCOUNT\s*\(\s*DISTINCT\s+([^()]+?)\s*\)', re.IGNORECASE)
+
+def approximate(sql):
+    # sql with COUNT(DISTINCT x) replaced by approx_count_distinct(x); needs
+    # register() on the connection that runs it. This bounds memory, not
+    # time: every row goes through Python, so it is many times slower than
+    # the exact query. Whole-column counts should use count_distinct().
+    return COUNT_DISTINCT.sub(r'approx_count_distinct(\1)', sql)
+
+# =====================================
+# Stored sketches
+# =====================================
+# HyperLogLogs of whole columns, rebuilt when their table was written to
+# since (warehouse.cache version counters). Distinct counts of a column, or
+# of the union of several, then only merge 16 KB sketches.
+SKETCH_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS approx_sketches (
+        table_name TEXT NOT NULL,
+        column_name TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        sketch BLOB NOT NULL,
+        PRIMARY KEY (table_name, column_name)
+    );
+'''
+
+def _version(conn, table):
+    if table not in cache.tracked_tables(conn):
+        cache.track(conn, table)
+        conn.commit()
+    return conn.execute('SELECT version FROM cache_table_versions WHERE table_name = ?', (table,)).fetchone()[0]
+
+def distinct_sketch(conn, table, column):
+    conn.executescript(SKETCH_SCHEMA)
+    version = _version(conn, table)
+    stored = conn.execute('SELECT version, sketch FROM approx_sketches WHERE table_name = ? AND column_name = ?',
+                          (table, column)).fetchone()
+    if stored is not None and stored[0] == version:
+        return HyperLogLog.from_bytes(stored[1])
+    sketch = HyperLogLog()
+    for (value,) in conn.execute(f'SELECT {column} FROM {table} WHERE {column} IS NOT NULL'):
+        sketch.add(value)
+    with loader.transaction(conn):
+        conn.execute('INSERT OR REPLACE INTO approx_sketches (table_name, column_name, version, sketch) '
+                     'VALUES (?, ?, ?, ?)', (table, column, version, sketch.to_bytes()))
+    return sketch
+
+def count_distinct(conn, columns, confidence=DEFAULT_CONFIDENCE):
+    # Distinct values in the union of [(table, column), ...]
+    sketch = None
+    for table, column in columns:
+        part = distinct_sketch(conn, table, column)
+        sketch = part if sketch is None else sketch.merge(part)
+    value = sketch.count()
+    margin = _z(confidence) * sketch.error * value
+    return Estimate(value, max(0, round(value - margin)), round(value + margin), None)
+
+# =====================================
+# Samples
+# =====================================
+# A random share of a table's rows, kept as a table of its own and rebuilt
+# like the sketches. SUM, AVG and COUNT of the sample scale up to the table
+# with bounds from the sample's variance.
+SAMPLE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS approx_samples (
+        table_name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL,
+        fraction REAL NOT NULL,
+        table_rows INTEGER NOT NULL,
+        sample_rows INTEGER NOT NULL
+    );
+'''
+
+DEFAULT_FRACTION = 0.01
+
+def sample_table(table):
+    return f'{table}_sample'
+
+def sample(conn, table, fraction=DEFAULT_FRACTION):
+    # (sample rows, table rows) of table's sample, built if missing, stale
+    # or of another fraction
+    conn.executescript(SAMPLE_SCHEMA)
+    version = _version(conn, table)
+    stored = conn.execute('SELECT version, fraction, sample_rows, table_rows FROM approx_samples '
+                          'WHERE table_name = ?', (table,)).fetchone()
+    if stored is not None and stored[:2] == (version, fraction):
+        return stored[2:]
+    name = sample_table(table)
+    with loader.transaction(conn):
+        conn.execute(f'DROP TABLE IF EXISTS {name}')
+        # Every row independently with probability fraction
+        conn.execute(f'CREATE TABLE {name} AS SELECT * FROM {table} '
+                     f'WHERE abs(random() % 1000000) < {round(fraction * 1000000)}')
+        sample_rows = conn.execute(f'SELECT COUNT(*) FROM {name}').fetchone()[0]
+        table_rows = conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        conn.execute('INSERT OR REPLACE INTO approx_samples (table_name, version, fraction, table_rows, '
+                     'sample_rows) VALUES (?, ?, ?, ?, ?)', (table, version, fraction, table_rows, sample_rows))
+    return sample_rows, table_rows
+
+def estimate(conn, table, function, expression='1', where=None, fraction=DEFAULT_FRACTION,
+             confidence=DEFAULT_CONFIDENCE):
+    # SUM, AVG or COUNT of expression over the rows of table matching where,
+    # from its sample. Rows where expression is NULL count as not matching.
+    n, total = sample(conn, table, fraction)
+    count, sum_x, sum_xx = conn.execute(f'''
+        SELECT COUNT(x), TOTAL(x), TOTAL(x * x)
+        FROM (SELECT {expression} AS x FROM {sample_table(table)} WHERE {where or 1})
+    ''').fetchone()
+    z = _z(confidence)
+    # Finite population correction: a sample of the whole table is exact
+    fpc = 1 - n / total if total else 0
+    function = function.upper()
+    if function == 'AVG':
+        if count == 0:
+            return Estimate(None, None, None, 0)
+        value = sum_x / count
+        variance = (sum_xx - sum_x * sum_x / count) / (count - 1) if count > 1 else 0.0
+        margin = z * math.sqrt(max(variance, 0.0) / count * fpc)
+    elif function in ('SUM', 'COUNT'):
+        if n == 0:
+            return Estimate(None, None, None, 0)
+        if function == 'COUNT':
+            # The count is the sum of 1 for every matching row
+            sum_x = sum_xx = count
+        # Non-matching sample rows add 0
+        mean = sum_x / n
+        variance = (sum_xx - sum_x * sum_x / n) / (n - 1) if n > 1 else 0.0
+        value = total * mean
+        margin = z * total * math.sqrt(max(variance, 0.0) / n * fpc)
+    else:
+        raise ValueError(f"Cannot estimate {function}; use SUM, AVG or COUNT")
+    return Estimate(value, value - margin, value + margin, count)
+
+def percentile(conn, table, column, q, where=None, fraction=DEFAULT_FRACTION, confidence=DEFAULT_CONFIDENCE):
+    # The q quantile of column from a t-digest of its sample. The bounds are
+    # the quantiles whose ranks lie z standard errors around q.
+    sample(conn, table, fraction)
+    digest = TDigest()
+    for (value,) in conn.execute(f'SELECT {column} FROM {sample_table(table)} '
+                                 f'WHERE {column} IS NOT NULL AND ({where or 1})'):
+        digest.add(value)
+    if not digest.total:
+        return Estimate(None, None, None, 0)
+    margin = _z(confidence) * math.sqrt(q * (1 - q) / digest.total)
+    return Estimate(digest.quantile(q), digest.quantile(q - margin), digest.quantile(q + margin), digest.total)
+
+def drop(conn):
+    conn.executescript(SAMPLE_SCHEMA)
+    for (table,) in conn.execute('SELECT table_name FROM approx_samples').fetchall():
+        conn.execute(f'DROP TABLE IF EXISTS {sample_table(table)}')
+    conn.execute('DROP TABLE IF EXISTS approx_samples')
+    conn.execute('DROP TABLE IF EXISTS approx_sketches')
+    conn.commit()
+
+# =====================================
+# Comparison against exact queries
+# =====================================
+# An exact query and the approximate way to answer it: 'sql' runs
+# approximate(exact) over the whole table, 'distinct' merges stored
+# sketches of args [(table, column), ...], 'percentile' and 'sum', 'avg',
+# 'count' use the sample with args like percentile() and estimate()
+Example = namedtuple('Example', ['name', 'exact', 'method', 'args'])
+
+EXAMPLES = {
+    'aggregation': [
+        Example('Distinct departments', 'SELECT COUNT(DISTINCT department) FROM employees', 'sql', ()),
+        Example('Distinct names', 'SELECT COUNT(DISTINCT name) FROM employees', 'distinct',
+                ([('employees', 'name')],)),
+        Example('Average salary', 'SELECT AVG(salary) FROM employees', 'avg', ('employees', 'salary')),
+        Example('Median salary', '''
+            SELECT salary FROM employees WHERE salary IS NOT NULL ORDER BY salary
+            LIMIT 1 OFFSET (SELECT COUNT(salary) / 2 FROM employees)
+        ''', 'percentile', ('employees', 'salary', 0.5)),
+        Example('Engineers hired since 2020', '''
+            SELECT COUNT(*) FROM employees WHERE department = 'Engineering' AND hire_date >= '2020-01-01'
+        ''', 'count', ('employees', '1', "department = 'Engineering' AND hire_date >= '2020-01-01'")),
+    ],
+    'joins': [
+        Example('Customers with orders', 'SELECT COUNT(DISTINCT customer_id) FROM orders', 'distinct',
+                ([('orders', 'customer_id')],)),
+        Example('Customers in 2023 or 2024', '''
+            SELECT COUNT(*) FROM (SELECT customer_id FROM orders_2023 UNION SELECT customer_id FROM orders_2024)
+        ''', 'distinct', ([('orders_2023', 'customer_id'), ('orders_2024', 'customer_id')],)),
+        Example('Revenue in 2024', "SELECT SUM(amount) FROM orders WHERE order_date >= '2024-01-01'",
+                'sum', ('orders', 'amount', "order_date >= '2024-01-01'")),
+        Example('Average order', 'SELECT AVG(amount) FROM orders', 'avg', ('orders', 'amount')),
+        Example('95th percentile order', '''
+            SELECT amount FROM orders WHERE amount IS NOT NULL ORDER BY amount
+            LIMIT 1 OFFSET (SELECT COUNT(amount) * 95 / 100 FROM orders)
+        ''', 'percentile', ('orders', 'amount', 0.95)),
+    ],
+}
+
+def answer(conn, example, fraction=DEFAULT_FRACTION, confidence=DEFAULT_CONFIDENCE):
+    if example.method == 'sql':
+        value = conn.execute(approximate(example.exact)).fetchone()[0]
+        margin = _z(confidence) * HyperLogLog().error * value
+        return Estimate(value, max(0, round(value - margin)), round(value + margin), None)
+    if example.method == 'distinct':
+        return count_distinct(conn, *example.args, confidence=confidence)
+    if example.method == 'percentile':
+        return percentile(conn, *example.args, fraction=fraction, confidence=confidence)
+    table, expression, *where = example.args
+    return estimate(conn, table, example.method, expression, *where, fraction=fraction, confidence=confidence)
+
+def _format(value):
+    if value is None:
+        return '-'
+    return f'{value:,.0f}' if abs(value) >= 1000 or float(value).is_integer() else f'{value:,.2f}'
+
+def compare(conn, schema, fraction=DEFAULT_FRACTION, confidence=DEFAULT_CONFIDENCE, runs=5):
+    # Build the sketches and samples, then time each example both ways
+    started = time.perf_counter()
+    for example in EXAMPLES[schema]:
+        answer(conn, example, fraction, confidence)
+    print(f"Sketches and samples ready in {time.perf_counter() - started:.2f}s\n")
+    print(f"{'Query':<28} {'exact':>12} {'approx':>12} {'speedup':>9} {'exact value':>14}  "
+          f"estimate ({confidence:.0%} bounds)")
+    for example in EXAMPLES[schema]:
+        exact = conn.execute(example.exact).fetchone()[0]
+        before = bench.time_query(conn, example.exact, runs)['p50_ms']
+        result = answer(conn, example, fraction, confidence)
+        after = bench.time_callable(lambda: answer(conn, example, fraction, confidence), runs, warmup=0)
+        inside = result.low is not None and exact is not None and result.low <= exact <= result.high
+        print(f"{example.name:<28} {bench.format_ms(before)} {bench.format_ms(after)} {bench.format_speedup(before, after)} "
+              f"{_format(exact):>14}  {_format(result.value)} [{_format(result.low)}, {_format(result.high)}]"
+              f"{'' if inside else ' (outside)'}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Approximate distinct counts, percentiles and sums.')
+    parser.add_argument('--schema', choices=EXAMPLES, default='joins')
+    parser.add_argument('--db', help='lesson database (default: generated at --scale)')
+    parser.add_argument('--scale', type=datagen.parse_scale, default=200000)
+    parser.add_argument('--data-dir', default=bench.DATA_DIR)
+    parser.add_argument('--query', help='run a query with COUNT(DISTINCT ...) approximated')
+    parser.add_argument('--fraction', type=float, default=DEFAULT_FRACTION, help='share of rows to sample')
+    parser.add_argument('--confidence', type=float, default=DEFAULT_CONFIDENCE)
+    parser.add_argument('--drop', action='store_true', help='remove the stored sketches and samples')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    path = args.db or bench.database_for(args.schema, args.scale, args.data_dir)
+    conn = loader.connect(path)
+    register(conn)
+    if args.drop:
+        drop(conn)
+        print("Dropped the stored sketches and samples.")
+    elif args.query:
+        for row in conn.execute(approximate(args.query)).fetchmany(20):
+            print(row)
+    else:
+        compare(conn, args.schema, args.fraction, args.confidence, args.runs)
+    conn.close()
+
+if __name__ == '__main__':
+    main()
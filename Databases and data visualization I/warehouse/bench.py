@@ -0,0 +1,243 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+from warehouse import datagen, lessons
+
+DEFAULT_SCALES = ['1k', '10k', '100k']
+# A query run slower than this ratio against the baseline counts as a regression
+REGRESSION_RATIO = 1.2
+
+# Where every tool keeps the generated databases, so each scale is made once
+DATA_DIR = 'bench_data'
+
+def percentile(values, pct):
+    # Linear interpolation between the closest ranks
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * pct / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def time_callable(function, runs, warmup=1):
+    # p50 in ms of runs calls of function, after warmup untimed calls
+    if runs < 1:
+        raise ValueError(f"runs must be at least 1, got {runs}")
+    for _ in range(warmup):
+        function()
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return percentile(timings, 50)
+
+# Cells of the before/after tables the tools print, 12, 9 and 7 wide
+def format_ms(ms, digits=2):
+    return f"{'-':>12}" if ms is None else f"{ms:>9.{digits}f} ms"
+
+def format_speedup(before, after):
+    return f"{before / after:>8.1f}x" if before is not None and after else f"{'-':>9}"
+
+def format_agrees(agrees):
+    return f"{'-' if agrees is None else 'yes' if agrees else 'NO':>7}"
+
+def _reset_peak_rss():
+    # Linux lets a process reset its high-water mark (VmHWM); elsewhere the
+    # peak is simply the maximum since the process started
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def peak_rss_kb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def _deadline_handler(deadline):
+    # Progress handler that aborts the running statement after the deadline
+    return lambda: 1 if time.perf_counter() > deadline else 0
+
+def positive_int(text):
+    # argparse type for --runs: the statistics need at least one timing
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return value
+
+def time_query(conn, sql, runs, warmup=1, max_seconds=None):
+    # Run sql warmup + runs times and return latency/throughput statistics
+    if runs < 1:
+        raise ValueError(f"runs must be at least 1, got {runs}")
+    cursor = conn.cursor()
+    timings = []
+    rows = 0
+    _reset_peak_rss()
+    for attempt in range(warmup + runs):
+        if max_seconds:
+            deadline = time.perf_counter() + max_seconds
+            conn.set_progress_handler(_deadline_handler(deadline), 10000)
+        started = time.perf_counter()
+        try:
+            cursor.execute(sql)
+            rows = len(cursor.fetchall())
+        except sqlite3.OperationalError as e:
+            if 'interrupted' not in str(e):
+                raise
+            conn.set_progress_handler(None, 0)
+            return {'runs': len(timings), 'timed_out': True, 'max_seconds': max_seconds}
+        elapsed = time.perf_counter() - started
+        if attempt >= warmup:
+            timings.append(elapsed)
+    conn.set_progress_handler(None, 0)
+
+    p50 = percentile(timings, 50)
+    return {
+        'runs': runs,
+        'rows': rows,
+        'p50_ms': round(p50 * 1000, 3),
+        'p95_ms': round(percentile(timings, 95) * 1000, 3),
+        'p99_ms': round(percentile(timings, 99) * 1000, 3),
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 3),
+        'rows_per_sec': round(rows / p50) if p50 else None,
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+def database_for(schema, scale, data_dir, workers=1, regenerate=False):
+    # Generated databases are deterministic, so they are reused between runs
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f'{schema}_{scale}.db')
+    if regenerate or not os.path.exists(path):
+        print(f"Generating {path}...")
+        if os.path.exists(path):
+            os.remove(path)
+        datagen.generate(path, schema, scale, workers)
+    return path
+
+def open_read_only(path):
+    # A connection that cannot change a shared generated database, not even
+    # its journal mode
+    return sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+
+def private_copy(path, tool):
+    # A copy of a generated database for a tool that adds tables, indexes or
+    # triggers to it, e.g. aggregation_100000_matview.db, so the file other
+    # runs reuse stays as generated. Made again when the original is newer.
+    root, extension = os.path.splitext(path)
+    copy = f'{root}_{tool}{extension}'
+    if not os.path.exists(copy) or os.path.getmtime(copy) < os.path.getmtime(path):
+        print(f"Copying {path} to {copy}...")
+        source, target = open_read_only(path), sqlite3.connect(copy + '.part')
+        try:
+            source.backup(target)
+        finally:
+            source.close()
+            target.close()
+        os.replace(copy + '.part', copy)
+    return copy
+
+def run_benchmarks(schemas, scales, runs, data_dir, workers=1, max_seconds=None,
+                   regenerate=False, connect=sqlite3.connect):
+    results = []
+    for scale in scales:
+        for schema in schemas:
+            path = database_for(schema, scale, data_dir, workers, regenerate)
+            conn = connect(path)
+            for name, sql in lessons.queries(schema):
+                stats = time_query(conn, sql, runs, max_seconds=max_seconds)
+                results.append({'schema': schema, 'scale': scale, 'query': name, **stats})
+                if stats.get('timed_out'):
+                    print(f"  {schema:<12} {scale:>10,}  {name[:50]:<50} timed out")
+                else:
+                    print(f"  {schema:<12} {scale:>10,}  {name[:50]:<50} "
+                          f"p50 {stats['p50_ms']:>10.2f} ms  p99 {stats['p99_ms']:>10.2f} ms")
+            conn.close()
+    return results
+
+def write_results(path, results, runs):
+    report = {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'runs': runs,
+        },
+        'results': results,
+    }
+    # Stable key order and indentation keep the files readable in a diff
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+def compare(baseline_path, current_path, ratio=REGRESSION_RATIO):
+    # Print queries whose p50 latency grew by more than `ratio`
+    def load(path):
+        with open(path) as f:
+            return {(r['schema'], r['scale'], r['query']): r for r in json.load(f)['results']}
+
+    baseline, current = load(baseline_path), load(current_path)
+    regressions = []
+    for key, result in sorted(current.items()):
+        before = baseline.get(key)
+        if not before or not before.get('p50_ms') or not result.get('p50_ms'):
+            continue
+        change = result['p50_ms'] / before['p50_ms']
+        marker = 'REGRESSION' if change > ratio else ''
+        print(f"  {key[0]:<12} {key[1]:>10,}  {key[2][:50]:<50} "
+              f"{before['p50_ms']:>10.2f} -> {result['p50_ms']:>10.2f} ms  x{change:.2f} {marker}")
+        if change > ratio:
+            regressions.append(key)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the lesson example queries across data scales.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run = subparsers.add_parser('run', help='time every example query')
+    run.add_argument('--schemas', nargs='+', choices=lessons.QUERY_SETS, default=lessons.QUERY_SETS)
+    run.add_argument('--scales', nargs='+', type=datagen.parse_scale,
+                     default=[datagen.parse_scale(s) for s in DEFAULT_SCALES])
+    run.add_argument('--runs', type=positive_int, default=10, help='timed runs per query')
+    run.add_argument('--data-dir', default=DATA_DIR, help='where generated databases are kept')
+    run.add_argument('--workers', type=int, default=1, help='processes used to generate data')
+    run.add_argument('--max-seconds', type=float, help='abort a single run after this many seconds')
+    run.add_argument('--regenerate', action='store_true', help='rebuild the databases')
+    run.add_argument('--output', default='bench_results.json')
+
+    diff = subparsers.add_parser('compare', help='compare two result files')
+    diff.add_argument('baseline')
+    diff.add_argument('current')
+    diff.add_argument('--ratio', type=float, default=REGRESSION_RATIO)
+
+    args = parser.parse_args()
+    if args.command == 'compare':
+        regressions = compare(args.baseline, args.current, args.ratio)
+        print(f"\n{len(regressions)} regression(s) found.")
+        sys.exit(1 if regressions else 0)
+
+    results = run_benchmarks(args.schemas, args.scales, args.runs, args.data_dir,
+                             args.workers, args.max_seconds, args.regenerate)
+    write_results(args.output, results, args.runs)
+    print(f"\nResults for {len(results)} queries written to {args.output}.")
+
+if __name__ == '__main__':
+    main()
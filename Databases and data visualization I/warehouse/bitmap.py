@@ -0,0 +1,229 @@
+import bisect
+import struct
+import sys
+from array import array
+
+# Compressed bitmap of non-negative integers in the style of Roaring bitmaps.
+# Values are split into chunks of 2**16 by their high bits. A chunk with few
+# values stores them as a sorted array of 16-bit integers; a dense chunk is
+# a 65536-bit Python int, so AND/OR/AND NOT of dense chunks run in C.
+
+CHUNK_BITS = 16
+CHUNK_SIZE = 1 << CHUNK_BITS
+LOW_MASK = CHUNK_SIZE - 1
+CHUNK_BYTES = CHUNK_SIZE // 8
+# Above this many values a bitset (8 KB) is smaller than an array (2 B/value)
+ARRAY_MAX = 4096
+
+# Set bit positions of every byte value, for turning bitsets into arrays
+BYTE_BITS = [tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+
+def _to_bits(values):
+    buffer = bytearray(CHUNK_BYTES)
+    for value in values:
+        buffer[value >> 3] |= 1 << (value & 7)
+    return int.from_bytes(buffer, 'little')
+
+def _to_array(bits):
+    data = bits.to_bytes(CHUNK_BYTES, 'little')
+    return array('H', [index * 8 + bit for index, byte in enumerate(data) if byte
+                       for bit in BYTE_BITS[byte]])
+
+def _count(container):
+    return container.bit_count() if isinstance(container, int) else len(container)
+
+def _compact(container):
+    # Store a chunk in whichever form is smaller; None if it is empty
+    if isinstance(container, int):
+        if not container:
+            return None
+        return _to_array(container) if container.bit_count() <= ARRAY_MAX else container
+    if not container:
+        return None
+    return _to_bits(container) if len(container) > ARRAY_MAX else container
+
+def _copy(container):
+    # Arrays are mutable; results must not share them with their operands
+    return container if isinstance(container, int) else array('H', container)
+
+def _filter(values, bits, keep):
+    # Values of an array container whose bit in bits is (keep) / is not set
+    data = bits.to_bytes(CHUNK_BYTES, 'little')
+    return array('H', [v for v in values if bool(data[v >> 3] >> (v & 7) & 1) == keep])
+
+def _and(a, b):
+    if isinstance(a, int) and isinstance(b, int):
+        return a & b
+    if isinstance(a, int):
+        a, b = b, a
+    if isinstance(b, int):
+        return _filter(a, b, True)
+    return array('H', sorted(set(a).intersection(b)))
+
+def _or(a, b):
+    if isinstance(a, int) and isinstance(b, int):
+        return a | b
+    if isinstance(a, int):
+        a, b = b, a
+    if isinstance(b, int):
+        return b | _to_bits(a)
+    return _compact(array('H', sorted(set(a).union(b))))
+
+def _andnot(a, b):
+    if isinstance(a, int):
+        return a & ~(b if isinstance(b, int) else _to_bits(b))
+    if isinstance(b, int):
+        return _filter(a, b, False)
+    return array('H', sorted(set(a).difference(b)))
+
+class Bitmap:
+    def __init__(self, values=()):
+        self.chunks = {}
+        grouped = {}
+        for value in values:
+            grouped.setdefault(value >> CHUNK_BITS, []).append(value & LOW_MASK)
+        for key, lows in grouped.items():
+            lows = sorted(set(lows))
+            self.chunks[key] = _to_bits(lows) if len(lows) > ARRAY_MAX else array('H', lows)
+
+    @classmethod
+    def _from_chunks(cls, chunks):
+        # Results of set operations keep the form the operation produced, as
+        # converting costs more than the operation; optimize() compacts them
+        bitmap = cls()
+        bitmap.chunks = {key: container for key, container in chunks.items() if _count(container)}
+        return bitmap
+
+    def optimize(self):
+        # Store every chunk in its smaller form, e.g. before keeping a result
+        self.chunks = {key: _compact(c) for key, c in self.chunks.items() if _count(c)}
+        return self
+
+    def add(self, value):
+        key, low = value >> CHUNK_BITS, value & LOW_MASK
+        container = self.chunks.get(key)
+        if container is None:
+            self.chunks[key] = array('H', [low])
+        elif isinstance(container, int):
+            self.chunks[key] = container | (1 << low)
+        else:
+            index = bisect.bisect_left(container, low)
+            if index == len(container) or container[index] != low:
+                container.insert(index, low)
+                if len(container) > ARRAY_MAX:
+                    self.chunks[key] = _to_bits(container)
+
+    def discard(self, value):
+        key, low = value >> CHUNK_BITS, value & LOW_MASK
+        container = self.chunks.get(key)
+        if container is None:
+            return
+        if isinstance(container, int):
+            container &= ~(1 << low)
+            # Halfway below the limit, so values near it do not flip back and forth
+            if container.bit_count() <= ARRAY_MAX // 2:
+                container = _to_array(container)
+        else:
+            index = bisect.bisect_left(container, low)
+            if index < len(container) and container[index] == low:
+                del container[index]
+        if _count(container):
+            self.chunks[key] = container
+        else:
+            del self.chunks[key]
+
+    def __contains__(self, value):
+        container = self.chunks.get(value >> CHUNK_BITS)
+        if container is None:
+            return False
+        low = value & LOW_MASK
+        if isinstance(container, int):
+            return bool(container >> low & 1)
+        index = bisect.bisect_left(container, low)
+        return index < len(container) and container[index] == low
+
+    def __len__(self):
+        return sum(_count(container) for container in self.chunks.values())
+
+    def chunk_counts(self):
+        # {high bits: values in the chunk}, without reading any container
+        return {key: _count(container) for key, container in self.chunks.items()}
+
+    def __bool__(self):
+        return bool(self.chunks)
+
+    def __iter__(self):
+        for key in sorted(self.chunks):
+            container = self.chunks[key]
+            base = key << CHUNK_BITS
+            lows = _to_array(container) if isinstance(container, int) else container
+            for low in lows:
+                yield base + low
+
+    def __and__(self, other):
+        return Bitmap._from_chunks({key: _and(container, other.chunks[key])
+                                    for key, container in self.chunks.items()
+                                    if key in other.chunks})
+
+    def __or__(self, other):
+        chunks = {key: _copy(container) for key, container in self.chunks.items()}
+        for key, container in other.chunks.items():
+            chunks[key] = _or(chunks[key], container) if key in chunks else _copy(container)
+        return Bitmap._from_chunks(chunks)
+
+    def __sub__(self, other):
+        return Bitmap._from_chunks({key: _andnot(container, other.chunks[key])
+                                    if key in other.chunks else _copy(container)
+                                    for key, container in self.chunks.items()})
+
+    def __eq__(self, other):
+        return isinstance(other, Bitmap) and list(self) == list(other)
+
+    def __repr__(self):
+        return f'Bitmap({len(self)} values, {self.nbytes:,} bytes)'
+
+    def copy(self):
+        bitmap = Bitmap()
+        bitmap.chunks = {key: _copy(container) for key, container in self.chunks.items()}
+        return bitmap
+
+    @property
+    def nbytes(self):
+        # Size of the containers in the serialized form
+        return sum(CHUNK_BYTES if isinstance(c, int) else 2 * len(c) for c in self.chunks.values())
+
+    def to_bytes(self):
+        # Per chunk: key, kind (0 = array, 1 = bitset), value count, data
+        parts = []
+        for key in sorted(self.chunks):
+            container = self.chunks[key]
+            if isinstance(container, int):
+                parts.append(struct.pack('<IBI', key, 1, container.bit_count()))
+                parts.append(container.to_bytes(CHUNK_BYTES, 'little'))
+            else:
+                data = array('H', container)
+                if sys.byteorder == 'big':
+                    data.byteswap()
+                parts.append(struct.pack('<IBI', key, 0, len(container)))
+                parts.append(data.tobytes())
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        bitmap = cls()
+        offset = 0
+        header = struct.calcsize('<IBI')
+        while offset < len(data):
+            key, kind, count = struct.unpack_from('<IBI', data, offset)
+            offset += header
+            if kind == 1:
+                bitmap.chunks[key] = int.from_bytes(data[offset:offset + CHUNK_BYTES], 'little')
+                offset += CHUNK_BYTES
+            else:
+                values = array('H')
+                values.frombytes(data[offset:offset + 2 * count])
+                if sys.byteorder == 'big':
+                    values.byteswap()
+                bitmap.chunks[key] = values
+                offset += 2 * count
+        return bitmap
@@ -0,0 +1,371 @@
+import argparse
+import hashlib
+import pickle
+import re
+import time
+from collections import OrderedDict, namedtuple
+
+from warehouse import datagen, lessons, loader, partition
+
+# Every write to a tracked table bumps its version; a cached result is valid
+# while the versions (and the schema) it was computed from are unchanged
+VERSION_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS cache_table_versions (
+        table_name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    );
+'''
+
+SPILL_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS query_cache (
+        key TEXT PRIMARY KEY,
+        tables BLOB NOT NULL,       -- pickled tuple of table names
+        snapshot BLOB NOT NULL,     -- pickled versions at caching time
+        rows BLOB NOT NULL,         -- pickled result rows
+        size INTEGER NOT NULL,
+        used_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_query_cache_used_at ON query_cache (used_at);
+'''
+
+DEFAULT_MAX_BYTES = 64 * 1024 ** 2
+DEFAULT_SPILL_BYTES = 1024 ** 3
+
+# Results of these functions change without any table changing
+VOLATILE_FUNCTIONS = {'random', 'randomblob', 'changes', 'total_changes', 'last_insert_rowid'}
+VOLATILE_SQL = re.compile(r"'now'|\bCURRENT_(?:DATE|TIME|TIMESTAMP)\b", re.IGNORECASE)
+# Opcodes that write, or read something whose changes cannot be tracked
+# (virtual tables). Temporary b-trees use OpenEphemeral and are fine.
+UNCACHEABLE_OPCODES = {'OpenWrite', 'VOpen', 'VUpdate'}
+READ_STATEMENTS = {'SELECT', 'WITH', 'VALUES'}
+
+Analysis = namedtuple('Analysis', ['tables', 'cacheable'])
+
+CacheEntry = namedtuple('CacheEntry', ['rows', 'description', 'tables', 'snapshot', 'size'])
+
+def normalize(sql):
+    # Whitespace and a trailing semicolon do not change what a query means
+    return ' '.join(sql.split()).rstrip(';').strip()
+
+def track(conn, table):
+    # Install the triggers that count writes to table, on its partitions
+    # if it is partitioned
+    conn.execute(VERSION_SCHEMA)
+    conn.execute('INSERT OR IGNORE INTO cache_table_versions (table_name) VALUES (?)', (table,))
+    for target in partition.physical_tables(conn, table):
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {partition.on_partition(f'cache_version_{table}_{event.lower()}', table, target)}
+                AFTER {event} ON {target}
+                BEGIN
+                    UPDATE cache_table_versions SET version = version + 1
+                    WHERE table_name = '{table}';
+                END
+            ''')
+    conn.commit()
+
+def untrack(conn):
+    # Remove every version trigger and the version table
+    triggers = conn.execute('''
+        SELECT name FROM sqlite_master
+        WHERE type = 'trigger' AND name LIKE 'cache\\_version\\_%' ESCAPE '\\'
+    ''').fetchall()
+    for (name,) in triggers:
+        conn.execute(f'DROP TRIGGER IF EXISTS "{name}"')
+    conn.execute('DROP TABLE IF EXISTS cache_table_versions')
+    conn.commit()
+
+def tracked_tables(conn):
+    triggers = conn.execute('''
+        SELECT DISTINCT tbl_name FROM sqlite_master
+        WHERE type = 'trigger' AND name LIKE 'cache\\_version\\_%' ESCAPE '\\'
+    ''').fetchall()
+    return {partition.parent_table(conn, name) for (name,) in triggers}
+
+class CachedCursor:
+    # Just enough of the sqlite3.Cursor interface for the lesson runners
+    def __init__(self, cache):
+        self.cache = cache
+        self.rows = []
+        self.position = 0
+        self.description = None
+
+    def execute(self, sql, params=()):
+        self.rows, self.description = self.cache.query(sql, params)
+        self.position = 0
+        return self
+
+    def fetchone(self):
+        if self.position >= len(self.rows):
+            return None
+        self.position += 1
+        return self.rows[self.position - 1]
+
+    def fetchmany(self, size=1):
+        chunk = self.rows[self.position:self.position + size]
+        self.position += len(chunk)
+        return chunk
+
+    def fetchall(self):
+        rest = self.rows[self.position:]
+        self.position = len(self.rows)
+        return rest
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+class QueryCache:
+    # LRU cache of query results for one connection. Entries are keyed by
+    # normalized SQL, parameters and database file, and checked against the
+    # per-table write counters on every hit. Evicted entries (and, on close,
+    # all entries) go to an optional SQLite spill file, which also makes the
+    # cache survive between runs.
+    def __init__(self, conn, max_bytes=DEFAULT_MAX_BYTES, spill_path=None,
+                 spill_bytes=DEFAULT_SPILL_BYTES):
+        self.conn = conn
+        self.max_bytes = max_bytes
+        self.spill_bytes = spill_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.analyses = {}
+        self.root_pages = None
+        conn.execute(VERSION_SCHEMA)
+        self.tracked = tracked_tables(conn)
+        self.database = conn.execute('PRAGMA database_list').fetchone()[2]
+        self.counts = {'hits': 0, 'spill_hits': 0, 'misses': 0, 'stale': 0, 'uncacheable': 0}
+        self.spill = None
+        if spill_path:
+            self.spill = loader.connect(spill_path)
+            self.spill.executescript(SPILL_SCHEMA)
+
+    def key(self, sql, params):
+        text = f'{self.database}\0{normalize(sql)}\0{params!r}'
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def _root_pages(self):
+        # {root page: table} so OpenRead opcodes can be traced to tables
+        schema_version = self.conn.execute('PRAGMA schema_version').fetchone()[0]
+        if self.root_pages is None or self.root_pages[0] != schema_version:
+            pages = dict(self.conn.execute('''
+                SELECT rootpage, tbl_name FROM sqlite_master WHERE rootpage > 0
+            '''))
+            self.root_pages = (schema_version, pages)
+            # A changed schema may also change which tables a query reads
+            self.analyses.clear()
+        return self.root_pages[1]
+
+    def analyze(self, sql, params=()):
+        # Read the compiled program: every table or index the query reads is
+        # opened with OpenRead. Views are already expanded at this point.
+        pages = self._root_pages()
+        normalized = normalize(sql)
+        if normalized in self.analyses:
+            return self.analyses[normalized]
+        if normalized.split(None, 1)[0].upper() not in READ_STATEMENTS:
+            return Analysis((), False)
+        try:
+            program = self.conn.execute('EXPLAIN ' + sql, params).fetchall()
+        except Exception:
+            return Analysis((), False)
+        tables = set()
+        cacheable = not VOLATILE_SQL.search(sql)
+        for _, opcode, _, p2, p3, p4, *_ in program:
+            if opcode in UNCACHEABLE_OPCODES:
+                cacheable = False
+            elif opcode == 'OpenRead':
+                # p3 is the database: 0 = main, 1 = temp, 2+ = attached
+                if p3 != 0:
+                    cacheable = False
+                elif p2 in pages:
+                    tables.add(pages[p2])
+            elif opcode in ('Function', 'PureFunc') and str(p4).split('(')[0] in VOLATILE_FUNCTIONS:
+                cacheable = False
+        analysis = Analysis(tuple(sorted(tables)), cacheable)
+        self.analyses[normalized] = analysis
+        return analysis
+
+    def snapshot(self, tables):
+        placeholders = ', '.join('?' for _ in tables)
+        versions = self.conn.execute(f'''
+            SELECT table_name, version FROM cache_table_versions
+            WHERE table_name IN ({placeholders})
+            UNION ALL
+            SELECT '', schema_version FROM pragma_schema_version
+        ''', tables).fetchall()
+        return tuple(sorted(versions))
+
+    def _valid(self, entry):
+        return self.snapshot(entry.tables) == entry.snapshot
+
+    def query(self, sql, params=()):
+        # Return (rows, description) from the cache or the database
+        key = self.key(sql, params)
+        entry = self.entries.get(key)
+        if entry is not None:
+            if self._valid(entry):
+                self.entries.move_to_end(key)
+                self.counts['hits'] += 1
+                return list(entry.rows), entry.description
+            self._forget(key)
+            self.counts['stale'] += 1
+        entry = self._load_spilled(key)
+        if entry is not None:
+            self.counts['spill_hits'] += 1
+            self._remember(key, entry)
+            return list(entry.rows), entry.description
+
+        analysis = self.analyze(sql, params)
+        # Uncommitted writes may still be rolled back, taking their version
+        # bumps with them, so nothing read inside a transaction is cached
+        if not analysis.cacheable or self.conn.in_transaction:
+            self.counts['uncacheable'] += 1
+            cursor = self.conn.execute(sql, params)
+            return cursor.fetchall(), cursor.description
+        self._track([t for t in analysis.tables if t not in self.tracked])
+
+        self.counts['misses'] += 1
+        before = self.snapshot(analysis.tables)
+        cursor = self.conn.execute(sql, params)
+        rows = cursor.fetchall()
+        # Another connection may have committed while the query ran
+        if self.snapshot(analysis.tables) == before:
+            size = len(pickle.dumps(rows, pickle.HIGHEST_PROTOCOL))
+            self._remember(key, CacheEntry(rows, cursor.description, analysis.tables, before, size))
+        return list(rows), cursor.description
+
+    def _track(self, tables):
+        if not tables:
+            return
+        old = ('', self.conn.execute('PRAGMA schema_version').fetchone()[0])
+        for table in tables:
+            track(self.conn, table)
+            self.tracked.add(table)
+        new = ('', self.conn.execute('PRAGMA schema_version').fetchone()[0])
+        # Adding our own triggers changes the schema but no result, so the
+        # entries cached so far stay valid
+        for key, entry in self.entries.items():
+            snapshot = tuple(sorted(new if item == old else item for item in entry.snapshot))
+            self.entries[key] = entry._replace(snapshot=snapshot)
+
+    def cursor(self):
+        return CachedCursor(self)
+
+    def _remember(self, key, entry):
+        if entry.size > self.max_bytes:
+            self._spill(key, entry)
+            return
+        self.entries[key] = entry
+        self.bytes += entry.size
+        while self.bytes > self.max_bytes:
+            old_key, old_entry = self.entries.popitem(last=False)
+            self.bytes -= old_entry.size
+            self._spill(old_key, old_entry)
+
+    def _forget(self, key):
+        entry = self.entries.pop(key)
+        self.bytes -= entry.size
+
+    def _spill(self, key, entry):
+        if self.spill is None or entry.size > self.spill_bytes:
+            return
+        dump = lambda value: pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        self.spill.execute('''
+            INSERT OR REPLACE INTO query_cache (key, tables, snapshot, rows, size, used_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (key, dump(entry.tables), dump((entry.snapshot, entry.description)),
+              dump(entry.rows), entry.size, time.time()))
+        total = self.spill.execute('SELECT TOTAL(size) FROM query_cache').fetchone()[0]
+        if total > self.spill_bytes:
+            # Drop the least recently used entries until the file fits again
+            self.spill.execute('''
+                DELETE FROM query_cache WHERE key IN (
+                    SELECT key FROM (
+                        SELECT key, SUM(size) OVER (ORDER BY used_at DESC) AS kept
+                        FROM query_cache
+                    ) WHERE kept > ?
+                )
+            ''', (self.spill_bytes,))
+        self.spill.commit()
+
+    def _load_spilled(self, key):
+        if self.spill is None:
+            return None
+        row = self.spill.execute('SELECT tables, snapshot, rows, size FROM query_cache WHERE key = ?',
+                                 (key,)).fetchone()
+        if row is None:
+            return None
+        tables = pickle.loads(row[0])
+        snapshot, description = pickle.loads(row[1])
+        if self.snapshot(tables) != snapshot:
+            self.spill.execute('DELETE FROM query_cache WHERE key = ?', (key,))
+            self.spill.commit()
+            self.counts['stale'] += 1
+            return None
+        self.spill.execute('DELETE FROM query_cache WHERE key = ?', (key,))
+        self.spill.commit()
+        return CacheEntry(pickle.loads(row[2]), description, tables, snapshot, row[3])
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+        if self.spill is not None:
+            self.spill.execute('DELETE FROM query_cache')
+            self.spill.commit()
+
+    def stats(self):
+        return {**self.counts, 'entries': len(self.entries), 'bytes': self.bytes}
+
+    def close(self):
+        # Keep the in-memory entries for the next run
+        if self.spill is not None:
+            for key, entry in self.entries.items():
+                self._spill(key, entry)
+            self.spill.close()
+            self.spill = None
+        self.entries.clear()
+        self.bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def time_pass(cache, queries):
+    started = time.perf_counter()
+    for _, sql in queries:
+        cache.query(sql)
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the lesson queries through the result cache.')
+    parser.add_argument('--schema', choices=lessons.QUERY_SETS, default='aggregation')
+    parser.add_argument('--db', required=True, help='lesson or generated database')
+    parser.add_argument('--spill', help='SQLite file that keeps results between runs')
+    parser.add_argument('--max-bytes', type=datagen.parse_scale, default=DEFAULT_MAX_BYTES,
+                        help='in-memory limit, e.g. 64M')
+    parser.add_argument('--passes', type=int, default=3)
+    parser.add_argument('--untrack', action='store_true',
+                        help='remove the version triggers from the database and exit')
+    args = parser.parse_args()
+
+    conn = loader.connect(args.db)
+    if args.untrack:
+        untrack(conn)
+        print(f"Removed the cache triggers from {args.db}.")
+        return
+
+    queries = lessons.queries(args.schema)
+    with QueryCache(conn, args.max_bytes, args.spill) as cache:
+        for number in range(1, args.passes + 1):
+            seconds = time_pass(cache, queries)
+            print(f"Pass {number}: {len(queries)} queries in {seconds * 1000:.2f} ms")
+        print(', '.join(f'{name}={value:,}' for name, value in cache.stats().items()))
+    conn.close()
+
+if __name__ == '__main__':
+    main()
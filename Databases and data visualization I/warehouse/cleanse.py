@@ -0,0 +1,220 @@
+import argparse
+import re
+import time
+from collections import namedtuple
+
+from warehouse import bench, datagen, loader
+
+# A column computed in Python from other columns of the same row and stored,
+# so the text functions run once per write instead of on every read.
+# function takes one list per source column and returns the new column.
+Derived = namedtuple('Derived', ['column', 'type', 'sources', 'function'])
+
+# Rows read, cleansed and written back per transaction
+BATCH_SIZE = 10000
+
+# Set by insert, and by triggers when a source column changes; cleared once
+# the derived columns are filled
+FLAG = 'needs_cleansing'
+
+NON_DIGITS = re.compile(r'\D')
+
+# Each transform works on whole columns: one list comprehension per batch
+# instead of a SQL function call per row and read. NULL stays NULL.
+def _each(function):
+    def transform(values):
+        return [None if value is None else function(value) for value in values]
+    return transform
+
+def full_name(first_names, last_names):
+    # first_name || ' ' || last_name
+    return [None if first is None or last is None else f'{first} {last}'
+            for first, last in zip(first_names, last_names)]
+
+# UPPER(SUBSTR(x, 1, 1)) || LOWER(SUBSTR(x, 2)); unlike SQLite's, Python's
+# upper() and lower() also handle non-ASCII letters
+proper_case = _each(lambda text: text[:1].upper() + text[1:].lower())
+
+# TRIM(x) removes spaces only, not tabs or newlines
+trim = _each(lambda text: text.strip(' '))
+
+# Everything before the last '@'; the text itself when there is none
+email_user = _each(lambda email: email.rpartition('@')[0] if '@' in email else email)
+
+def _digits(phone):
+    return NON_DIGITS.sub('', phone)
+
+def _format_phone(phone):
+    # (555) 123-4567 from '5551234567' or '555-123-4567'; anything that is
+    # not ten digits is kept as entered
+    digits = _digits(phone)
+    if len(digits) != 10:
+        return phone
+    return f'({digits[:3]}) {digits[3:6]}-{digits[6:]}'
+
+formatted_phone = _each(_format_phone)
+area_code = _each(lambda phone: _digits(phone)[:3] or None)
+
+# Derived columns per lesson schema and table, named after the aliases the
+# lessons used for the same expressions
+CLEANSING = {
+    'text': {
+        'customers': [
+            Derived('full_name', 'TEXT', ('first_name', 'last_name'), full_name),
+            Derived('proper_first_name', 'TEXT', ('first_name',), proper_case),
+            Derived('proper_last_name', 'TEXT', ('last_name',), proper_case),
+            Derived('trimmed_address', 'TEXT', ('address',), trim),
+            Derived('email_user', 'TEXT', ('email',), email_user),
+            Derived('formatted_phone', 'TEXT', ('phone',), formatted_phone),
+            Derived('area_code', 'TEXT', ('phone',), area_code),
+        ],
+    },
+    # full_name and area_code are generated columns here (warehouse.generated)
+    'commands': {
+        'customers': [
+            Derived('email_user', 'TEXT', ('email',), email_user),
+            Derived('formatted_phone', 'TEXT', ('phone',), formatted_phone),
+        ],
+    },
+}
+
+def _sources(derived):
+    return sorted({source for d in derived for source in d.sources})
+
+def install(conn, table, derived):
+    # Add the derived columns, the flag and the trigger that sets it when a
+    # source column changes; safe to re-run. Returns the columns added.
+    existing = set(loader.table_columns(conn, table))
+    added = [d.column for d in derived if d.column not in existing]
+    for d in derived:
+        if d.column not in existing:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {d.column} {d.type}')
+    if FLAG not in existing:
+        # New rows need cleansing; existing rows too, as their columns are empty
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {FLAG} INTEGER NOT NULL DEFAULT 1')
+    conn.executescript(f'''
+        CREATE INDEX IF NOT EXISTS idx_{table}_{FLAG} ON {table} ({FLAG}) WHERE {FLAG} = 1;
+
+        CREATE TRIGGER IF NOT EXISTS {table}_{FLAG} AFTER UPDATE OF {", ".join(_sources(derived))}
+        ON {table} BEGIN
+            UPDATE {table} SET {FLAG} = 1 WHERE rowid = new.rowid;
+        END;
+    ''')
+    return added
+
+def uninstall(conn, table, derived):
+    conn.executescript(f'''
+        DROP TRIGGER IF EXISTS {table}_{FLAG};
+        DROP INDEX IF EXISTS idx_{table}_{FLAG};
+    ''')
+    existing = set(loader.table_columns(conn, table))
+    for column in [d.column for d in derived] + [FLAG]:
+        if column in existing:
+            conn.execute(f'ALTER TABLE {table} DROP COLUMN {column}')
+
+def cleanse(conn, table, derived, batch_size=BATCH_SIZE):
+    # Fill the derived columns of every flagged row and return how many
+    # rows were cleansed. Each batch is read, transformed column by column
+    # and written back in one transaction.
+    sources = _sources(derived)
+    assignments = ', '.join(f'{d.column} = ?' for d in derived)
+    select = (f'SELECT rowid, {", ".join(sources)} FROM {table} '
+              f'WHERE {FLAG} = 1 AND rowid > ? ORDER BY rowid LIMIT ?')
+    update = f'UPDATE {table} SET {assignments}, {FLAG} = 0 WHERE rowid = ?'
+    last = -(2 ** 63)
+    cleansed = 0
+    while True:
+        rows = conn.execute(select, (last, batch_size)).fetchall()
+        if not rows:
+            return cleansed
+        rowids, *values = zip(*rows)
+        columns = dict(zip(sources, values))
+        results = [d.function(*(columns[source] for source in d.sources)) for d in derived]
+        with loader.transaction(conn):
+            conn.executemany(update, zip(*results, rowids))
+        cleansed += len(rows)
+        last = rowids[-1]
+
+def cleanse_schema(conn, schema):
+    # Install and run the cleansing of every table of a lesson schema;
+    # returns {table: rows cleansed}
+    counts = {}
+    for table, derived in CLEANSING[schema].items():
+        install(conn, table, derived)
+        counts[table] = cleanse(conn, table, derived)
+    return counts
+
+# The expressions the derived columns replace, as the lessons computed them
+# on every read
+COMPARISONS = {
+    'text': [
+        ('Full names',
+         "SELECT first_name || ' ' || last_name FROM customers",
+         'SELECT full_name FROM customers'),
+        ('Proper case names',
+         'SELECT UPPER(SUBSTR(first_name, 1, 1)) || LOWER(SUBSTR(first_name, 2)), '
+         'UPPER(SUBSTR(last_name, 1, 1)) || LOWER(SUBSTR(last_name, 2)) FROM customers',
+         'SELECT proper_first_name, proper_last_name FROM customers'),
+        ('Trimmed addresses',
+         'SELECT TRIM(address) FROM customers',
+         'SELECT trimmed_address FROM customers'),
+        ('Formatted phones',
+         "SELECT phone, '(' || SUBSTR(phone, 1, 3) || ') ' || SUBSTR(phone, 4, 3) || '-' || "
+         "SUBSTR(phone, 7) FROM customers",
+         'SELECT phone, formatted_phone FROM customers'),
+        ('Email users',
+         "SELECT REPLACE(email, '@example.com', '') FROM customers",
+         'SELECT email_user FROM customers'),
+    ],
+    'commands': [
+        ('Email users',
+         "SELECT substr(email, 1, instr(email, '@') - 1) FROM customers",
+         'SELECT email_user FROM customers'),
+        ('Formatted phones',
+         "SELECT '(' || substr(phone, 1, 3) || ') ' || substr(phone, 5, 3) || '-' || "
+         "substr(phone, 9) FROM customers",
+         'SELECT formatted_phone FROM customers'),
+    ],
+}
+
+def compare(conn, schema, runs=5):
+    # Time the per-read expressions against the stored columns and check
+    # that both give the same values
+    print(f"{'Query':<22} {'expression':>13} {'column':>12} {'speedup':>9} {'agrees':>7}")
+    for name, expression, column in COMPARISONS[schema]:
+        agrees = conn.execute(expression).fetchall() == conn.execute(column).fetchall()
+        before = bench.time_query(conn, expression, runs)['p50_ms']
+        after = bench.time_query(conn, column, runs)['p50_ms']
+        print(f"{name:<22} {before:>10.2f} ms {after:>9.2f} ms {before / after:>8.1f}x "
+              f"{'yes' if agrees else 'NO':>7}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Store cleansed text columns computed in Python.')
+    parser.add_argument('--schema', choices=CLEANSING, default='text')
+    parser.add_argument('--db', help='lesson database (default: generated at --scale)')
+    parser.add_argument('--scale', type=datagen.parse_scale, default=200000)
+    parser.add_argument('--data-dir', default=bench.DATA_DIR)
+    parser.add_argument('--drop', action='store_true', help='remove the derived columns')
+    parser.add_argument('--compare', action='store_true',
+                        help='time the SQL expressions against the stored columns')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    path = args.db or bench.database_for(args.schema, args.scale, args.data_dir)
+    conn = loader.connect(path)
+    if args.drop:
+        for table, derived in CLEANSING[args.schema].items():
+            uninstall(conn, table, derived)
+        conn.commit()
+        print("Dropped the derived columns.")
+        return
+    started = time.perf_counter()
+    for table, count in cleanse_schema(conn, args.schema).items():
+        print(f"{table}: {count:,} rows cleansed in {time.perf_counter() - started:.2f}s")
+    if args.compare:
+        print()
+        compare(conn, args.schema, args.runs)
+    conn.close()
+
+if __name__ == '__main__':
+    main()
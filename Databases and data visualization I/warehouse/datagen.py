@@ -0,0 +1,419 @@
+import argparse
+import itertools
+import multiprocessing
+import os
+import random
+import time
+from collections import namedtuple
+from datetime import date, timedelta
+
+from warehouse import lessons, loader, lookups
+
+# Rows handed to a single executemany() call. Every batch gets its own seeded
+# generator, so memory stays constant and the output does not depend on how
+# many worker processes produced it.
+BATCH_SIZE = 10000
+
+# Each table is generated from a range of driving keys (usually its primary key).
+# count(scale) gives the size of that range, rows(start, stop, rng, scale)
+# yields the rows for keys in [start, stop).
+TableSpec = namedtuple('TableSpec', ['name', 'columns', 'count', 'rows'])
+
+FIRST_NAMES = ['John', 'Jane', 'Bob', 'Alice', 'Charlie', 'Eve', 'Frank', 'Grace',
+               'Henry', 'Ivy', 'David', 'Carol', 'Maria', 'Liam', 'Olivia', 'Noah',
+               'Emma', 'Lucas', 'Mia', 'Ethan', 'Sofia', 'Mason', 'Chloe', 'Leo']
+LAST_NAMES = ['Doe', 'Smith', 'Wilson', 'Brown', 'Davis', 'Miller', 'Lee', 'Garcia',
+              'Chen', 'Johnson', 'Williams', 'Jones', 'Taylor', 'Anderson', 'Thomas',
+              'Moore', 'Martin', 'Clark', 'Lewis', 'Walker', 'Young', 'King']
+DEPARTMENTS = ['Engineering', 'Marketing', 'HR', 'Sales', 'Finance', 'Operations',
+               'Support', 'Legal']
+# Typical salary per department, used as the median of a log-normal spread
+DEPARTMENT_SALARY = {'Engineering': 78000, 'Marketing': 64000, 'HR': 58000,
+                     'Sales': 60000, 'Finance': 72000, 'Operations': 56000,
+                     'Support': 48000, 'Legal': 90000}
+JOB_TITLES = {
+    'Engineering': ['Developer', 'Senior Developer', 'Engineering Manager'],
+    'Marketing': ['Marketing Specialist', 'Marketing Manager'],
+    'HR': ['HR Generalist', 'Recruiter', 'HR Manager'],
+    'Sales': ['Sales Representative', 'Account Executive', 'Sales Manager'],
+    'Finance': ['Accountant', 'Financial Analyst', 'Controller'],
+    'Operations': ['Operations Analyst', 'Operations Manager'],
+    'Support': ['Support Agent', 'Support Lead'],
+    'Legal': ['Paralegal', 'Counsel'],
+}
+CITIES = ['New York', 'Los Angeles', 'Chicago', 'Boston', 'Seattle', 'Austin',
+          'Denver', 'Miami']
+STREETS = ['Main St', 'Oak Ave', 'Pine Rd', 'Maple Dr', 'Cedar Ln', 'Elm St',
+           'Lake View', 'Hill Rd']
+PROJECT_WORDS = ['Website', 'Mobile', 'Marketing', 'HR', 'Data', 'Cloud', 'Billing',
+                 'Search', 'Payroll', 'Analytics']
+PROJECT_KINDS = ['Redesign', 'App', 'Campaign', 'System', 'Migration', 'Platform']
+PRODUCT_CATEGORIES = ['Electronics', 'Furniture', 'Office', 'Outdoor']
+PRODUCT_NAMES = {
+    'Electronics': ['Laptop', 'Phone', 'Tablet', 'Monitor', 'Keyboard'],
+    'Furniture': ['Chair', 'Desk', 'Shelf', 'Lamp'],
+    'Office': ['Notebook', 'Pen Set', 'Stapler'],
+    'Outdoor': ['Tent', 'Backpack', 'Cooler'],
+}
+# Camera shop catalogue used by the text lessons: (product_name, code, tags, description)
+CAMERA_PRODUCTS = [
+    ('Digital Camera', 'CAM', 'camera,electronics', 'digital camera with 4K recording'),
+    ('Wide Angle Lens', 'LENS', 'lens,camera,accessories', 'wide angle lens'),
+    ('Telephoto Lens', 'LENS', 'lens,camera,pro', 'telephoto zoom lens'),
+    ('Carbon Fiber Tripod', 'TRI', 'tripod,accessories', 'lightweight tripod for stability'),
+    ('Memory Card', 'MEM', 'storage,electronics', 'high speed memory card'),
+    ('Camera Bag', 'BAG', 'bag,accessories', 'padded camera bag'),
+]
+PRODUCT_GRADES = ['', ' Pro', ' Lite', ' X1000', ' Max']
+ORDER_STATUSES = ['Pending', 'Shipping', 'Delivered']
+ORDER_STATUS_WEIGHTS = [15, 15, 70]
+SHIP_METHODS = ['FedEx', 'USPS', 'UPS', 'DHL']
+SHIP_METHOD_WEIGHTS = [40, 30, 20, 10]
+
+FIRST_HIRE = date(2010, 1, 1)
+FIRST_ORDER = date(2022, 1, 1)
+# Employees report to the employee (emp_id - 2) // MANAGER_FANOUT + 1,
+# which gives a balanced org chart with a single root
+MANAGER_FANOUT = 8
+
+def parse_scale(text):
+    # Accept plain integers as well as 1k / 10M / 1G style suffixes
+    text = str(text).strip().lower().replace('_', '')
+    multipliers = {'k': 10 ** 3, 'm': 10 ** 6, 'g': 10 ** 9}
+    if text and text[-1] in multipliers:
+        return int(float(text[:-1]) * multipliers[text[-1]])
+    return int(text)
+
+def _person(rng):
+    return rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+
+def _day(rng, start, days):
+    return (start + timedelta(days=rng.randrange(days))).isoformat()
+
+def _money(rng, median, spread=0.25):
+    return round(median * rng.lognormvariate(0, spread), 2)
+
+def _manager(emp_id):
+    return None if emp_id == 1 else (emp_id - 2) // MANAGER_FANOUT + 1
+
+def _skewed_id(rng, count):
+    # A few ids get most of the traffic, like real customers and products
+    return int(count * rng.random() ** 2) + 1
+
+def _department_name(dept_id):
+    name = DEPARTMENTS[(dept_id - 1) % len(DEPARTMENTS)]
+    copy = (dept_id - 1) // len(DEPARTMENTS)
+    return name if copy == 0 else f'{name} {copy + 1}'
+
+def _department_count(scale):
+    return max(4, scale // 1000)
+
+def _customer_count(scale):
+    return max(3, scale // 10)
+
+# =====================================
+# aggregation.py
+# =====================================
+def _aggregation_employees(start, stop, rng, scale):
+    for emp_id in range(start, stop):
+        first, last = _person(rng)
+        department = rng.choice(DEPARTMENTS[:4])
+        # Roughly 2% of employees have no salary on record yet
+        salary = None if rng.random() < 0.02 else _money(rng, DEPARTMENT_SALARY[department])
+        yield (emp_id, f'{first} {last}', department,
+               rng.choice(JOB_TITLES[department]), salary, _day(rng, FIRST_HIRE, 5000))
+
+# =====================================
+# joins.py
+# =====================================
+def _joins_customers(start, stop, rng, scale):
+    for customer_id in range(start, stop):
+        first, last = _person(rng)
+        yield (customer_id, f'{first} {last}', f'{first.lower()}{customer_id}@example.com')
+
+def _joins_orders(start, stop, rng, scale):
+    customers = _customer_count(scale)
+    for order_id in range(start, stop):
+        yield (order_id, _skewed_id(rng, customers), _day(rng, FIRST_ORDER, 1095),
+               _money(rng, 120, 0.6))
+
+def _joins_employees(start, stop, rng, scale):
+    for emp_id in range(start, stop):
+        first, last = _person(rng)
+        yield (emp_id, f'{first} {last}', _manager(emp_id))
+
+def _joins_products(start, stop, rng, scale):
+    for product_id in range(start, stop):
+        category = rng.choice(PRODUCT_CATEGORIES)
+        name = rng.choice(PRODUCT_NAMES[category]) + rng.choice(PRODUCT_GRADES)
+        yield (product_id, name, category)
+
+def _yearly_orders(start, stop, rng, scale):
+    # About half of the customers ordered in a given year, some several times
+    for customer_id in range(start, stop):
+        if rng.random() < 0.5:
+            for _ in range(rng.choice((1, 1, 1, 2, 3))):
+                yield (customer_id, _money(rng, 600, 0.5))
+
+def _segment(share):
+    def rows(start, stop, rng, scale):
+        for customer_id in range(start, stop):
+            if rng.random() < share:
+                yield (customer_id,)
+    return rows
+
+def _regional_sales(start, stop, rng, scale):
+    for _ in range(start, stop):
+        yield (_money(rng, 1000, 0.3),)
+
+# =====================================
+# tasks.py
+# =====================================
+def _task_employee_count(scale):
+    # Every employee works on two projects on average, so employee_projects
+    # (the fact table) ends up with roughly `scale` rows
+    return max(5, scale // 2)
+
+def _task_project_count(scale):
+    return max(4, scale // 100)
+
+def _tasks_departments(start, stop, rng, scale):
+    for dept_id in range(start, stop):
+        yield (dept_id, _department_name(dept_id), rng.choice(CITIES))
+
+def _tasks_employees(start, stop, rng, scale):
+    departments = _department_count(scale)
+    for emp_id in range(start, stop):
+        first, last = _person(rng)
+        dept_id = rng.randint(1, departments)
+        department = DEPARTMENTS[(dept_id - 1) % len(DEPARTMENTS)]
+        salary = None if rng.random() < 0.01 else _money(rng, DEPARTMENT_SALARY[department])
+        yield (emp_id, f'{first} {last}', salary, dept_id, _manager(emp_id),
+               _day(rng, FIRST_HIRE, 5000))
+
+def _tasks_projects(start, stop, rng, scale):
+    departments = _department_count(scale)
+    for project_id in range(start, stop):
+        name = f'{rng.choice(PROJECT_WORDS)} {rng.choice(PROJECT_KINDS)}'
+        yield (project_id, name, _money(rng, 100000, 0.4), rng.randint(1, departments))
+
+def _tasks_employee_projects(start, stop, rng, scale):
+    projects = _task_project_count(scale)
+    for emp_id in range(start, stop):
+        assigned = rng.sample(range(1, projects + 1), min(projects, rng.choice((1, 2, 2, 3))))
+        for project_id in assigned:
+            yield (emp_id, project_id, round(rng.uniform(10, 200) * 2) / 2)
+
+# =====================================
+# commands.py
+# =====================================
+def _phone_digits(rng):
+    return f'{rng.randint(200, 999)}{rng.randint(200, 999)}{rng.randint(0, 9999):04d}'
+
+def _commands_customers(start, stop, rng, scale):
+    for customer_id in range(start, stop):
+        first, last = _person(rng)
+        digits = _phone_digits(rng)
+        yield (customer_id, first, last, f'{first.lower()}.{last.lower()}{customer_id}@email.com',
+               f'{digits[:3]}-{digits[3:6]}-{digits[6:]}')
+
+def _commands_products(start, stop, rng, scale):
+    for product_id in range(start, stop):
+        name = rng.choice(CAMERA_PRODUCTS)[0] + rng.choice(PRODUCT_GRADES)
+        yield (product_id, name, _money(rng, 150, 0.8))
+
+def _commands_orders(start, stop, rng, scale):
+    customers = _customer_count(scale)
+    codes = lookups.codes(lookups.ORDER_STATUSES)
+    for order_id in range(start, stop):
+        status = rng.choices(ORDER_STATUSES, ORDER_STATUS_WEIGHTS)[0]
+        yield (order_id, _skewed_id(rng, customers), codes[status], _day(rng, FIRST_ORDER, 1095))
+
+# =====================================
+# text.py
+# =====================================
+def _text_customers(start, stop, rng, scale):
+    for customer_id in range(start, stop):
+        first, last = _person(rng)
+        # Mixed case emails and padded addresses, as in the sample data
+        email = f'{first.lower()}.{last.upper()}{customer_id}@example.com'
+        address = f'  {rng.randint(1, 9999)} {rng.choice(STREETS)}  '
+        yield (customer_id, first, last, email, _phone_digits(rng), address)
+
+def _text_products(start, stop, rng, scale):
+    for product_id in range(start, stop):
+        name, code, tags, description = rng.choice(CAMERA_PRODUCTS)
+        grade = rng.choice(PRODUCT_GRADES)
+        if grade == ' Pro' and 'pro' not in tags:
+            tags += ',pro'
+        stock = 0 if rng.random() < 0.1 else rng.randint(1, 50)
+        yield (product_id, name + grade, f'{grade.strip() or "Standard"} {description}',
+               code, tags, stock)
+
+def _text_orders(start, stop, rng, scale):
+    customers = _customer_count(scale)
+    codes = lookups.codes(lookups.ORDER_STATUSES)
+    for order_id in range(start, stop):
+        status = rng.choices(ORDER_STATUSES, ORDER_STATUS_WEIGHTS)[0]
+        ship_method = rng.choices(SHIP_METHODS, SHIP_METHOD_WEIGHTS)[0]
+        yield (order_id, _skewed_id(rng, customers), codes[status], ship_method)
+
+# Tables in load order for every lesson schema. `scale` is the approximate
+# row count of the largest (fact) table; the dimensions are sized from it.
+SCHEMAS = {
+    'aggregation': [
+        TableSpec('employees', ['id', 'name', 'department', 'job_title', 'salary', 'hire_date'],
+                  lambda scale: scale, _aggregation_employees),
+    ],
+    'joins': [
+        TableSpec('customers', ['customer_id', 'name', 'email'],
+                  _customer_count, _joins_customers),
+        TableSpec('orders', ['order_id', 'customer_id', 'order_date', 'amount'],
+                  lambda scale: scale, _joins_orders),
+        TableSpec('employees', ['emp_id', 'name', 'manager_id'],
+                  lambda scale: max(4, scale // 10), _joins_employees),
+        TableSpec('products', ['product_id', 'product_name', 'category'],
+                  lambda scale: max(3, scale // 100), _joins_products),
+        TableSpec('orders_2023', ['customer_id', 'amount'], _customer_count, _yearly_orders),
+        TableSpec('orders_2024', ['customer_id', 'amount'], _customer_count, _yearly_orders),
+        TableSpec('active_customers', ['customer_id'], _customer_count, _segment(0.7)),
+        TableSpec('premium_members', ['customer_id'], _customer_count, _segment(0.2)),
+        # all_customers also contains prospects that never became customers
+        TableSpec('all_customers', ['customer_id'],
+                  lambda scale: _customer_count(scale) * 5 // 4, _segment(1.0)),
+        TableSpec('opted_out_customers', ['customer_id'],
+                  lambda scale: _customer_count(scale) * 5 // 4, _segment(0.1)),
+        TableSpec('north_sales', ['amount'], lambda scale: max(2, scale // 10), _regional_sales),
+        TableSpec('south_sales', ['amount'], lambda scale: max(2, scale // 10), _regional_sales),
+    ],
+    'tasks': [
+        TableSpec('departments', ['dept_id', 'dept_name', 'location'],
+                  _department_count, _tasks_departments),
+        TableSpec('employees', ['emp_id', 'name', 'salary', 'department_id', 'manager_id', 'hire_date'],
+                  _task_employee_count, _tasks_employees),
+        TableSpec('projects', ['project_id', 'project_name', 'budget', 'dept_id'],
+                  _task_project_count, _tasks_projects),
+        TableSpec('employee_projects', ['emp_id', 'project_id', 'hours_worked'],
+                  _task_employee_count, _tasks_employee_projects),
+    ],
+    'commands': [
+        TableSpec('customers', ['customer_id', 'first_name', 'last_name', 'email', 'phone'],
+                  _customer_count, _commands_customers),
+        TableSpec('products', ['product_id', 'product_name', 'price'],
+                  lambda scale: max(4, scale // 100), _commands_products),
+        TableSpec('orders', ['order_id', 'customer_id', 'status_code', 'order_date'],
+                  lambda scale: scale, _commands_orders),
+    ],
+    'text': [
+        TableSpec('customers', ['customer_id', 'first_name', 'last_name', 'email', 'phone', 'address'],
+                  _customer_count, _text_customers),
+        TableSpec('products', ['product_id', 'product_name', 'description', 'product_code', 'tags', 'in_stock'],
+                  lambda scale: max(3, scale // 100), _text_products),
+        TableSpec('orders', ['order_id', 'customer_id', 'status_code', 'ship_method'],
+                  lambda scale: scale, _text_orders),
+    ],
+}
+
+def batches(schema, table, scale, start=1, stop=None, seed=0):
+    # Yield one generator per BATCH_SIZE keys. Batches start on fixed key
+    # boundaries so a key range always produces the same rows.
+    if stop is None:
+        stop = table.count(scale) + 1
+    for batch_start in range(start, stop, BATCH_SIZE):
+        batch_stop = min(batch_start + BATCH_SIZE, stop)
+        rng = random.Random(f'{seed}:{schema}:{table.name}:{batch_start}')
+        yield table.rows(batch_start, batch_stop, rng, scale)
+
+def _fill(conn, schema, scale, seed, ranges=None):
+    # Stream every table of the schema into conn, one transaction per table
+    rows = 0
+    for table in SCHEMAS[schema]:
+        start, stop = ranges[table.name] if ranges else (1, None)
+        generated = itertools.chain.from_iterable(batches(schema, table, scale, start, stop, seed))
+        stats = loader.load(conn, table.name, generated, table.columns, batch_size=None)
+        rows += stats['rows']
+    return rows
+
+def _clear(conn, schema):
+    for table in SCHEMAS[schema]:
+        conn.execute(f'DELETE FROM {table.name}')
+    conn.commit()
+
+def populate(conn, schema, scale, seed=0):
+    # Replace the contents of an open lesson database with generated data
+    _clear(conn, schema)
+    return _fill(conn, schema, scale, seed)
+
+def key_ranges(schema, scale, worker, workers):
+    # Split every table's key range into `workers` slices aligned to BATCH_SIZE
+    ranges = {}
+    for table in SCHEMAS[schema]:
+        count = table.count(scale)
+        batch_count = -(-count // BATCH_SIZE)
+        first = batch_count * worker // workers
+        last = batch_count * (worker + 1) // workers
+        ranges[table.name] = (1 + first * BATCH_SIZE, min(count, last * BATCH_SIZE) + 1)
+    return ranges
+
+def _write_shard(shard_path, schema, scale, seed, worker, workers):
+    # Worker process: write its primary-key slice of every table to a private file
+    conn = loader.connect(shard_path, loader.BULK_PRAGMAS)
+    conn.executescript(lessons.load(schema).SCHEMA)
+    rows = _fill(conn, schema, scale, seed, key_ranges(schema, scale, worker, workers))
+    conn.close()
+    return rows
+
+def generate(db_path, schema, scale, workers=1, seed=0):
+    # Build (or refill) a lesson database at db_path with `scale` fact rows
+    conn = loader.connect(db_path, loader.BULK_PRAGMAS)
+    conn.executescript(lessons.load(schema).SCHEMA)
+    _clear(conn, schema)
+    if workers <= 1:
+        rows = _fill(conn, schema, scale, seed)
+        conn.close()
+        return rows
+
+    shard_paths = [f'{db_path}.part{worker}' for worker in range(workers)]
+    for path in shard_paths:
+        if os.path.exists(path):
+            os.remove(path)
+    with multiprocessing.Pool(workers) as pool:
+        rows = sum(pool.starmap(_write_shard, [
+            (path, schema, scale, seed, worker, workers)
+            for worker, path in enumerate(shard_paths)
+        ]))
+
+    # Shards hold disjoint key ranges in ascending order, so appending them
+    # in worker order keeps every table sorted by primary key
+    for path in shard_paths:
+        conn.execute('ATTACH DATABASE ? AS shard', (path,))
+        for table in SCHEMAS[schema]:
+            columns = ', '.join(table.columns)
+            conn.execute(f'INSERT INTO main.{table.name} ({columns}) '
+                         f'SELECT {columns} FROM shard.{table.name}')
+        conn.commit()
+        conn.execute('DETACH DATABASE shard')
+        os.remove(path)
+    conn.close()
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic data for a lesson database.')
+    parser.add_argument('schema', choices=sorted(SCHEMAS))
+    parser.add_argument('--scale', type=parse_scale, default=1000,
+                        help='approximate rows in the largest table (e.g. 1k, 10M, 100M)')
+    parser.add_argument('--db', help='database file (default: <schema>_<scale>.db)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes generating disjoint primary-key ranges')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    db_path = args.db or f'{args.schema}_{args.scale}.db'
+    print(f"Generating '{args.schema}' data at scale {args.scale:,} into {db_path}...")
+    started = time.perf_counter()
+    rows = generate(db_path, args.schema, args.scale, args.workers, args.seed)
+    elapsed = time.perf_counter() - started
+    print(f"Inserted {rows:,} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):,.0f} rows/sec).")
+
+if __name__ == '__main__':
+    main()
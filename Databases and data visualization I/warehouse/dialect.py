@@ -0,0 +1,358 @@
+import argparse
+import csv
+import datetime
+import decimal
+import itertools
+import os
+import re
+import sqlite3
+import tempfile
+import time
+from collections import namedtuple
+
+from warehouse import bench, datagen, lessons
+
+try:
+    import duckdb
+except ImportError:  # only the DuckDB target needs it
+    duckdb = None
+
+# The lesson .sql files are written for PostgreSQL (skills_for_today.sql)
+# or MySQL (sql_basics.sql). translate() rewrites their statements for an
+# embedded engine: SQLite, the row store the lessons use, or DuckDB, a
+# column store, so one workload can be timed on both without a server.
+SOURCES = ['postgres', 'mysql', 'sqlite']
+TARGETS = ['sqlite', 'duckdb']
+
+# A statement that has no equivalent in the target is kept as a comment
+SKIPPED = '-- skipped: '
+
+Result = namedtuple('Result', ['sql', 'columns', 'rows', 'seconds'])
+
+# How NULL is written to the CSV files DuckDB bulk-loads
+CSV_NULL = '\\N'
+
+QUERY_WORDS = ('SELECT', 'WITH', 'VALUES', 'PRAGMA', 'EXPLAIN', 'SHOW', 'DESCRIBE')
+
+MYSQL_MARKERS = re.compile(r'\bAUTO_INCREMENT\b|^\s*USE\s+\w+|`|\bENGINE\s*=|^\s*#', re.IGNORECASE | re.MULTILINE)
+POSTGRES_MARKERS = re.compile(r'\b(?:BIG|SMALL)?SERIAL\b|::\w|\bILIKE\b|\bPostgreSQL\b', re.IGNORECASE)
+
+def detect(script):
+    # Dialect of a script from the syntax only one of them uses
+    if MYSQL_MARKERS.search(script):
+        return 'mysql'
+    if POSTGRES_MARKERS.search(script):
+        return 'postgres'
+    return 'sqlite'
+
+def split(script, dialect='sqlite'):
+    # Statements of a script without comments. Semicolons inside strings,
+    # quoted names and comments do not end a statement. '#' starts a
+    # comment at the start of a line, and anywhere in MySQL.
+    statements, current = [], []
+    i, n = 0, len(script)
+    line_start = True
+    while i < n:
+        char = script[i]
+        if char in '\'"`':
+            end = i + 1
+            while end < n:
+                if script[end] == '\\' and dialect == 'mysql':
+                    end += 2
+                    continue
+                if script[end] == char:
+                    if end + 1 < n and script[end + 1] == char:
+                        end += 2
+                        continue
+                    break
+                end += 1
+            current.append(script[i:end + 1])
+            i = end + 1
+        elif script.startswith('--', i) or (char == '#' and (line_start or dialect == 'mysql')):
+            end = script.find('\n', i)
+            i = n if end == -1 else end
+        elif script.startswith('/*', i):
+            end = script.find('*/', i + 2)
+            i = n if end == -1 else end + 2
+            current.append(' ')
+        elif char == ';':
+            statements.append(''.join(current))
+            current = []
+            i += 1
+        else:
+            current.append(char)
+            i += 1
+        line_start = char == '\n' or (line_start and char in ' \t')
+    statements.append(''.join(current))
+    return [s.strip() for s in statements if s.strip()]
+
+# =====================================
+# Rewrites
+# =====================================
+STRING = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+MYSQL_STRING = re.compile(r'"((?:[^"\\]|\\.)*)"')
+
+def _mask(sql):
+    # Swap string literals for placeholders so rewrites never touch them
+    literals = []
+
+    def keep(match):
+        literals.append(match.group(0))
+        return f'\x00{len(literals) - 1}\x00'
+    return STRING.sub(keep, sql), literals
+
+def _unmask(sql, literals):
+    return re.sub('\x00(\\d+)\x00', lambda m: literals[int(m.group(1))], sql)
+
+def _standard_string(text):
+    # MySQL 'It\'s' and "It's" as standard 'It''s'
+    body = re.sub(r'\\(.)', r'\1', text).replace("'", "''")
+    return f"'{body}'"
+
+def _concat(sql):
+    # CONCAT(a, b, c) as (a || b || c): NULL if any argument is NULL, like
+    # MySQL. DuckDB's concat() would skip NULLs and SQLite 3.40 has none.
+    while True:
+        match = re.search(r'\bCONCAT\s*\(', sql, re.IGNORECASE)
+        if not match:
+            return sql
+        depth, args, start = 1, [], match.end()
+        i = start
+        while depth:
+            if sql[i] == '(':
+                depth += 1
+            elif sql[i] == ')':
+                depth -= 1
+            elif sql[i] == ',' and depth == 1:
+                args.append(sql[start:i].strip())
+                start = i + 1
+            i += 1
+        args.append(sql[start:i - 1].strip())
+        sql = sql[:match.start()] + '(' + ' || '.join(args) + ')' + sql[i:]
+
+TABLE_NAME = re.compile(r'^\s*CREATE\s+(?:TEMP(?:ORARY)?\s+)?TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?([\w."]+)',
+                        re.IGNORECASE)
+SERIAL = re.compile(r'\b(\w+)\s+(?:BIG|SMALL)?SERIAL\b', re.IGNORECASE)
+AUTO_INCREMENT = re.compile(r'\b(\w+)\s+\w+(?:\(\d+\))?([^,()]*?)\s*\bAUTO_INCREMENT\b', re.IGNORECASE)
+AUTOINCREMENT = re.compile(r'\b(\w+)\s+INTEGER\s+PRIMARY\s+KEY\s+AUTOINCREMENT\b', re.IGNORECASE)
+TABLE_OPTIONS = re.compile(r'\)\s*(?:(?:ENGINE|(?:DEFAULT\s+)?(?:CHARSET|CHARACTER\s+SET)|COLLATE|AUTO_INCREMENT)'
+                           r'\s*=?\s*\w+\s*)+$', re.IGNORECASE)
+CAST = re.compile(r'(\b[\w.]+|\x00\d+\x00)::(\w+(?:\s*\([\d,\s]+\))?)')
+
+# Statements with no counterpart in an embedded, single-database engine
+UNSUPPORTED = [
+    (re.compile(r'^\s*CREATE\s+(?:DATABASE|SCHEMA)\b', re.IGNORECASE), 'one database per file'),
+    (re.compile(r'^\s*(?:USE|\\c(?:onnect)?)\s+\w+', re.IGNORECASE), 'one database per file'),
+    (re.compile(r'^\s*SET\s+(?:NAMES|SESSION|GLOBAL|@@|FOREIGN_KEY_CHECKS|sql_mode)', re.IGNORECASE),
+     'server session setting'),
+]
+
+def translate_statement(sql, source, target='sqlite'):
+    # One statement of source as a list of target statements
+    for pattern, reason in UNSUPPORTED:
+        if pattern.match(sql):
+            return [f"{SKIPPED}{' '.join(sql.split())} ({reason})"]
+    if source == 'mysql':
+        sql = MYSQL_STRING.sub(lambda m: _standard_string(m.group(1)), sql)
+        sql = STRING.sub(lambda m: _standard_string(m.group(0)[1:-1]) if '\\' in m.group(0) else m.group(0), sql)
+    sql, literals = _mask(sql)
+    sql = sql.replace('`', '"')
+    sql = _concat(sql)
+    sql = TABLE_OPTIONS.sub(')', sql)
+    before = []
+    table = TABLE_NAME.match(sql)
+    table = table.group(1).strip('"') if table else None
+
+    if target == 'sqlite':
+        # INTEGER PRIMARY KEY is the rowid and numbers new rows by itself
+        sql = SERIAL.sub(r'\1 INTEGER', sql)
+        sql = AUTO_INCREMENT.sub(r'\1 INTEGER\2', sql)
+        sql = CAST.sub(r'CAST(\1 AS \2)', sql)
+        sql = re.sub(r'\bILIKE\b', 'LIKE', sql, flags=re.IGNORECASE)
+        sql = re.sub(r'\bNOW\(\)', 'CURRENT_TIMESTAMP', sql, flags=re.IGNORECASE)
+        sql = re.sub(r'\bCURDATE\(\)', 'CURRENT_DATE', sql, flags=re.IGNORECASE)
+    else:
+        # DuckDB numbers rows from a sequence
+        def sequence(match, rest=''):
+            name = f'{table}_{match.group(1)}_seq'
+            before.append(f'CREATE SEQUENCE IF NOT EXISTS {name}')
+            return f"{match.group(1)} INTEGER DEFAULT nextval('{name}'){rest}"
+        if table:
+            sql = SERIAL.sub(sequence, sql)
+            sql = AUTO_INCREMENT.sub(lambda m: sequence(m, m.group(2)), sql)
+            sql = AUTOINCREMENT.sub(lambda m: sequence(m, ' PRIMARY KEY'), sql)
+        sql = re.sub(r'\)\s*WITHOUT\s+ROWID\s*$', ')', sql, flags=re.IGNORECASE)
+    return before + [_unmask(sql, literals)]
+
+def translate(script, source=None, target='sqlite'):
+    # Statements of a script rewritten for target
+    source = source or detect(script)
+    return [translated for sql in split(script, source)
+            for translated in translate_statement(sql, source, target)]
+
+# =====================================
+# Running
+# =====================================
+def connect(target, path=':memory:'):
+    if target == 'duckdb':
+        if duckdb is None:
+            raise RuntimeError("The DuckDB target needs duckdb (pip install duckdb)")
+        return duckdb.connect(path)
+    return sqlite3.connect(path)
+
+def is_query(sql):
+    return sql.lstrip('( \n').split(None, 1)[0].upper() in QUERY_WORDS
+
+def run(conn, statements):
+    # Execute translated statements in order, yielding a Result for each;
+    # only queries have columns and rows
+    cursor = conn.cursor()
+    for sql in statements:
+        if sql.startswith(SKIPPED):
+            yield Result(sql, None, None, 0.0)
+            continue
+        started = time.perf_counter()
+        cursor.execute(sql)
+        if is_query(sql):
+            columns = [column[0] for column in cursor.description]
+            rows = cursor.fetchall()
+        else:
+            columns = rows = None
+        yield Result(sql, columns, rows, time.perf_counter() - started)
+    conn.commit()
+
+def _csv_value(value):
+    if value is None:
+        return CSV_NULL
+    if isinstance(value, bytes):
+        # DuckDB casts '\xAB' escapes in text to BLOB bytes
+        return ''.join(f'\\x{b:02X}' for b in value)
+    return value
+
+def copy_rows(conn, table, columns, batches):
+    # Bulk-load batches of rows into columns of a DuckDB table through a CSV
+    # file, which DuckDB parses in one pass instead of running an INSERT per row
+    types = {row[0]: row[1] for row in conn.execute(f'DESCRIBE "{table}"').fetchall()}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, f'{table}.csv')
+        with open(path, 'w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file, lineterminator='\n')
+            for rows in batches:
+                writer.writerows([_csv_value(v) for v in row] for row in rows)
+        # BLOBs arrive as escaped text and are cast once read
+        read = ', '.join(f"'{c}': '{'VARCHAR' if types[c] == 'BLOB' else types[c]}'" for c in columns)
+        values = ', '.join(f'CAST("{c}" AS BLOB)' if types[c] == 'BLOB' else f'"{c}"' for c in columns)
+        names = ', '.join(f'"{c}"' for c in columns)
+        csv_path = path.replace("'", "''")
+        conn.execute(f"""
+            INSERT INTO "{table}" ({names}) SELECT {values}
+            FROM read_csv('{csv_path}', header = false, columns = {{{read}}}, nullstr = '{CSV_NULL}',
+                          quote = '"', escape = '"', auto_detect = false)
+        """)
+
+def load_lesson_data(conn, target, schema, scale, batch_size=datagen.BATCH_SIZE):
+    # Create a lesson schema and fill it with generated rows, on any target
+    for sql in translate(lessons.load(schema).SCHEMA, 'sqlite', target):
+        conn.execute(sql)
+    for table in datagen.SCHEMAS[schema]:
+        if target == 'duckdb':
+            copy_rows(conn, table.name, table.columns, datagen.batches(schema, table, scale))
+            continue
+        placeholders = ', '.join('?' for _ in table.columns)
+        sql = f'INSERT INTO {table.name} ({", ".join(table.columns)}) VALUES ({placeholders})'
+        for rows in datagen.batches(schema, table, scale):
+            for chunk in iter(lambda: list(itertools.islice(rows, batch_size)), []):
+                conn.executemany(sql, chunk)
+    conn.commit()
+
+def normalize_rows(rows):
+    # Both engines' rows in one sorted form: DuckDB returns dates and
+    # decimals where SQLite returns text and floats, or integers for the
+    # whole values of a DECIMAL column
+    def value(v):
+        if isinstance(v, (datetime.date, datetime.datetime)):
+            return str(v)
+        if isinstance(v, (int, float, decimal.Decimal)) and not isinstance(v, bool):
+            return round(float(v), 6)
+        return v
+    return sorted((tuple(value(v) for v in row) for row in rows), key=repr)
+
+def _label(sql, width=44):
+    text = ' '.join(sql.split())
+    return text if len(text) <= width else text[:width - 3] + '...'
+
+def compare(script, source=None, targets=TARGETS, runs=5, data=None, scale=None):
+    # Run the script on an in-memory database of every target and time each
+    # of its queries there
+    available = [t for t in targets if t != 'duckdb' or duckdb is not None]
+    if len(available) < len(targets):
+        print("duckdb is not installed (pip install duckdb); timing SQLite only.\n")
+    timings, answers = {}, {}
+    for target in available:
+        conn = connect(target)
+        if data:
+            started = time.perf_counter()
+            load_lesson_data(conn, target, data, scale)
+            print(f"{target}: loaded {data} at scale {scale:,} in {time.perf_counter() - started:.2f}s")
+        # The first run of each query doubles as warm-up and gives its answer
+        queries = [r for r in run(conn, translate(script, source, target)) if r.columns is not None]
+        for number, (sql, _, rows, _) in enumerate(queries):
+            answers.setdefault(number, {})[target] = normalize_rows(rows)
+            timings.setdefault(number, (sql, {}))[1][target] = bench.time_callable(
+                lambda: conn.execute(sql).fetchall(), runs, warmup=0)
+        conn.close()
+    print(f"\n{'Query':<46}" + ''.join(f'{t:>12}' for t in available)
+          + (f"{'ratio':>9} {'agrees':>7}" if len(available) > 1 else ''))
+    for number, (sql, times) in sorted(timings.items()):
+        line = f"{_label(sql):<46}" + ''.join(bench.format_ms(times[t]) for t in available)
+        if len(available) > 1:
+            first, second = (times[t] for t in available[:2])
+            agrees = len({repr(rows) for rows in answers[number].values()}) == 1
+            line += f"{bench.format_speedup(first, second)} {bench.format_agrees(agrees)}"
+        print(line)
+
+def _print_result(result):
+    if result.sql.startswith(SKIPPED):
+        print(result.sql)
+        return
+    print(f"> {_label(result.sql, 76)}")
+    if result.columns is not None:
+        print(f"  {tuple(result.columns)}")
+        for row in result.rows:
+            print(f"  {tuple(row)}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Run PostgreSQL/MySQL lesson scripts on SQLite or DuckDB.')
+    parser.add_argument('script', help='.sql file')
+    parser.add_argument('--from', dest='source', choices=SOURCES, help='dialect of the script (default: detect)')
+    parser.add_argument('--target', nargs='+', choices=TARGETS, default=['sqlite'])
+    parser.add_argument('--db', default=':memory:', help='database file to run on (default: in memory)')
+    parser.add_argument('--print', action='store_true', help='print the translated script instead of running it')
+    parser.add_argument('--compare', action='store_true', help="time the script's queries on every target")
+    parser.add_argument('--data', choices=sorted(datagen.SCHEMAS),
+                        help='load generated data of a lesson schema first (with --compare)')
+    parser.add_argument('--scale', type=datagen.parse_scale, default=20000)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    with open(args.script, encoding='utf-8') as f:
+        script = f.read()
+    source = args.source or detect(script)
+    print(f"-- {args.script}: {source} dialect")
+    if args.compare:
+        compare(script, source, args.target, args.runs, args.data, args.scale)
+        return
+    for target in args.target:
+        statements = translate(script, source, target)
+        print(f"-- {target}")
+        if args.print:
+            for sql in statements:
+                print(sql if sql.startswith(SKIPPED) else sql + ';\n')
+            continue
+        conn = connect(target, args.db)
+        for result in run(conn, statements):
+            _print_result(result)
+        conn.close()
+
+if __name__ == '__main__':
+    main()
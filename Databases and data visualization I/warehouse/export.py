@@ -0,0 +1,266 @@
+import argparse
+import csv
+import gzip
+import itertools
+import os
+import re
+import time
+
+from warehouse import loader
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet/Arrow export needs pyarrow; CSV does not
+    pa = pq = None
+
+FORMATS = {'parquet': '.parquet', 'arrow': '.arrow', 'csv': '.csv'}
+COMPRESSION = {
+    'parquet': ['zstd', 'snappy', 'gzip', 'none'],
+    'arrow': ['zstd', 'lz4', 'none'],
+    'csv': ['gzip', 'none'],
+}
+
+# Rows per Parquet row group / Arrow record batch, and per fetchmany() call
+ROW_GROUP_SIZE = 100000
+
+# A text column is dictionary-encoded when the first batch has at most this
+# many distinct values and they make up at most this share of its rows
+DICTIONARY_MAX_VALUES = 1000
+DICTIONARY_MAX_RATIO = 0.1
+
+# Partition date columns by a prefix of their ISO text, e.g. hire_date:year
+DATE_GRAINS = {'year': 4, 'month': 7, 'day': 10}
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+IDENTIFIER = re.compile(r'^\w+$')
+
+def _require_pyarrow(format):
+    if pa is None:
+        raise RuntimeError(f"Exporting to {format} needs pyarrow (pip install pyarrow); "
+                           f"use --format csv without it")
+
+def declared_types(conn, sql):
+    # Declared column types of a query, via a temporary view. Expressions
+    # have no declared type and come back as ''.
+    conn.execute(f'CREATE TEMP VIEW export_columns AS {sql}')
+    try:
+        return {row[1]: row[2].upper() for row in conn.execute('PRAGMA temp.table_info(export_columns)')}
+    finally:
+        conn.execute('DROP VIEW temp.export_columns')
+
+def _kind(decltype, values):
+    # Column kind from SQLite's type affinity rules, falling back to the
+    # values of the first batch for expressions
+    if 'INT' in decltype:
+        return 'int'
+    if any(word in decltype for word in ('CHAR', 'CLOB', 'TEXT')):
+        return 'text'
+    if any(word in decltype for word in ('REAL', 'FLOA', 'DOUB', 'DECIMAL', 'NUMERIC')):
+        return 'float'
+    if decltype == 'DATE':
+        return 'date'
+    present = {type(v) for v in values if v is not None}
+    if present <= {int}:
+        return 'int' if present else 'text'
+    if present <= {int, float}:
+        return 'float'
+    if present == {bytes}:
+        return 'binary'
+    return 'text'
+
+def _dictionary_candidate(values):
+    distinct = set(values)
+    return (len(distinct) <= DICTIONARY_MAX_VALUES
+            and len(distinct) <= max(1, len(values) * DICTIONARY_MAX_RATIO))
+
+def _plan(names, decltypes, batch, dictionary):
+    # [(name, kind, dictionary encoded)] from the first batch
+    columns = list(zip(*batch)) if batch else [()] * len(names)
+    plan = []
+    for name, values in zip(names, columns):
+        kind = _kind(decltypes.get(name, ''), values)
+        if dictionary is None:
+            encode = kind == 'text' and bool(values) and _dictionary_candidate(values)
+        else:
+            encode = kind == 'text' and name in dictionary
+        plan.append((name, kind, encode))
+    return plan
+
+def _arrow_schema(plan):
+    types = {'int': pa.int64(), 'float': pa.float64(), 'text': pa.string(),
+             'date': pa.date32(), 'binary': pa.binary()}
+    return pa.schema([pa.field(name, pa.dictionary(pa.int32(), types[kind]) if encode else types[kind])
+                      for name, kind, encode in plan])
+
+def _record_batch(plan, schema, rows):
+    arrays = []
+    for (name, kind, encode), values in zip(plan, zip(*rows)):
+        if kind == 'date':
+            # ISO date text; pyarrow parses it in C
+            array = pa.array(values, pa.string()).cast(pa.date32())
+        else:
+            array = pa.array(values, schema.field(name).type.value_type if encode
+                             else schema.field(name).type)
+        if encode and kind != 'date':
+            array = array.dictionary_encode()
+        arrays.append(array)
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+class ParquetWriter:
+    def __init__(self, path, plan, compression):
+        self.plan = plan
+        self.schema = _arrow_schema(plan)
+        self.writer = pq.ParquetWriter(path, self.schema, compression=compression)
+
+    def write(self, rows):
+        # Each call becomes one row group
+        batch = _record_batch(self.plan, self.schema, rows)
+        self.writer.write_table(pa.Table.from_batches([batch]))
+
+    def close(self):
+        self.writer.close()
+
+class ArrowWriter:
+    # Arrow IPC file format (Feather v2)
+    def __init__(self, path, plan, compression):
+        self.plan = plan
+        self.schema = _arrow_schema(plan)
+        self.sink = pa.OSFile(path, 'wb')
+        options = pa.ipc.IpcWriteOptions(compression=compression)
+        self.writer = pa.ipc.new_file(self.sink, self.schema, options=options)
+
+    def write(self, rows):
+        self.writer.write_batch(_record_batch(self.plan, self.schema, rows))
+
+    def close(self):
+        self.writer.close()
+        self.sink.close()
+
+class CsvWriter:
+    # Row-oriented, but readable by Tableau without any extra libraries
+    def __init__(self, path, plan, compression):
+        self.file = (gzip.open(path, 'wt', newline='') if compression == 'gzip'
+                     else open(path, 'w', newline=''))
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([name for name, _, _ in plan])
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+WRITERS = {'parquet': ParquetWriter, 'arrow': ArrowWriter, 'csv': CsvWriter}
+
+def partition_key(partition_by):
+    # (SQL expression, directory name) for 'column' or 'date_column:grain'
+    column, _, grain = partition_by.partition(':')
+    if not IDENTIFIER.match(column):
+        raise ValueError(f"Invalid partition column: {column}")
+    if not grain:
+        return column, column
+    if grain not in DATE_GRAINS:
+        raise ValueError(f"Unknown date grain {grain!r}; use one of {', '.join(DATE_GRAINS)}")
+    return f'substr({column}, 1, {DATE_GRAINS[grain]})', f'{column}_{grain}'
+
+def _partition_dir(name, value):
+    if value is None:
+        return f'{name}={NULL_PARTITION}'
+    return f'{name}=' + re.sub(r'[^\w.-]', '_', str(value))
+
+def _file_name(path, format, compression):
+    suffix = FORMATS[format] + ('.gz' if format == 'csv' and compression == 'gzip' else '')
+    return path if path.endswith(suffix) else path + suffix
+
+def export(conn, source, path, format='parquet', partition_by=None, compression=None,
+           dictionary=None, params=(), batch_size=ROW_GROUP_SIZE):
+    # Stream a table or query into columnar files and return statistics.
+    # Unpartitioned, path is the output file. Partitioned, path is a
+    # directory of Hive-style column=value/ folders, written one at a time
+    # because the rows arrive sorted by the partition key.
+    if format not in FORMATS:
+        raise ValueError(f"Unknown format {format!r}; use one of {', '.join(FORMATS)}")
+    compression = compression or COMPRESSION[format][0]
+    if compression not in COMPRESSION[format]:
+        raise ValueError(f"{format} supports {', '.join(COMPRESSION[format])} compression")
+    if format != 'csv':
+        _require_pyarrow(format)
+    codec = None if compression == 'none' else compression
+
+    source = source.strip().rstrip(';')
+    sql = f'SELECT * FROM {source}' if IDENTIFIER.match(source) else source
+    # Views cannot take parameters, so parameterized queries infer all types
+    decltypes = {} if params else declared_types(conn, sql)
+    if partition_by:
+        key, key_name = partition_key(partition_by)
+        sql = f'SELECT {key} AS export_partition, * FROM ({sql}) ORDER BY 1'
+
+    started = time.perf_counter()
+    cursor = conn.execute(sql, params)
+    names = [column[0] for column in cursor.description][1 if partition_by else 0:]
+    stats = {'rows': 0, 'files': [], 'bytes': 0}
+    plan = writer = current = None
+
+    def open_writer(file_path):
+        os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+        stats['files'].append(file_path)
+        return WRITERS[format](file_path, plan, codec)
+
+    batches = iter(lambda: cursor.fetchmany(batch_size), [])
+    first = next(batches, [])
+    try:
+        for batch in itertools.chain([first], batches):
+            if plan is None:
+                plan = _plan(names, decltypes, [row[1:] for row in batch] if partition_by else batch,
+                             dictionary)
+            if not partition_by:
+                writer = writer or open_writer(_file_name(path, format, compression))
+                if batch:
+                    writer.write(batch)
+                stats['rows'] += len(batch)
+                continue
+            for value, rows in itertools.groupby(batch, key=lambda row: row[0]):
+                if writer is None or value != current:
+                    if writer is not None:
+                        writer.close()
+                    current = value
+                    folder = os.path.join(path, _partition_dir(key_name, value))
+                    writer = open_writer(_file_name(os.path.join(folder, 'part-0'), format, compression))
+                rows = [row[1:] for row in rows]
+                writer.write(rows)
+                stats['rows'] += len(rows)
+    finally:
+        if writer is not None:
+            writer.close()
+    stats['bytes'] = sum(os.path.getsize(f) for f in stats['files'])
+    stats['seconds'] = time.perf_counter() - started
+    stats['dictionary'] = [name for name, _, encode in plan if encode] if format != 'csv' else []
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description='Export a table or query to Parquet, Arrow or CSV files.')
+    parser.add_argument('--db', required=True)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--table')
+    source.add_argument('--query')
+    parser.add_argument('--out', required=True, help='output file, or directory when partitioned')
+    parser.add_argument('--format', choices=FORMATS, default='parquet')
+    parser.add_argument('--partition-by', metavar='COLUMN[:year|month|day]')
+    parser.add_argument('--compression', help='default: zstd (parquet, arrow) or gzip (csv)')
+    parser.add_argument('--dictionary', nargs='*', metavar='COLUMN',
+                        help='columns to dictionary-encode (default: low-cardinality text)')
+    parser.add_argument('--batch-size', type=int, default=ROW_GROUP_SIZE)
+    args = parser.parse_args()
+
+    conn = loader.connect(args.db)
+    stats = export(conn, args.table or args.query, args.out, args.format, args.partition_by,
+                   args.compression, args.dictionary, batch_size=args.batch_size)
+    conn.close()
+    print(f"{stats['rows']:,} rows -> {len(stats['files'])} file(s), "
+          f"{stats['bytes'] / 1024 ** 2:.2f} MB in {stats['seconds']:.2f}s")
+    if stats['dictionary']:
+        print(f"Dictionary-encoded: {', '.join(stats['dictionary'])}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+import argparse
+import re
+import time
+from collections import namedtuple
+
+from warehouse import bench, datagen, loader
+
+# A VIRTUAL generated column: computed from the row when read, so it takes
+# no space in the table, but an index on it stores the computed values and
+# turns a filter on the expression into a lookup
+Generated = namedtuple('Generated', ['column', 'type', 'expression', 'indexed'], defaults=[True])
+
+GENERATED = {
+    'commands': {
+        'customers': [
+            Generated('full_name', 'TEXT', "first_name || ' ' || last_name"),
+            Generated('email_domain', 'TEXT', "lower(substr(email, instr(email, '@') + 1))"),
+            Generated('email_at', 'INTEGER', "instr(email, '@')", indexed=False),
+            Generated('area_code', 'TEXT', 'substr(phone, 1, 3)'),
+        ],
+    },
+    'text': {
+        'customers': [
+            Generated('email_domain', 'TEXT', "lower(substr(email, instr(email, '@') + 1))"),
+            Generated('email_lower', 'TEXT', 'lower(email)'),
+        ],
+    },
+}
+
+# PRAGMA table_xinfo 'hidden' values of generated columns
+VIRTUAL, STORED = 2, 3
+
+def _hidden(conn, table):
+    return {row[1]: row[6] for row in conn.execute(f'PRAGMA table_xinfo({table})')}
+
+def install(conn, schema):
+    # Add the generated columns and their indexes to an existing lesson
+    # database; safe to re-run. A plain column of the same name, e.g. one
+    # filled by warehouse.cleanse, is replaced.
+    for table, columns in GENERATED[schema].items():
+        hidden = _hidden(conn, table)
+        for g in columns:
+            if g.column in hidden and hidden[g.column] not in (VIRTUAL, STORED):
+                conn.execute(f'ALTER TABLE {table} DROP COLUMN {g.column}')
+                del hidden[g.column]
+            if g.column not in hidden:
+                # ADD COLUMN can only add VIRTUAL generated columns
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN {g.column} {g.type} '
+                             f'GENERATED ALWAYS AS ({g.expression}) VIRTUAL')
+            if g.indexed:
+                conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_{g.column} ON {table} ({g.column})')
+    conn.commit()
+
+def uninstall(conn, schema):
+    for table, columns in GENERATED[schema].items():
+        hidden = _hidden(conn, table)
+        for g in columns:
+            conn.execute(f'DROP INDEX IF EXISTS idx_{table}_{g.column}')
+            if hidden.get(g.column) in (VIRTUAL, STORED):
+                conn.execute(f'ALTER TABLE {table} DROP COLUMN {g.column}')
+    conn.commit()
+
+# =====================================
+# Rewriting filters to the generated columns
+# =====================================
+SQL_TOKEN = re.compile(r"'(?:[^']|'')*'|\w+|[^\w\s]")
+
+def _expression_pattern(expression):
+    # The expression with any spacing; keywords and names in any case,
+    # string literals exactly
+    parts = [re.escape(token) if token.startswith("'") else f'(?i:{re.escape(token)})'
+             for token in SQL_TOKEN.findall(expression)]
+    return re.compile(r'(?<![\w.])' + r'\s*'.join(parts) + r'(?!\w)')
+
+# email LIKE '%@domain' is email_domain = 'domain' (LIKE ignores ASCII case)
+# and phone LIKE '555%' is area_code = '555'
+LIKE_DOMAIN = re.compile(r"(?<![\w.])email\s+LIKE\s+'%@([^'%_]+)'", re.IGNORECASE)
+LIKE_AREA_CODE = re.compile(r"(?<![\w.])phone\s+LIKE\s+'([^'%_]{3})%'", re.IGNORECASE)
+
+def rewrite(sql, schema):
+    # sql with the expressions of the schema's generated columns replaced by
+    # the columns, so SQLite can use their indexes. It only knows the column
+    # names, so use it on queries whose other tables have no email, phone or
+    # name columns.
+    columns = [g for table in GENERATED[schema].values() for g in table]
+    names = {g.column for g in columns}
+    # Longest first: email_domain's expression contains email_at's
+    for g in sorted(columns, key=lambda g: len(g.expression), reverse=True):
+        sql = _expression_pattern(g.expression).sub(g.column, sql)
+    if 'email_domain' in names:
+        sql = LIKE_DOMAIN.sub(lambda m: f"email_domain = '{m.group(1).lower()}'", sql)
+    if 'area_code' in names:
+        sql = LIKE_AREA_CODE.sub(lambda m: f"area_code = '{m.group(1)}'", sql)
+    return sql
+
+def query(conn, sql, schema, params=()):
+    # Execute sql rewritten to the generated columns
+    return conn.execute(rewrite(sql, schema), params)
+
+def plan(conn, sql, params=()):
+    return '; '.join(row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params))
+
+# Filters as the lessons would write them
+EXAMPLES = {
+    'commands': [
+        ('Customers in area code 555',
+         "SELECT customer_id FROM customers WHERE substr(phone, 1, 3) = '555'"),
+        ('Phones starting 555',
+         "SELECT customer_id FROM customers WHERE phone LIKE '555%'"),
+        ('Customer by full name',
+         "SELECT customer_id FROM customers WHERE first_name || ' ' || last_name = 'Jane Smith'"),
+        ('Emails at a domain',
+         "SELECT COUNT(*) FROM customers WHERE email LIKE '%@email.com'"),
+    ],
+    'text': [
+        ('Emails at a domain',
+         "SELECT COUNT(*) FROM customers WHERE lower(substr(email, instr(email, '@') + 1)) = 'example.com'"),
+        ('Email, any case',
+         "SELECT customer_id FROM customers WHERE lower(email) = 'jane.smith2@example.com'"),
+    ],
+}
+
+def compare(conn, schema, runs=5):
+    # Time each example as written and rewritten, and show the new plans
+    print(f"{'Query':<28} {'as written':>12} {'rewritten':>12} {'speedup':>9} {'agrees':>7}")
+    for name, sql in EXAMPLES[schema]:
+        rewritten = rewrite(sql, schema)
+        agrees = sorted(conn.execute(sql).fetchall()) == sorted(conn.execute(rewritten).fetchall())
+        before = bench.time_query(conn, sql, runs)['p50_ms']
+        after = bench.time_query(conn, rewritten, runs)['p50_ms']
+        print(f"{name:<28} {before:>9.2f} ms {after:>9.2f} ms {before / after:>8.1f}x "
+              f"{'yes' if agrees else 'NO':>7}")
+        print(f"    {plan(conn, rewritten)}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Generated columns and indexes for derived text values.')
+    parser.add_argument('--schema', choices=GENERATED, default='commands')
+    parser.add_argument('--db', help='lesson database (default: generated at --scale)')
+    parser.add_argument('--scale', type=datagen.parse_scale, default=200000)
+    parser.add_argument('--data-dir', default=bench.DATA_DIR)
+    parser.add_argument('--drop', action='store_true', help='remove the generated columns')
+    parser.add_argument('--query', help='show how a query is rewritten and planned')
+    parser.add_argument('--compare', action='store_true', help='time the example filters')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    path = args.db or bench.database_for(args.schema, args.scale, args.data_dir)
+    conn = loader.connect(path)
+    if args.drop:
+        uninstall(conn, args.schema)
+        print("Dropped the generated columns.")
+        return
+    started = time.perf_counter()
+    install(conn, args.schema)
+    print(f"Generated columns ready in {time.perf_counter() - started:.2f}s.")
+    if args.query:
+        rewritten = rewrite(args.query, args.schema)
+        print(f"\n{rewritten}\n  {plan(conn, rewritten)}")
+    if args.compare:
+        print()
+        compare(conn, args.schema, args.runs)
+    conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+import argparse
+import time
+from collections import namedtuple
+
+from warehouse import bench, datagen, loader
+
+# Every (manager, report) pair of the employees.manager_id tree at any
+# distance, including each employee as its own depth 0 ancestor. Reports
+# of X at any level are one range of the primary key; the managers above
+# X are one range of the descendant index. Triggers keep the table in step
+# with employees. An employee whose manager_id matches no employee is the
+# root of a tree, as in the lessons' LEFT JOINs.
+CLOSURE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS employee_closure (
+        ancestor INTEGER NOT NULL,
+        depth INTEGER NOT NULL,             -- 0: itself, 1: direct report
+        descendant INTEGER NOT NULL,
+        PRIMARY KEY (ancestor, depth, descendant)
+    ) WITHOUT ROWID;
+
+    CREATE INDEX IF NOT EXISTS idx_employee_closure_descendant ON employee_closure (descendant, depth);
+
+    -- Finds the reports of a new or moved employee
+    CREATE INDEX IF NOT EXISTS idx_employees_manager ON employees (manager_id);
+'''
+
+Span = namedtuple('Span', ['direct', 'total', 'levels'])
+
+def _check_cycle(row):
+    # A manager inside the employee's own subtree would make a loop
+    return f'''
+        SELECT RAISE(ABORT, 'manager_id would make an employee report to itself')
+        WHERE EXISTS (SELECT 1 FROM employee_closure
+                      WHERE ancestor = {row}.emp_id AND descendant = {row}.manager_id);
+    '''
+
+def _link(row):
+    # Attach the subtree of row under every ancestor of its manager
+    return f'''
+        INSERT INTO employee_closure (ancestor, depth, descendant)
+        SELECT above.ancestor, above.depth + below.depth + 1, below.descendant
+        FROM employee_closure AS above, employee_closure AS below
+        WHERE above.descendant = {row}.manager_id AND below.ancestor = {row}.emp_id;
+    '''
+
+def _unlink(row):
+    # Detach the subtree of row from everything above row
+    return f'''
+        DELETE FROM employee_closure
+        WHERE descendant IN (SELECT descendant FROM employee_closure WHERE ancestor = {row}.emp_id)
+          AND ancestor NOT IN (SELECT descendant FROM employee_closure WHERE ancestor = {row}.emp_id);
+    '''
+
+def _add(row):
+    # The employee itself, then the reports that were waiting for it as
+    # their manager, then the whole subtree under its own manager
+    return f'''
+        INSERT INTO employee_closure (ancestor, depth, descendant) VALUES ({row}.emp_id, 0, {row}.emp_id);
+        INSERT INTO employee_closure (ancestor, depth, descendant)
+        SELECT {row}.emp_id, below.depth + 1, below.descendant
+        FROM employees AS report JOIN employee_closure AS below ON below.ancestor = report.emp_id
+        WHERE report.manager_id = {row}.emp_id AND report.emp_id <> {row}.emp_id;
+        {_check_cycle(row)}
+        {_link(row)}
+    '''
+
+def _remove(row):
+    # Its reports stay behind as roots of their own trees
+    return f'''
+        {_unlink(row)}
+        DELETE FROM employee_closure WHERE ancestor = {row}.emp_id;
+        DELETE FROM employee_closure WHERE descendant = {row}.emp_id;
+    '''
+
+TRIGGERS = f'''
+    CREATE TRIGGER IF NOT EXISTS employee_closure_insert AFTER INSERT ON employees BEGIN
+        {_add('new')}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS employee_closure_delete AFTER DELETE ON employees BEGIN
+        {_remove('old')}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS employee_closure_move AFTER UPDATE OF manager_id ON employees
+    WHEN old.emp_id = new.emp_id AND old.manager_id IS NOT new.manager_id BEGIN
+        {_check_cycle('new')}
+        {_unlink('new')}
+        {_link('new')}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS employee_closure_rekey AFTER UPDATE OF emp_id ON employees
+    WHEN old.emp_id <> new.emp_id BEGIN
+        {_remove('old')}
+        {_add('new')}
+    END;
+'''
+
+# Rebuild from employees: walk up from every employee to its root
+BUILD = '''
+    WITH RECURSIVE chain (ancestor, depth, descendant) AS (
+        SELECT emp_id, 0, emp_id FROM employees
+        UNION ALL
+        SELECT manager.emp_id, chain.depth + 1, chain.descendant
+        FROM chain
+        JOIN employees AS e ON e.emp_id = chain.ancestor
+        JOIN employees AS manager ON manager.emp_id = e.manager_id
+        WHERE chain.depth < ?               -- stops on a loop in manager_id
+    )
+    INSERT INTO employee_closure (ancestor, depth, descendant)
+    SELECT ancestor, depth, descendant FROM chain
+'''
+
+def rebuild(conn):
+    with loader.transaction(conn):
+        conn.execute('DELETE FROM employee_closure')
+        employees = conn.execute('SELECT COUNT(*) FROM employees').fetchone()[0]
+        conn.execute(BUILD, (employees,))
+        if conn.execute('SELECT EXISTS (SELECT 1 FROM employee_closure '
+                        'WHERE ancestor = descendant AND depth > 0)').fetchone()[0]:
+            raise ValueError("employees.manager_id has a loop")
+
+def install(conn):
+    # Create the closure table and its triggers, and fill it unless it
+    # already matches employees; safe to re-run
+    conn.executescript(CLOSURE_SCHEMA + TRIGGERS)
+    in_step = conn.execute('''
+        SELECT (SELECT COUNT(*) FROM employee_closure WHERE depth = 0) = (SELECT COUNT(*) FROM employees)
+    ''').fetchone()[0]
+    if not in_step:
+        rebuild(conn)
+
+def drop(conn):
+    conn.executescript('''
+        DROP TRIGGER IF EXISTS employee_closure_insert;
+        DROP TRIGGER IF EXISTS employee_closure_delete;
+        DROP TRIGGER IF EXISTS employee_closure_move;
+        DROP TRIGGER IF EXISTS employee_closure_rekey;
+        DROP TABLE IF EXISTS employee_closure;
+    ''')
+
+# =====================================
+# Queries
+# =====================================
+def reports(conn, emp_id, max_depth=None):
+    # [(emp_id, name, depth)] of everyone under emp_id, nearest first
+    return conn.execute('''
+        SELECT c.descendant, e.name, c.depth
+        FROM employee_closure AS c JOIN employees AS e ON e.emp_id = c.descendant
+        WHERE c.ancestor = ? AND c.depth BETWEEN 1 AND ?
+        ORDER BY c.depth, c.descendant
+    ''', (emp_id, 2 ** 31 if max_depth is None else max_depth)).fetchall()
+
+def chain_of_command(conn, emp_id):
+    # [(emp_id, name, depth)] of the managers above emp_id, from the direct
+    # manager up to the root
+    return conn.execute('''
+        SELECT c.ancestor, e.name, c.depth
+        FROM employee_closure AS c JOIN employees AS e ON e.emp_id = c.ancestor
+        WHERE c.descendant = ? AND c.depth > 0
+        ORDER BY c.depth
+    ''', (emp_id,)).fetchall()
+
+def span_of_control(conn, emp_id):
+    # Direct reports, reports at any level and levels below emp_id
+    direct, total, levels = conn.execute('''
+        SELECT COALESCE(SUM(depth = 1), 0), COUNT(*), COALESCE(MAX(depth), 0)
+        FROM employee_closure WHERE ancestor = ? AND depth > 0
+    ''', (emp_id,)).fetchone()
+    return Span(direct, total, levels)
+
+# =====================================
+# Comparison against recursive CTEs over manager_id
+# =====================================
+REPORTS_CTE = '''
+    WITH RECURSIVE under (emp_id, depth) AS (
+        SELECT emp_id, 1 FROM employees WHERE manager_id = ?
+        UNION ALL
+        SELECT e.emp_id, under.depth + 1 FROM employees AS e JOIN under ON e.manager_id = under.emp_id
+    )
+    SELECT under.emp_id, e.name, under.depth
+    FROM under JOIN employees AS e USING (emp_id)
+    ORDER BY under.depth, under.emp_id
+'''
+
+CHAIN_CTE = '''
+    WITH RECURSIVE above (emp_id, depth) AS (
+        SELECT manager_id, 1 FROM employees WHERE emp_id = ?
+        UNION ALL
+        SELECT e.manager_id, above.depth + 1 FROM employees AS e JOIN above USING (emp_id)
+    )
+    SELECT above.emp_id, e.name, above.depth
+    FROM above JOIN employees AS e USING (emp_id)
+    ORDER BY above.depth
+'''
+
+SPAN_CTE = '''
+    WITH RECURSIVE under (emp_id, depth) AS (
+        SELECT emp_id, 1 FROM employees WHERE manager_id = ?
+        UNION ALL
+        SELECT e.emp_id, under.depth + 1 FROM employees AS e JOIN under ON e.manager_id = under.emp_id
+    )
+    SELECT COALESCE(SUM(depth = 1), 0), COUNT(*), COALESCE(MAX(depth), 0) FROM under
+'''
+
+def compare(conn, manager, employee, runs=5):
+    # Each question by a recursive CTE walking manager_id and by the closure
+    questions = [
+        (f'All reports under {manager}',
+         lambda: conn.execute(REPORTS_CTE, (manager,)).fetchall(),
+         lambda: reports(conn, manager)),
+        (f'Chain of command of {employee}',
+         lambda: conn.execute(CHAIN_CTE, (employee,)).fetchall(),
+         lambda: chain_of_command(conn, employee)),
+        (f'Span of control of {manager}',
+         lambda: tuple(conn.execute(SPAN_CTE, (manager,)).fetchone()),
+         lambda: tuple(span_of_control(conn, manager))),
+    ]
+    print(f"{'Question':<32} {'CTE':>12} {'closure':>12} {'speedup':>9} {'agrees':>7}")
+    for name, walk, closure in questions:
+        agrees = walk() == closure()
+        before, after = bench.time_callable(walk, runs), bench.time_callable(closure, runs)
+        print(f"{name:<32} {bench.format_ms(before, 3)} {bench.format_ms(after, 3)} "
+              f"{bench.format_speedup(before, after)} {bench.format_agrees(agrees)}")
+
+def write_overhead(conn, moves=1000):
+    # Seconds to move `moves` employees to another manager with and
+    # without the triggers, rolled back afterwards
+    ids = [row[0] for row in conn.execute(
+        'SELECT emp_id FROM employees WHERE manager_id IS NOT NULL ORDER BY emp_id DESC LIMIT ?', (moves,))]
+    root = conn.execute('SELECT MIN(emp_id) FROM employees').fetchone()[0]
+    timings = {}
+    for label, sql in (('with closure', None), ('plain', 'DROP TRIGGER employee_closure_move')):
+        conn.execute('BEGIN')
+        try:
+            if sql:
+                conn.execute(sql)
+            started = time.perf_counter()
+            conn.executemany('UPDATE employees SET manager_id = ? WHERE emp_id = ?', [(root, i) for i in ids])
+            timings[label] = time.perf_counter() - started
+        finally:
+            conn.rollback()
+    print(f"\nMoving {len(ids):,} employees: {timings['plain'] * 1000:.1f} ms plain, "
+          f"{timings['with closure'] * 1000:.1f} ms with the closure table")
+
+def main():
+    parser = argparse.ArgumentParser(description='Closure table of the employees.manager_id hierarchy.')
+    parser.add_argument('--schema', choices=['tasks', 'joins'], default='tasks')
+    parser.add_argument('--db', help='lesson database (default: generated at --scale)')
+    parser.add_argument('--scale', type=datagen.parse_scale, default=200000)
+    parser.add_argument('--data-dir', default=bench.DATA_DIR)
+    parser.add_argument('--employee', type=int, help='show the reports, managers and span of an employee')
+    parser.add_argument('--rebuild', action='store_true', help='refill the closure table from employees')
+    parser.add_argument('--drop', action='store_true', help='remove the closure table and triggers')
+    parser.add_argument('--compare', action='store_true', help='time the closure against recursive CTEs')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    path = args.db or bench.database_for(args.schema, args.scale, args.data_dir)
+    conn = loader.connect(path)
+    if args.drop:
+        drop(conn)
+        print("Dropped the closure table.")
+        return
+    started = time.perf_counter()
+    install(conn)
+    if args.rebuild:
+        rebuild(conn)
+    rows = conn.execute('SELECT COUNT(*) FROM employee_closure').fetchone()[0]
+    print(f"Closure table ready in {time.perf_counter() - started:.2f}s: {rows:,} rows.")
+
+    if args.employee is not None:
+        span = span_of_control(conn, args.employee)
+        print(f"\nEmployee {args.employee}: {span.direct:,} direct reports, "
+              f"{span.total:,} in total over {span.levels} levels")
+        print("Chain of command:", ' -> '.join(f'{name} ({emp_id})'
+                                               for emp_id, name, _ in chain_of_command(conn, args.employee)))
+    if args.compare:
+        root = conn.execute('SELECT MIN(emp_id) FROM employees').fetchone()[0]
+        deepest = conn.execute('SELECT descendant FROM employee_closure ORDER BY depth DESC LIMIT 1').fetchone()[0]
+        print()
+        compare(conn, args.employee or root, deepest, args.runs)
+        write_overhead(conn)
+    conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+import time
+
+from warehouse import partition
+
+# High-water marks of every incrementally loaded source table, stored next
+# to the data they describe so both commit in the same transaction
+WATERMARK_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS etl_watermarks (
+        source TEXT PRIMARY KEY,              -- e.g. 'tasks.employees'
+        watermark_column TEXT NOT NULL,       -- e.g. employees_changes.seq or orders.created_at
+        value,                                -- highest value already loaded
+        loaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+'''
+
+# Lower bound for a table that was never loaded. SQLite sorts integers
+# before text, so this works for numeric keys and for timestamps alike.
+MIN_WATERMARK = -(2 ** 63)
+
+def create_watermark_table(conn):
+    conn.executescript(WATERMARK_SCHEMA)
+
+def get_watermark(conn, source, column=None):
+    # MIN_WATERMARK too when the value was kept for another column
+    row = conn.execute('SELECT value, watermark_column FROM etl_watermarks WHERE source = ?',
+                       (source,)).fetchone()
+    if row is None or row[0] is None or (column is not None and row[1] != column):
+        return MIN_WATERMARK
+    return row[0]
+
+def set_watermark(conn, source, column, value):
+    conn.execute('''
+        INSERT INTO etl_watermarks (source, watermark_column, value, loaded_at)
+        VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(source) DO UPDATE SET
+            watermark_column = excluded.watermark_column,
+            value = excluded.value,
+            loaded_at = excluded.loaded_at
+    ''', (source, column, value))
+
+def reset_watermarks(conn, prefix=''):
+    # Forget what was loaded so the next run starts from scratch
+    conn.execute('DELETE FROM etl_watermarks WHERE source LIKE ?', (prefix + '%',))
+    conn.commit()
+
+def high_water(conn, schema, table, column):
+    # Current maximum of the watermark column in an (attached) source table
+    return conn.execute(f'SELECT MAX({column}) FROM {schema}.{table}').fetchone()[0]
+
+def watermarks(conn):
+    return conn.execute('''
+        SELECT source, watermark_column, value, loaded_at
+        FROM etl_watermarks
+        ORDER BY source
+    ''').fetchall()
+
+# =====================================
+# Change logs
+# =====================================
+# A source table without a column that grows on every write gets a log
+# kept by triggers: the key of each row inserted, updated or deleted, with
+# a sequence number that only grows, also when the table is emptied and
+# refilled. The log is the watermark table of the source.
+def changes_table(table):
+    return f'{table}_changes'
+
+def _drop_triggers(conn, schema, log):
+    # The log's triggers, on the table or on each of its partitions
+    names = [row[0] for row in conn.execute(
+        f"SELECT name FROM {schema}.sqlite_master WHERE type = 'trigger' AND name LIKE ? ESCAPE '\\'",
+        (log.replace('_', '\\_') + '\\_%',))]
+    for name in names:
+        conn.execute(f'DROP TRIGGER IF EXISTS {schema}."{name}"')
+
+def track_changes(conn, schema, table, key):
+    # Install the change log of schema.table, keyed by its column key (or
+    # rowid); rows already there are logged once. Safe to re-run. The
+    # triggers go on the partitions of a partitioned table.
+    log = changes_table(table)
+    exists = conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?",
+                          (log,)).fetchone()
+
+    def record(row):
+        # Inside a trigger OR REPLACE would give way to the conflict policy
+        # of the statement that fired it (ABORT under loader.upsert); an
+        # ON CONFLICT clause keeps its own
+        return (f'INSERT INTO {log} (row_key, seq) '
+                f'VALUES ({row}.{key}, (SELECT COALESCE(MAX(seq), 0) + 1 FROM {log})) '
+                f'ON CONFLICT (row_key) DO UPDATE SET seq = excluded.seq;')
+    conn.executescript(f'''
+        CREATE TABLE IF NOT EXISTS {schema}.{log} (
+            row_key INTEGER PRIMARY KEY,
+            seq INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS {schema}.idx_{log}_seq ON {log} (seq);
+    ''')
+    # The triggers are always recreated, so logs installed with older
+    # trigger bodies get the current ones
+    _drop_triggers(conn, schema, log)
+    for target in partition.physical_tables(conn, table, schema):
+        insert, update, delete = (partition.on_partition(f'{log}_{event}', table, target)
+                                  for event in ('insert', 'update', 'delete'))
+        conn.executescript(f'''
+            CREATE TRIGGER {schema}.{insert} AFTER INSERT ON {target} BEGIN
+                {record('new')}
+            END;
+            CREATE TRIGGER {schema}.{update} AFTER UPDATE ON {target} BEGIN
+                {record('old')}
+                {record('new')}
+            END;
+            CREATE TRIGGER {schema}.{delete} AFTER DELETE ON {target} BEGIN
+                {record('old')}
+            END;
+        ''')
+    if not exists:
+        conn.execute(f'INSERT OR IGNORE INTO {schema}.{log} (row_key, seq) '
+                     f'SELECT {key}, 0 FROM {schema}.{table}')
+        conn.commit()
+
+def untrack_changes(conn, schema, table):
+    log = changes_table(table)
+    _drop_triggers(conn, schema, log)
+    conn.execute(f'DROP TABLE IF EXISTS {schema}.{log}')
+    conn.commit()
+
+def run_step(conn, source, table, key, sql, schema='src', column=None, pending=None):
+    # Run the statements of sql for the rows of schema.table that changed
+    # since the last load: its {changed} placeholder is a subquery of their
+    # keys. Without column, changes come from the table's change log;
+    # with one, from rows whose column lies in (last load, current
+    # maximum]. Rows written after the maximum was read wait for the next
+    # run. pending, if given, selects the keys of changed rows that cannot
+    # be loaded yet; the load then stops before the first of them. Returns
+    # (rows written, seconds, rows waiting); the caller commits.
+    if column is None:
+        watermark_table, watermark = changes_table(table), 'seq'
+        changed = (f'(SELECT row_key FROM {schema}.{watermark_table} '
+                   f'WHERE seq > :since AND seq <= :until)')
+    else:
+        watermark_table, watermark = table, column
+        changed = (f'(SELECT {key} FROM {schema}.{table} '
+                   f'WHERE {column} > :since AND {column} <= :until)')
+    stored = f'{watermark_table}.{watermark}'
+    since = get_watermark(conn, source, stored)
+    until = high_water(conn, schema, watermark_table, watermark)
+    if until is None:
+        return 0, 0.0, 0
+    if since != MIN_WATERMARK and until < since:
+        # The source was rebuilt below what was loaded: load all of it again
+        since = MIN_WATERMARK
+    if since != MIN_WATERMARK and until == since:
+        return 0, 0.0, 0
+    started = time.perf_counter()
+    params = {'since': since, 'until': until}
+    waiting = 0
+    if pending is not None:
+        blocked = f'({pending.format(changed=changed)})'
+        if column is None:
+            first, waiting = conn.execute(f'SELECT MIN(seq), COUNT(*) FROM {schema}.{watermark_table} '
+                                          f'WHERE row_key IN {blocked}', params).fetchone()
+        else:
+            first, waiting = conn.execute(f'SELECT MIN({column}), COUNT(*) FROM {schema}.{table} '
+                                          f'WHERE {key} IN {blocked}', params).fetchone()
+        if first is not None:
+            until = conn.execute(f'SELECT MAX({watermark}) FROM {schema}.{watermark_table} '
+                                 f'WHERE {watermark} > :since AND {watermark} < :first',
+                                 {'since': since, 'first': first}).fetchone()[0]
+            if until is None:
+                return 0, time.perf_counter() - started, waiting
+            params['until'] = until
+    changes = conn.total_changes
+    for statement in sql.format(changed=changed).split(';'):
+        if statement.strip():
+            conn.execute(statement, params)
+    rows = conn.total_changes - changes
+    set_watermark(conn, source, stored, until)
+    return rows, time.perf_counter() - started, waiting
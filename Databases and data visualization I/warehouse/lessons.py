@@ -0,0 +1,44 @@
+import importlib
+import os
+import sys
+
+# Folder that holds the numbered lesson directories
+COURSE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Lesson script -> lesson directory (the script lives in its files/ folder)
+LESSON_DIRS = {
+    'aggregation': '2. Aggregation and joins in SQL',
+    'joins': '2. Aggregation and joins in SQL',
+    'tasks': '2. Aggregation and joins in SQL',
+    'commands': '3. Handling text with SQL, advanced filtering',
+    'text': '3. Handling text with SQL, advanced filtering',
+}
+
+# Lesson scripts whose example queries can be loaded with queries()
+QUERY_SETS = ['aggregation', 'joins', 'tasks']
+
+def files_dir(name):
+    return os.path.join(COURSE_DIR, LESSON_DIRS[name], 'files')
+
+def load(name):
+    # Lesson folders contain spaces, so put the files/ folder on sys.path
+    # and import the script as a plain module
+    if name not in LESSON_DIRS:
+        raise KeyError(f"Unknown lesson script: {name}")
+    path = files_dir(name)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+    return importlib.import_module(name)
+
+def queries(name):
+    # Example queries shipped with a lesson script as a flat [(name, sql), ...] list
+    module = load(name)
+    if name == 'aggregation':
+        return [(f'{category}: {description}', query)
+                for category, examples in module.EXAMPLES.items()
+                for description, query in examples]
+    if name == 'joins':
+        return list(module.EXAMPLE_QUERIES.items())
+    if name == 'tasks':
+        return list(module.TASKS)
+    raise KeyError(f"Lesson script has no query set: {name}")
@@ -0,0 +1,231 @@
+import itertools
+import sqlite3
+import time
+from contextlib import contextmanager
+
+# Rows written between two commits
+BATCH_SIZE = 50000
+
+# Settings for databases that are read and written interactively: WAL lets
+# readers run next to a writer and synchronous=NORMAL is safe with WAL
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,        # negative values are KiB, so 64 MB
+    'mmap_size': 256 * 1024 ** 2,
+    'temp_store': 'MEMORY',
+}
+
+# Settings for loading generated data that can simply be rebuilt after a
+# crash: no journal, no fsync and a large page cache
+BULK_PRAGMAS = {
+    'journal_mode': 'OFF',
+    'synchronous': 'OFF',
+    'cache_size': -262144,
+    'mmap_size': 1024 ** 3,
+    'temp_store': 'MEMORY',
+}
+
+PRAGMA_CHOICES = {
+    'journal_mode': {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'},
+    'synchronous': {'OFF', 'NORMAL', 'FULL', 'EXTRA'},
+    'temp_store': {'DEFAULT', 'FILE', 'MEMORY'},
+}
+INTEGER_PRAGMAS = {'cache_size', 'mmap_size'}
+
+def apply_pragmas(conn, pragmas):
+    # Pragmas cannot take bound parameters, so validate the values instead
+    for name, value in pragmas.items():
+        if value is None:
+            continue
+        if name in INTEGER_PRAGMAS:
+            value = int(value)
+        elif name in PRAGMA_CHOICES:
+            value = str(value).upper()
+            if value not in PRAGMA_CHOICES[name]:
+                raise ValueError(f"Invalid value for PRAGMA {name}: {value}")
+        else:
+            raise ValueError(f"Unsupported pragma: {name}")
+        conn.execute(f'PRAGMA {name} = {value}').fetchall()
+
+def connect(path, pragmas=None, **overrides):
+    # sqlite3.connect() with tuned pragmas. Any pragma can be overridden by
+    # keyword, e.g. connect('practice.db', journal_mode='DELETE')
+    settings = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+    pragma_overrides = {k: overrides.pop(k) for k in list(overrides) if k in DEFAULT_PRAGMAS}
+    settings.update(pragma_overrides)
+    conn = sqlite3.connect(path, **overrides)
+    apply_pragmas(conn, settings)
+    return conn
+
+@contextmanager
+def transaction(conn):
+    # Commit everything in the block at once, or roll all of it back
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+class BatchWriter:
+    # Groups many writes into few transactions by committing every
+    # `batch_size` rows instead of after every statement. batch_size=None
+    # keeps everything in one transaction until commit().
+    def __init__(self, conn, batch_size=BATCH_SIZE):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.cursor = conn.cursor()
+        self.rows = 0
+        self.pending = 0
+        self.started = time.perf_counter()
+
+    def execute(self, sql, params=()):
+        self.cursor.execute(sql, params)
+        self._written(max(self.cursor.rowcount, 0))
+
+    def executemany(self, sql, rows):
+        if self.batch_size is None:
+            # executemany consumes iterators lazily, so memory stays flat
+            self.cursor.executemany(sql, rows)
+            self._written(self.cursor.rowcount)
+            return
+        for chunk in chunked(rows, self.batch_size):
+            self.cursor.executemany(sql, chunk)
+            self._written(len(chunk))
+
+    def _written(self, count):
+        self.rows += count
+        self.pending += count
+        if self.batch_size and self.pending >= self.batch_size:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self.pending = 0
+
+    def stats(self):
+        seconds = time.perf_counter() - self.started
+        return {'rows': self.rows, 'seconds': seconds,
+                'rows_per_sec': self.rows / seconds if seconds else 0.0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.conn.rollback()
+
+def drop_indexes(conn, table):
+    # Drop the explicit indexes of a table and return their CREATE statements.
+    # Automatic indexes (PRIMARY KEY / UNIQUE) have no SQL and are kept.
+    indexes = conn.execute('''
+        SELECT name, sql FROM sqlite_master
+        WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL
+    ''', (table,)).fetchall()
+    for name, _ in indexes:
+        conn.execute(f'DROP INDEX IF EXISTS "{name}"')
+    return [sql for _, sql in indexes]
+
+def rebuild_indexes(conn, statements):
+    for sql in statements:
+        conn.execute(sql)
+    conn.commit()
+
+def load(conn, table, rows, columns=None, batch_size=BATCH_SIZE, replace=False,
+         rebuild=True):
+    # Bulk insert rows into table and return load statistics. Indexes are
+    # dropped first and rebuilt once at the end, which is much faster than
+    # updating them for every row.
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return {'rows': 0, 'seconds': 0.0, 'rows_per_sec': 0.0, 'index_seconds': 0.0}
+    rows = itertools.chain([first], rows)
+
+    verb = 'INSERT OR REPLACE' if replace else 'INSERT'
+    target = f'{table} ({", ".join(columns)})' if columns else table
+    placeholders = ', '.join('?' for _ in first)
+    sql = f'{verb} INTO {target} VALUES ({placeholders})'
+
+    indexes = drop_indexes(conn, table) if rebuild else []
+    try:
+        with BatchWriter(conn, batch_size) as writer:
+            writer.executemany(sql, rows)
+    finally:
+        # Also when a row fails, or the table is left without its indexes
+        started = time.perf_counter()
+        rebuild_indexes(conn, indexes)
+    stats = writer.stats()
+    stats['index_seconds'] = time.perf_counter() - started
+    return stats
+
+def table_columns(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+def upsert_clause(columns, keys):
+    # ON CONFLICT clause that updates a row only when a value actually
+    # changed, so re-loading identical rows writes nothing
+    values = [c for c in columns if c not in keys]
+    if not values:
+        return f'ON CONFLICT ({", ".join(keys)}) DO NOTHING'
+    assignments = ', '.join(f'{c} = excluded.{c}' for c in values)
+    current = ', '.join(values)
+    incoming = ', '.join(f'excluded.{c}' for c in values)
+    return (f'ON CONFLICT ({", ".join(keys)}) DO UPDATE SET {assignments} '
+            f'WHERE ({current}) IS NOT ({incoming})')
+
+def is_view(conn, table):
+    return conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (table,)).fetchone() == ('view',)
+
+def view_upsert_sql(table, columns, keys):
+    # UPDATE and INSERT that together upsert one row into a view with
+    # INSTEAD OF triggers (e.g. a table split by warehouse.partition), which
+    # ON CONFLICT cannot target. ?N is the row's Nth value.
+    number = {c: i + 1 for i, c in enumerate(columns)}
+    match = ' AND '.join(f'{k} = ?{number[k]}' for k in keys)
+    values = [c for c in columns if c not in keys]
+    update = None
+    if values:
+        update = (f'UPDATE {table} SET {", ".join(f"{c} = ?{number[c]}" for c in values)} '
+                  f'WHERE {match} AND ({", ".join(values)}) IS NOT '
+                  f'({", ".join(f"?{number[c]}" for c in values)})')
+    insert = (f'INSERT INTO {table} ({", ".join(columns)}) '
+              f'SELECT {", ".join(f"?{number[c]}" for c in columns)} '
+              f'WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE {match})')
+    return update, insert
+
+def upsert(conn, table, rows, keys, columns=None, batch_size=BATCH_SIZE):
+    # Insert new rows and update changed ones by key instead of
+    # INSERT OR REPLACE, which deletes and re-inserts every row
+    columns = columns or table_columns(conn, table)
+    changes = conn.total_changes
+    if is_view(conn, table):
+        update, insert = view_upsert_sql(table, columns, keys)
+        with BatchWriter(conn, batch_size) as writer:
+            for row in rows:
+                if update:
+                    writer.execute(update, row)
+                writer.execute(insert, row)
+        return conn.total_changes - changes
+    placeholders = ', '.join('?' for _ in columns)
+    sql = (f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({placeholders}) '
+           f'{upsert_clause(columns, keys)}')
+    with BatchWriter(conn, batch_size) as writer:
+        writer.executemany(sql, rows)
+    return conn.total_changes - changes
+
+def format_stats(table, stats):
+    return (f"{table}: {stats['rows']:,} rows in {stats['seconds']:.2f}s "
+            f"({stats['rows_per_sec']:,.0f} rows/sec)")
@@ -0,0 +1,220 @@
+import argparse
+import sqlite3
+import time
+from collections import namedtuple
+
+from warehouse import bench, datagen, loader, partition
+
+# A small reference table for a repeated string: base tables store its
+# integer key and join the table for the value's label, instead of storing
+# the string and translating it with a CASE on every read
+Lookup = namedtuple('Lookup', ['table', 'key', 'value', 'label', 'rows'])
+
+# Ranges of a number, for CASE WHEN x < a THEN ... chains. rows are
+# (key, lowest value, highest value + 1 or None, label).
+Bands = namedtuple('Bands', ['table', 'key', 'low', 'high', 'label', 'rows'])
+
+# A base table column whose strings are replaced by the lookup's keys
+Encoded = namedtuple('Encoded', ['table', 'column', 'lookup'])
+
+ORDER_STATUSES = Lookup('order_statuses', 'status_code', 'order_status', 'status_text', [
+    (1, 'Pending', 'Open'),
+    (2, 'Shipping', 'In Progress'),
+    (3, 'Delivered', 'Closed'),
+])
+
+STOCK_LEVELS = Bands('stock_levels', 'level_code', 'min_stock', 'max_stock', 'stock_status', [
+    (1, None, 20, 'Low Stock'),
+    (2, 20, 30, 'Medium Stock'),
+    (3, 30, None, 'High Stock'),
+])
+
+# Label of strings the lookup did not know, as in the lessons' CASE ... ELSE
+UNKNOWN = 'Unknown'
+
+ENCODED = {
+    'commands': [Encoded('orders', 'order_status', ORDER_STATUSES)],
+    'text': [Encoded('orders', 'order_status', ORDER_STATUSES)],
+}
+
+def _literal(value):
+    if value is None:
+        return 'NULL'
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return repr(value)
+
+def sql(lookup):
+    # CREATE TABLE and rows of a lookup, to prepend to a lesson's SCHEMA so
+    # every database built from it has the table. Re-running updates labels.
+    if isinstance(lookup, Bands):
+        columns = [lookup.key, lookup.low, lookup.high, lookup.label]
+        table = f'''
+    CREATE TABLE IF NOT EXISTS {lookup.table} (
+        {lookup.key} INTEGER PRIMARY KEY,
+        {lookup.low} INTEGER,             -- NULL: no lower bound
+        {lookup.high} INTEGER,            -- exclusive, NULL: no upper bound
+        {lookup.label} TEXT NOT NULL
+    );
+'''
+    else:
+        columns = [lookup.key, lookup.value, lookup.label]
+        table = f'''
+    CREATE TABLE IF NOT EXISTS {lookup.table} (
+        {lookup.key} INTEGER PRIMARY KEY,
+        {lookup.value} TEXT NOT NULL UNIQUE,
+        {lookup.label} TEXT NOT NULL
+    );
+'''
+    values = ',\n        '.join('(' + ', '.join(_literal(v) for v in row) + ')' for row in lookup.rows)
+    return table + f'''
+    INSERT INTO {lookup.table} ({", ".join(columns)}) VALUES
+        {values}
+    {loader.upsert_clause(columns, [lookup.key])};
+'''
+
+def create(conn, lookup):
+    # sql(lookup) one statement at a time: unlike executescript() this does
+    # not commit the caller's open transaction
+    for statement in sql(lookup).split(';'):
+        if statement.strip():
+            conn.execute(statement)
+
+def codes(lookup):
+    return {value: key for key, value, _ in lookup.rows}
+
+def encode(lookup, value):
+    # Key of a value, for code that writes the base tables
+    try:
+        return codes(lookup)[value]
+    except KeyError:
+        raise ValueError(f"Unknown {lookup.value}: {value!r}") from None
+
+def encode_rows(lookup, rows, index):
+    # rows with the value at position index replaced by its key
+    return [row[:index] + (encode(lookup, row[index]),) + row[index + 1:] for row in rows]
+
+def _drop_indexes_on(conn, table, column):
+    # DROP COLUMN refuses to drop an indexed column
+    for index in [row[1] for row in conn.execute(f'PRAGMA index_list({table})')]:
+        if column in [row[2] for row in conn.execute(f'PRAGMA index_info({index})')]:
+            conn.execute(f'DROP INDEX {index}')
+
+def encode_column(conn, encoded):
+    # Replace the strings of a base table column by the lookup's keys. Safe
+    # to re-run; strings the lookup does not know get new keys labelled
+    # UNKNOWN. Returns the number of rows converted.
+    table, column, lookup = encoded
+    conn.executescript(sql(lookup))
+    converted = 0
+    if column in loader.table_columns(conn, table):
+        with loader.transaction(conn):
+            conn.execute(f'''
+                INSERT INTO {lookup.table} ({lookup.key}, {lookup.value}, {lookup.label})
+                SELECT (SELECT COALESCE(MAX({lookup.key}), 0) FROM {lookup.table})
+                       + ROW_NUMBER() OVER (ORDER BY {column}), {column}, ?
+                FROM (SELECT DISTINCT {column} FROM {table}
+                      WHERE {column} IS NOT NULL
+                        AND {column} NOT IN (SELECT {lookup.value} FROM {lookup.table}))
+            ''', (UNKNOWN,))
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {lookup.key} INTEGER '
+                         f'REFERENCES {lookup.table} ({lookup.key})')
+            converted = conn.execute(f'''
+                UPDATE {table} SET {lookup.key} = (
+                    SELECT {lookup.key} FROM {lookup.table} WHERE {lookup.value} = {table}.{column}
+                )
+            ''').rowcount
+            _drop_indexes_on(conn, table, column)
+            conn.execute(f'ALTER TABLE {table} DROP COLUMN {column}')
+    partition.create_index(conn, f'idx_{table}_{lookup.key}', table, lookup.key)
+    conn.commit()
+    return converted
+
+def install(conn, schema):
+    # Lookup tables, integer codes and their indexes for a lesson database;
+    # returns {table.column: rows converted from strings}
+    return {f'{e.table}.{e.column}': encode_column(conn, e) for e in ENCODED[schema]}
+
+# =====================================
+# Comparison against the string column and CASE
+# =====================================
+def _case(lookup, column):
+    whens = ' '.join(f"WHEN {_literal(value)} THEN {_literal(label)}" for _, value, label in lookup.rows)
+    return f"CASE {column} {whens} ELSE {_literal(UNKNOWN)} END"
+
+def table_bytes(conn, table):
+    # Bytes of a table and its indexes, or None without the dbstat table
+    try:
+        return conn.execute('''
+            SELECT SUM(pgsize) FROM dbstat
+            WHERE name = ? OR name IN (SELECT name FROM sqlite_master WHERE tbl_name = ? AND type = 'index')
+        ''', (table, table)).fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+
+def compare(conn, encoded, runs=5):
+    # Rebuild the table with the strings in a scratch copy, then time
+    # GROUP BY on the CASE against GROUP BY on the code and compare sizes
+    table, column, lookup = encoded
+    scratch = f'lookup_compare_{table}'
+    columns = [c for c in loader.table_columns(conn, table) if c != lookup.key]
+    conn.execute(f'DROP TABLE IF EXISTS {scratch}')
+    conn.execute(f'''
+        CREATE TABLE {scratch} AS
+        SELECT {", ".join(f"t.{c}" for c in columns)}, l.{lookup.value} AS {column}
+        FROM {table} AS t LEFT JOIN {lookup.table} AS l USING ({lookup.key})
+    ''')
+    conn.execute(f'CREATE INDEX idx_{scratch}_{column} ON {scratch} ({column})')
+    conn.commit()
+    try:
+        queries = [
+            ('Count by status',
+             f'SELECT {_case(lookup, column)} AS status, COUNT(*) FROM {scratch} GROUP BY status',
+             f'''SELECT COALESCE(l.{lookup.label}, '{UNKNOWN}') AS status, SUM(counts.n)
+                 FROM (SELECT {lookup.key}, COUNT(*) AS n FROM {table} GROUP BY {lookup.key}) AS counts
+                 LEFT JOIN {lookup.table} AS l USING ({lookup.key})
+                 GROUP BY status'''),
+            ('Rows with status text',
+             f'SELECT {columns[0]}, {_case(lookup, column)} FROM {scratch}',
+             f'''SELECT t.{columns[0]}, COALESCE(l.{lookup.label}, '{UNKNOWN}')
+                 FROM {table} AS t LEFT JOIN {lookup.table} AS l USING ({lookup.key})'''),
+        ]
+        print(f"{'Query':<24} {'CASE':>12} {'lookup':>12} {'speedup':>9} {'agrees':>7}")
+        for name, before_sql, after_sql in queries:
+            agrees = sorted(conn.execute(before_sql).fetchall()) == sorted(conn.execute(after_sql).fetchall())
+            before = bench.time_query(conn, before_sql, runs)['p50_ms']
+            after = bench.time_query(conn, after_sql, runs)['p50_ms']
+            print(f"{name:<24} {before:>9.2f} ms {after:>9.2f} ms {before / after:>8.1f}x "
+                  f"{'yes' if agrees else 'NO':>7}")
+        before, after = table_bytes(conn, scratch), table_bytes(conn, table)
+        if before and after:
+            print(f"\n{table} with strings: {before / 1024 ** 2:.2f} MB, "
+                  f"with codes: {after / 1024 ** 2:.2f} MB ({1 - after / before:.0%} smaller)")
+    finally:
+        conn.execute(f'DROP TABLE IF EXISTS {scratch}')
+        conn.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description='Lookup tables with integer codes for status strings.')
+    parser.add_argument('--schema', choices=ENCODED, default='commands')
+    parser.add_argument('--db', help='lesson database (default: generated at --scale)')
+    parser.add_argument('--scale', type=datagen.parse_scale, default=200000)
+    parser.add_argument('--data-dir', default=bench.DATA_DIR)
+    parser.add_argument('--compare', action='store_true',
+                        help='time CASE on the strings against the lookup join')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    path = args.db or bench.database_for(args.schema, args.scale, args.data_dir)
+    conn = loader.connect(path)
+    started = time.perf_counter()
+    for column, count in install(conn, args.schema).items():
+        print(f"{column}: {count:,} rows converted in {time.perf_counter() - started:.2f}s")
+    if args.compare:
+        for encoded in ENCODED[args.schema]:
+            print()
+            compare(conn, encoded, args.runs)
+    conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+import argparse
+import itertools
+import time
+from collections import namedtuple
+
+from warehouse import bench, datagen, lessons, loader
+
+# One aggregate of a summary, e.g. Aggregate('avg_salary', 'AVG', 'salary', 2)
+# for ROUND(AVG(salary), 2) AS avg_salary. COUNT may use '*' as its column.
+Aggregate = namedtuple('Aggregate', ['alias', 'function', 'column', 'digits'], defaults=[None])
+
+# A GROUP BY query kept as a summary table. having is written against the
+# aggregate aliases, e.g. 'employee_count > 2'.
+Summary = namedtuple('Summary', ['name', 'table', 'group_by', 'aggregates', 'having'],
+                     defaults=[None])
+
+FUNCTIONS = {'COUNT', 'SUM', 'AVG', 'MIN', 'MAX'}
+
+# The "GROUP BY Examples" of aggregation.py, keyed by their description
+AGGREGATION_SUMMARIES = {
+    'Count employees by department': Summary(
+        'department_counts', 'employees', ('department',),
+        [Aggregate('employee_count', 'COUNT', '*')]),
+    'Department salary statistics': Summary(
+        'department_salary_stats', 'employees', ('department',),
+        [Aggregate('employee_count', 'COUNT', '*'),
+         Aggregate('avg_salary', 'AVG', 'salary', 2),
+         Aggregate('max_salary', 'MAX', 'salary'),
+         Aggregate('min_salary', 'MIN', 'salary')]),
+    'Departments with more than 2 employees': Summary(
+        'large_departments', 'employees', ('department',),
+        [Aggregate('employee_count', 'COUNT', '*')],
+        having='employee_count > 2'),
+}
+
+def state_table(summary):
+    return f'mv_{summary.name}'
+
+def _state_columns(summary):
+    # {state column: (function, source column)} needed to maintain the
+    # aggregates. AVG is kept as SUM and COUNT; SUM needs the COUNT to know
+    # when every value of a group is NULL again.
+    columns = {'row_count': ('COUNT', '*')}
+    for agg in summary.aggregates:
+        function = agg.function.upper()
+        if function not in FUNCTIONS:
+            raise ValueError(f"Cannot maintain {agg.function}() incrementally")
+        if agg.column == '*':
+            if function != 'COUNT':
+                raise ValueError(f"{function}(*) is not an aggregate")
+            continue
+        if function in ('COUNT', 'SUM', 'AVG'):
+            columns[f'n_{agg.column}'] = ('COUNT', agg.column)
+        if function in ('SUM', 'AVG'):
+            columns[f'sum_{agg.column}'] = ('SUM', agg.column)
+        if function in ('MIN', 'MAX'):
+            columns[f'{function.lower()}_{agg.column}'] = (function, agg.column)
+    return columns
+
+def _output(agg):
+    # Expression over the state table that returns the aggregate
+    function = agg.function.upper()
+    if agg.column == '*':
+        expr = 'row_count'
+    elif function == 'COUNT':
+        expr = f'n_{agg.column}'
+    elif function == 'SUM':
+        expr = f'sum_{agg.column}'
+    elif function == 'AVG':
+        expr = f'CAST(sum_{agg.column} AS REAL) / n_{agg.column}'
+    else:
+        expr = f'{function.lower()}_{agg.column}'
+    if agg.digits is not None:
+        expr = f'ROUND({expr}, {agg.digits})'
+    return f'{expr} AS {agg.alias}'
+
+def _same_group(summary, row):
+    # IS instead of = so that a NULL group key matches itself
+    return ' AND '.join(f'{col} IS {row}.{col}' for col in summary.group_by)
+
+def _add_row(summary, row='NEW'):
+    # Fold one source row into its group, creating the group if needed
+    table = state_table(summary)
+    assignments = []
+    values = []
+    for name, (function, column) in _state_columns(summary).items():
+        value = f'{row}.{column}'
+        if column == '*':
+            assignments.append(f'{name} = {name} + 1')
+            values.append('1')
+        elif function == 'COUNT':
+            assignments.append(f'{name} = {name} + ({value} IS NOT NULL)')
+            values.append(f'({value} IS NOT NULL)')
+        elif function == 'SUM':
+            assignments.append(f'{name} = CASE WHEN {value} IS NULL THEN {name} '
+                               f'ELSE COALESCE({name}, 0) + {value} END')
+            values.append(value)
+        else:
+            op = '>' if function == 'MAX' else '<'
+            assignments.append(f'{name} = CASE WHEN {name} IS NULL OR {value} {op} {name} '
+                               f'THEN {value} ELSE {name} END')
+            values.append(value)
+    group = ', '.join(summary.group_by)
+    new_group = ', '.join(f'{row}.{col}' for col in summary.group_by)
+    columns = ', '.join(_state_columns(summary))
+    return f'''
+        UPDATE {table} SET {', '.join(assignments)}
+        WHERE {_same_group(summary, row)};
+        INSERT INTO {table} ({group}, {columns})
+        SELECT {new_group}, {', '.join(values)}
+        WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE {_same_group(summary, row)});
+    '''
+
+def _remove_row(summary, row='OLD'):
+    # Take one source row out of its group. MIN/MAX cannot be undone from the
+    # state alone, so they are looked up again when the extreme row leaves.
+    table = state_table(summary)
+    assignments = []
+    for name, (function, column) in _state_columns(summary).items():
+        value = f'{row}.{column}'
+        if column == '*':
+            assignments.append(f'{name} = {name} - 1')
+        elif function == 'COUNT':
+            assignments.append(f'{name} = {name} - ({value} IS NOT NULL)')
+        elif function == 'SUM':
+            assignments.append(f'{name} = CASE WHEN {value} IS NULL THEN {name} '
+                               f'WHEN n_{column} = 1 THEN NULL ELSE {name} - {value} END')
+        else:
+            assignments.append(f'{name} = CASE WHEN {value} = {name} THEN '
+                               f'(SELECT {function}({column}) FROM {summary.table} '
+                               f'WHERE {_same_group(summary, row)}) ELSE {name} END')
+    return f'''
+        UPDATE {table} SET {', '.join(assignments)}
+        WHERE {_same_group(summary, row)};
+        DELETE FROM {table} WHERE {_same_group(summary, row)} AND row_count = 0;
+    '''
+
+def create_sql(summary):
+    table = state_table(summary)
+    state = _state_columns(summary)
+    group = ', '.join(summary.group_by)
+    # No declared types: a NUMERIC column would turn 70000.0 into 70000
+    columns = ',\n'.join(f'        {name}' for name in state)
+    watched = ', '.join(dict.fromkeys(list(summary.group_by) +
+                                      [c for _, c in state.values() if c != '*']))
+    outputs = ', '.join([*summary.group_by, *(_output(agg) for agg in summary.aggregates)])
+    having = f'WHERE {summary.having}' if summary.having else ''
+    statements = f'''
+    CREATE TABLE {table} (
+        {group},
+{columns}
+    );
+    CREATE UNIQUE INDEX {table}_group ON {table} ({group});
+
+    CREATE TRIGGER {table}_insert AFTER INSERT ON {summary.table}
+    BEGIN {_add_row(summary)} END;
+
+    CREATE TRIGGER {table}_delete AFTER DELETE ON {summary.table}
+    BEGIN {_remove_row(summary)} END;
+
+    CREATE TRIGGER {table}_update AFTER UPDATE OF {watched} ON {summary.table}
+    BEGIN {_remove_row(summary)} {_add_row(summary)} END;
+
+    CREATE VIEW {summary.name} AS
+    SELECT * FROM (SELECT {outputs} FROM {table}) {having}
+    ORDER BY {group};
+    '''
+    # MIN/MAX lookups after removing the extreme row read this index only
+    for function, column in state.values():
+        if function in ('MIN', 'MAX'):
+            statements += (f'CREATE INDEX IF NOT EXISTS idx_{summary.table}_{"_".join(summary.group_by)}_'
+                           f'{column} ON {summary.table} ({group}, {column});\n')
+    return statements
+
+def drop(conn, summary):
+    table = state_table(summary)
+    conn.executescript(f'''
+        DROP VIEW IF EXISTS {summary.name};
+        DROP TRIGGER IF EXISTS {table}_insert;
+        DROP TRIGGER IF EXISTS {table}_delete;
+        DROP TRIGGER IF EXISTS {table}_update;
+        DROP TABLE IF EXISTS {table};
+    ''')
+
+def refresh(conn, summary):
+    # Recompute the whole summary from the source table, e.g. after a bulk
+    # load that ran with the triggers dropped
+    state = _state_columns(summary)
+    group = ', '.join(summary.group_by)
+    aggregates = ', '.join(f'{function}({column})' for function, column in state.values())
+    with loader.transaction(conn):
+        conn.execute(f'DELETE FROM {state_table(summary)}')
+        conn.execute(f'''
+            INSERT INTO {state_table(summary)} ({group}, {', '.join(state)})
+            SELECT {group}, {aggregates} FROM {summary.table} GROUP BY {group}
+        ''')
+
+def create(conn, summary):
+    # (Re)create the state table, its triggers and the view that reads it
+    drop(conn, summary)
+    conn.executescript(create_sql(summary))
+    refresh(conn, summary)
+
+def create_all(conn, summaries=AGGREGATION_SUMMARIES):
+    for summary in summaries.values():
+        create(conn, summary)
+
+def registered(conn):
+    # Names of the summaries that exist in conn
+    return [row[0] for row in conn.execute('''
+        SELECT substr(name, 4) FROM sqlite_master
+        WHERE type = 'table' AND name LIKE 'mv\\_%' ESCAPE '\\'
+        ORDER BY name
+    ''')]
+
+def _rounded(rows):
+    # Running sums can differ from a fresh SUM() in the last bits
+    return [tuple(round(v, 6) if isinstance(v, float) else v for v in row) for row in rows]
+
+def check(conn, summary, sql):
+    # True if the summary returns the same rows as the query it replaces
+    expected = conn.execute(f'SELECT * FROM ({sql}) ORDER BY 1').fetchall()
+    actual = conn.execute(f'SELECT * FROM {summary.name}').fetchall()
+    return _rounded(expected) == _rounded(actual)
+
+def compare(conn, queries, summaries, runs):
+    print(f"\n{'Query':<45} {'GROUP BY':>12} {'summary':>12} {'speedup':>9}")
+    for description, summary in summaries.items():
+        before = bench.time_query(conn, queries[description], runs)['p50_ms']
+        after = bench.time_query(conn, f'SELECT * FROM {summary.name}', runs)['p50_ms']
+        print(f"{description[:45]:<45} {before:>9.2f} ms {after:>9.2f} ms {before / after:>8.1f}x")
+
+def _write_workload(conn, scale, rows):
+    # Insert, update and delete `rows` employees, then roll everything back.
+    # Returns the seconds each step took.
+    spec = datagen.SCHEMAS['aggregation'][0]
+    start = conn.execute(f'SELECT MAX(id) FROM {spec.name}').fetchone()[0] + 1
+    generated = itertools.chain.from_iterable(
+        datagen.batches('aggregation', spec, scale, start, start + rows))
+    placeholders = ', '.join('?' for _ in spec.columns)
+    timings = {}
+    conn.execute('BEGIN')
+    try:
+        started = time.perf_counter()
+        conn.executemany(f'INSERT INTO {spec.name} ({", ".join(spec.columns)}) '
+                         f'VALUES ({placeholders})', generated)
+        timings['insert'] = time.perf_counter() - started
+        started = time.perf_counter()
+        conn.execute(f'UPDATE {spec.name} SET salary = salary * 1.05 WHERE id >= ?', (start,))
+        timings['update'] = time.perf_counter() - started
+        started = time.perf_counter()
+        conn.execute(f'DELETE FROM {spec.name} WHERE id >= ?', (start,))
+        timings['delete'] = time.perf_counter() - started
+    finally:
+        conn.rollback()
+    return timings
+
+def write_overhead(conn, scale, summaries, rows=10000):
+    # Cost of keeping the summaries current on writes to the source table
+    for summary in summaries.values():
+        drop(conn, summary)
+    without = _write_workload(conn, scale, rows)
+    create_all(conn, summaries)
+    with_triggers = _write_workload(conn, scale, rows)
+    print(f"\n{'Write (' + format(rows, ',') + ' rows)':<20} {'plain':>12} {'summaries':>12}")
+    for step in without:
+        print(f"{step:<20} {without[step] * 1000:>9.1f} ms {with_triggers[step] * 1000:>9.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Keep the GROUP BY examples of aggregation.py as trigger-maintained summaries.')
+    parser.add_argument('--db', help='aggregation database (default: a copy of a generated one)')
+    parser.add_argument('--scale', type=datagen.parse_scale, default=100000)
+    parser.add_argument('--data-dir', default=bench.DATA_DIR)
+    parser.add_argument('--drop', action='store_true', help='remove the summaries again')
+    parser.add_argument('--compare', action='store_true',
+                        help='time the summaries against the GROUP BY queries')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.db:
+        path = args.db
+    else:
+        # The summaries, their triggers and indexes go into a copy: bench
+        # and advisor time and index the generated file itself
+        path = bench.private_copy(bench.database_for('aggregation', args.scale, args.data_dir), 'matview')
+    conn = loader.connect(path)
+
+    if args.drop:
+        for summary in AGGREGATION_SUMMARIES.values():
+            drop(conn, summary)
+        print(f"Dropped the summaries from {path}.")
+        conn.close()
+        return
+
+    started = time.perf_counter()
+    create_all(conn)
+    print(f"Created {len(AGGREGATION_SUMMARIES)} summaries in {path} "
+          f"in {time.perf_counter() - started:.2f}s.")
+
+    queries = {name.split(': ', 1)[1]: sql for name, sql in lessons.queries('aggregation')}
+    for description, summary in AGGREGATION_SUMMARIES.items():
+        status = 'ok' if check(conn, summary, queries[description]) else 'MISMATCH'
+        print(f"  {summary.name:<28} {status}")
+
+    if args.compare:
+        compare(conn, queries, AGGREGATION_SUMMARIES, args.runs)
+        write_overhead(conn, args.scale, AGGREGATION_SUMMARIES)
+    conn.close()
+
+if __name__ == '__main__':
+    main()
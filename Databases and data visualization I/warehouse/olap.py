@@ -0,0 +1,394 @@
+import argparse
+import re
+import sqlite3
+import time
+from collections import namedtuple
+
+from warehouse import bench, cache, datagen, dialect, lessons, loader
+
+try:
+    import duckdb
+except ImportError:  # without it every query runs on SQLite
+    duckdb = None
+
+# SQLite stores rows and walks them one at a time, which is what a lookup
+# by key needs. DuckDB stores columns and runs scans and aggregates over
+# vectors of values from each. A Router keeps both copies of a lesson
+# database and sends each read to the engine that suits it.
+
+# A query that reads at least this many rows by full scans is analytical
+OLAP_MIN_ROWS = 50000
+
+# Rows per fetchmany() when copying without the sqlite extension
+COPY_BATCH_SIZE = 10000
+
+# The query cache's own tables are not copied
+CACHE_TABLES = {'cache_table_versions', 'query_cache'}
+
+# Opcodes of aggregate and window functions in SQLite's compiled program
+AGGREGATE_OPCODES = {'AggStep', 'AggStep1', 'AggValue', 'AggInverse', 'AggFinal'}
+READ_STATEMENTS = {'SELECT', 'WITH', 'VALUES'}
+
+Route = namedtuple('Route', ['backend', 'reason'])
+
+# Arithmetic whose result differs between the engines. SQLite divides two
+# integers as integers, and a DECIMAL column holds integers wherever the
+# value is whole, where the DuckDB copy holds DOUBLEs and '/' always gives
+# one. SQLite's ROUND() rounds the decimal text of a double, DuckDB's the
+# binary value, so e.g. 4300.8999999 rounds to 4300.9 and 4300.89.
+ENGINE_DEPENDENT = re.compile(r'/|\bROUND\s*\(', re.IGNORECASE)
+
+def _is_read(sql):
+    return sql.lstrip('( \n').split(None, 1)[0].upper() in READ_STATEMENTS
+
+def _engine_dependent(sql):
+    # True if sql divides or rounds outside its strings and comments
+    masked, _ = dialect._mask(sql)
+    return bool(ENGINE_DEPENDENT.search(re.sub(r'--[^\n]*|/\*.*?\*/', ' ', masked, flags=re.DOTALL)))
+
+class SQLiteBackend:
+    name = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = loader.connect(path)
+
+    def execute(self, sql, params=()):
+        cursor = self.conn.execute(sql, params)
+        rows = cursor.fetchall()
+        if not _is_read(sql):
+            self.conn.commit()
+        return rows
+
+    def close(self):
+        self.conn.close()
+
+def _duckdb_type(decltype):
+    # DuckDB type for a declared SQLite type, by SQLite's affinity rules
+    decltype = decltype.upper()
+    if 'INT' in decltype:
+        return 'BIGINT'
+    if any(word in decltype for word in ('CHAR', 'CLOB', 'TEXT')):
+        return 'VARCHAR'
+    if any(word in decltype for word in ('REAL', 'FLOA', 'DOUB', 'DECIMAL', 'NUMERIC')):
+        return 'DOUBLE'
+    if decltype == 'DATE':
+        return 'DATE'
+    if decltype in ('DATETIME', 'TIMESTAMP'):
+        return 'TIMESTAMP'
+    if 'BLOB' in decltype:
+        return 'BLOB'
+    return 'VARCHAR'
+
+def copyable_tables(conn):
+    # Tables of a SQLite database worth copying: not virtual tables (FTS
+    # indexes) or their shadow tables, which only SQLite can read
+    rows = conn.execute('''
+        SELECT name, sql FROM sqlite_master
+        WHERE type = 'table' AND name NOT LIKE 'sqlite\\_%' ESCAPE '\\'
+        ORDER BY name
+    ''').fetchall()
+    virtual = [name for name, sql in rows if sql.upper().startswith('CREATE VIRTUAL')]
+    return [name for name, _ in rows
+            if name not in virtual and not any(name.startswith(f'{v}_') for v in virtual)
+            and name not in CACHE_TABLES]
+
+class DuckDBBackend:
+    # An in-memory DuckDB copy of a SQLite file. Queries are written for
+    # SQLite and translated by warehouse.dialect.
+    name = 'duckdb'
+
+    def __init__(self, path, threads=None):
+        if duckdb is None:
+            raise RuntimeError("The DuckDB backend needs duckdb (pip install duckdb)")
+        self.path = path
+        self.conn = duckdb.connect()
+        if threads:
+            self.conn.execute(f'SET threads = {int(threads)}')
+        self.translations = {}
+        self.seconds = None
+        self.load()
+
+    def load(self, tables=None):
+        # Copy tables (default: all), replacing an earlier copy of each
+        started = time.perf_counter()
+        source = sqlite3.connect(self.path)
+        try:
+            tables = copyable_tables(source) if tables is None else tables
+            try:
+                self._attach()
+            except duckdb.Error:
+                # No sqlite extension (e.g. offline): copy through CSV files,
+                # which DuckDB parses in bulk
+                for table in tables:
+                    self._copy(source, table)
+            else:
+                try:
+                    for table in tables:
+                        self.conn.execute(f'CREATE OR REPLACE TABLE "{table}" AS SELECT * FROM src."{table}"')
+                finally:
+                    self.conn.execute('DETACH src')
+        finally:
+            source.close()
+        self.seconds = time.perf_counter() - started
+
+    def _attach(self):
+        self.conn.execute('INSTALL sqlite')
+        self.conn.execute('LOAD sqlite')
+        path = self.path.replace("'", "''")
+        self.conn.execute(f"ATTACH '{path}' AS src (TYPE sqlite, READ_ONLY)")
+
+    def _copy(self, source, table):
+        columns = [(row[1], _duckdb_type(row[2])) for row in source.execute(f'PRAGMA table_info("{table}")')]
+        self.conn.execute(f'CREATE OR REPLACE TABLE "{table}" ('
+                          + ', '.join(f'"{name}" {type}' for name, type in columns) + ')')
+        names = [name for name, _ in columns]
+        cursor = source.execute('SELECT ' + ', '.join(f'"{name}"' for name in names) + f' FROM "{table}"')
+        dialect.copy_rows(self.conn, table, names, iter(lambda: cursor.fetchmany(COPY_BATCH_SIZE), []))
+
+    def translate(self, sql):
+        if sql not in self.translations:
+            self.translations[sql] = dialect.translate_statement(sql, 'sqlite', 'duckdb')[-1]
+        return self.translations[sql]
+
+    def execute(self, sql, params=()):
+        return self.conn.execute(self.translate(sql), list(params)).fetchall()
+
+    def close(self):
+        self.conn.close()
+
+class Router:
+    # Runs each statement on SQLite or DuckDB. Reads that aggregate or scan
+    # at least min_rows rows go to DuckDB; lookups by key, small queries
+    # and every write go to SQLite. The DuckDB copy is loaded on the first
+    # analytical query. After a write, including commits by other
+    # connections, the tables whose write counters (see warehouse.cache)
+    # moved are copied again; a schema change copies everything.
+    def __init__(self, path, min_rows=OLAP_MIN_ROWS, olap=True):
+        self.sqlite = SQLiteBackend(path)
+        self.min_rows = min_rows
+        self.use_olap = olap and duckdb is not None
+        self.olap = None
+        self.data_version = None
+        self.versions = None
+        self.routes = {}
+        self.row_counts = {}
+        self.root_pages = None
+        self.counts = {'sqlite': 0, 'duckdb': 0, 'reloads': 0, 'fallbacks': 0}
+
+    def _version(self):
+        # PRAGMA data_version changes when another connection commits;
+        # writes through this router reset self.data_version instead
+        return self.sqlite.conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def _invalidate(self):
+        self.data_version = None
+        self.routes.clear()
+        self.row_counts.clear()
+
+    def _root_pages(self):
+        # {root page: table} for tables and their indexes
+        if self.root_pages is None:
+            self.root_pages = dict(self.sqlite.conn.execute(
+                "SELECT rootpage, tbl_name FROM sqlite_master WHERE type IN ('table', 'index')"))
+        return self.root_pages
+
+    def _rows(self, table):
+        if table not in self.row_counts:
+            self.row_counts[table] = self.sqlite.conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+        return self.row_counts[table]
+
+    def route(self, sql, params=()):
+        # Which backend sql goes to and why, from SQLite's compiled
+        # program: Rewind starts a full scan of a table or index, the Agg
+        # opcodes run aggregate and window functions. Queries whose
+        # results would differ on DuckDB stay on SQLite.
+        if not _is_read(sql):
+            return Route('sqlite', 'write')
+        if _engine_dependent(sql):
+            return Route('sqlite', 'divides or rounds')
+        if self.data_version is not None and self._version() != self.data_version:
+            self._invalidate()
+        if sql in self.routes:
+            return self.routes[sql]
+        pages = self._root_pages()
+        cursors, scanned, aggregates = {}, set(), False
+        for _, opcode, p1, p2, p3, *_ in self.sqlite.conn.execute('EXPLAIN ' + sql, params):
+            if opcode == 'OpenRead' and p3 == 0 and p2 in pages:
+                cursors[p1] = pages[p2]
+            elif opcode == 'Rewind' and p1 in cursors:
+                scanned.add(cursors[p1])
+            elif opcode in AGGREGATE_OPCODES:
+                aggregates = True
+        rows = sum(self._rows(table) for table in scanned)
+        if rows < self.min_rows:
+            route = Route('sqlite', f'scans {rows:,} rows' if scanned else 'no full scan')
+        elif aggregates:
+            route = Route('duckdb', f'aggregates {rows:,} rows')
+        else:
+            route = Route('duckdb', f'scans {rows:,} rows')
+        self.routes[sql] = route
+        return route
+
+    def _table_versions(self):
+        # {table: write count}, with the schema version under ''
+        conn = self.sqlite.conn
+        versions = dict(conn.execute('SELECT table_name, version FROM cache_table_versions'))
+        versions[''] = conn.execute('PRAGMA schema_version').fetchone()[0]
+        return versions
+
+    def _track(self):
+        # Count writes to every copied table
+        conn = self.sqlite.conn
+        tracked = cache.tracked_tables(conn)
+        for table in copyable_tables(conn):
+            if table not in tracked:
+                cache.track(conn, table)
+
+    def _olap(self):
+        # The DuckDB copy, with the tables SQLite changed since the last
+        # load copied again
+        version = self._version()
+        if self.olap is None:
+            self._track()
+            self.olap = DuckDBBackend(self.sqlite.path)
+            self.versions = self._table_versions()
+        elif version != self.data_version:
+            versions = self._table_versions()
+            if versions[''] != self.versions['']:
+                self._track()
+                versions = self._table_versions()
+                self.olap.load()
+            else:
+                changed = [t for t, v in versions.items() if t and v != self.versions.get(t)]
+                if changed:
+                    self.olap.load(changed)
+            self.versions = versions
+            self.counts['reloads'] += 1
+        self.data_version = self._version()
+        return self.olap
+
+    def execute(self, sql, params=()):
+        # Rows of sql from the backend route() picks. A query DuckDB cannot
+        # run (e.g. one using a SQLite-only function) falls back to SQLite.
+        route = self.route(sql, params)
+        if route.backend == 'duckdb' and self.use_olap:
+            try:
+                rows = self._olap().execute(sql, params)
+            except duckdb.Error as e:
+                self.routes[sql] = Route('sqlite', f'duckdb failed: {str(e).splitlines()[0]}')
+                self.counts['fallbacks'] += 1
+            else:
+                self.counts['duckdb'] += 1
+                return rows
+        rows = self.sqlite.execute(sql, params)
+        self.counts['sqlite'] += 1
+        if route.reason == 'write':
+            self._invalidate()
+            self.root_pages = None
+        return rows
+
+    def close(self):
+        self.sqlite.close()
+        if self.olap is not None:
+            self.olap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+# =====================================
+# Comparison report
+# =====================================
+# Lookups by key, as an application would run next to the lesson queries
+POINT_QUERIES = {
+    'aggregation': [('Employee by id', 'SELECT * FROM employees WHERE id = 4242')],
+    'joins': [('Orders of a customer', 'SELECT * FROM orders WHERE customer_id = 42')],
+    'tasks': [('Employee by id', 'SELECT * FROM employees WHERE emp_id = 4242'),
+              ('Projects of a department', 'SELECT * FROM projects WHERE dept_id = 7')],
+    'commands': [('Customer by id', 'SELECT * FROM customers WHERE customer_id = 42')],
+    'text': [('Customer by id', 'SELECT * FROM customers WHERE customer_id = 42')],
+}
+
+def _time(backend, sql, runs):
+    # p50 in ms and the rows of the first run, which is also the warm-up
+    rows = backend.execute(sql)
+    return bench.time_callable(lambda: backend.execute(sql), runs, warmup=0), rows
+
+def compare(path, schema, runs=5, min_rows=OLAP_MIN_ROWS):
+    # Time a lesson's queries and some lookups on both engines and show
+    # where the router sends each
+    queries = lessons.queries(schema) + POINT_QUERIES.get(schema, [])
+    with Router(path, min_rows) as router:
+        olap = None
+        if router.use_olap:
+            olap = router._olap()
+            print(f"Loaded {path} into DuckDB in {olap.seconds:.2f}s\n")
+        else:
+            print("duckdb is not installed (pip install duckdb); timing SQLite only.\n")
+        print(f"{'Query':<44} {'sqlite':>12} {'duckdb':>12} {'routed':>8} {'agrees':>7}  reason")
+        totals = {'sqlite': 0.0, 'duckdb': 0.0, 'routed': 0.0}
+        for name, sql in queries:
+            route = router.route(sql)
+            sqlite_ms, expected = _time(router.sqlite, sql, runs)
+            duckdb_ms, agrees = None, None
+            if olap is not None:
+                try:
+                    duckdb_ms, rows = _time(olap, sql, runs)
+                    agrees = dialect.normalize_rows(rows) == dialect.normalize_rows(expected)
+                except duckdb.Error as e:
+                    route = Route('sqlite', f'duckdb failed: {str(e).splitlines()[0]}')
+            totals['sqlite'] += sqlite_ms
+            totals['duckdb'] += sqlite_ms if duckdb_ms is None else duckdb_ms
+            totals['routed'] += duckdb_ms if route.backend == 'duckdb' and duckdb_ms is not None else sqlite_ms
+            print(f"{name[:44]:<44} {bench.format_ms(sqlite_ms)} {bench.format_ms(duckdb_ms)} "
+                  f"{route.backend:>8} {bench.format_agrees(agrees)}  {route.reason}")
+        print(f"\n{'All queries on one engine or routed':<44} {bench.format_ms(totals['sqlite'])} "
+              f"{bench.format_ms(totals['duckdb'] if olap is not None else None)} {totals['routed']:>5.2f} ms")
+
+def check(path, schema, min_rows=OLAP_MIN_ROWS):
+    # Names of the queries whose rows through the router differ from
+    # SQLite's own; an empty list when routing never changes a result
+    failed = []
+    with Router(path, min_rows) as router:
+        for name, sql in lessons.queries(schema) + POINT_QUERIES.get(schema, []):
+            if dialect.normalize_rows(router.execute(sql)) != dialect.normalize_rows(router.sqlite.execute(sql)):
+                failed.append(name)
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(description='Route lesson queries between SQLite and DuckDB.')
+    parser.add_argument('--schema', choices=lessons.QUERY_SETS, default='aggregation')
+    parser.add_argument('--db', help='lesson database (default: generated at --scale)')
+    parser.add_argument('--scale', type=datagen.parse_scale, default=200000)
+    parser.add_argument('--data-dir', default=bench.DATA_DIR)
+    parser.add_argument('--query', help='show where a query is routed and run it')
+    parser.add_argument('--min-rows', type=int, default=OLAP_MIN_ROWS,
+                        help='rows scanned from which a query goes to DuckDB')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--check', action='store_true',
+                        help='only verify that routed results equal SQLite\'s; exit status 1 if not')
+    args = parser.parse_args()
+
+    path = args.db or bench.database_for(args.schema, args.scale, args.data_dir)
+    if args.check:
+        failed = check(path, args.schema, args.min_rows)
+        for name in failed:
+            print(f"Routed result differs: {name}")
+        print(f"{len(failed)} of {len(lessons.queries(args.schema)) + len(POINT_QUERIES.get(args.schema, []))} "
+              f"queries differ when routed.")
+        raise SystemExit(1 if failed else 0)
+    if args.query:
+        with Router(path, args.min_rows) as router:
+            route = router.route(args.query)
+            rows = router.execute(args.query)
+            print(f"{route.backend} ({route.reason}): {len(rows):,} rows")
+            for row in rows[:20]:
+                print(f"  {row}")
+        return
+    compare(path, args.schema, args.runs, args.min_rows)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,633 @@
+import argparse
+import os
+import re
+import time
+from collections import namedtuple
+
+from warehouse import bench, datagen, loader
+
+# A fact table split by the period of a date column. The rows move to one
+# table per period, e.g. orders_p2023_05, and a view with the table's name
+# puts them back together with UNION ALL, so queries keep working. Rows
+# whose date is NULL or outside every period go to {table}_pdefault, until
+# extend() gives a new period its own partition. Writes reach the
+# partitions through INSTEAD OF triggers on the view. A view cannot be
+# upserted, indexed or given AFTER triggers, so loader.upsert falls back to
+# UPDATE and INSERT there, and create_index(), cache.track and
+# incremental.track_changes work on physical_tables().
+Partitioning = namedtuple('Partitioning', ['table', 'column', 'grain'])
+
+PARTITIONED = {
+    'joins': Partitioning('orders', 'order_date', 'month'),
+    'commands': Partitioning('orders', 'order_date', 'month'),
+    'aggregation': Partitioning('employees', 'hire_date', 'year'),
+    'tasks': Partitioning('employees', 'hire_date', 'year'),
+}
+
+# Characters of an ISO date that name its period
+GRAINS = {'year': 4, 'month': 7}
+
+DEFAULT = 'default'
+
+# One row per partition. file is set once a partition is archived to a
+# database file of its own.
+CATALOG_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS partition_catalog (
+        table_name TEXT NOT NULL,
+        partition_key TEXT NOT NULL,        -- '2023_05', '2023' or 'default'
+        low TEXT,                           -- first date, inclusive
+        high TEXT,                          -- end date, exclusive
+        file TEXT,
+        PRIMARY KEY (table_name, partition_key)
+    );
+    -- Last INTEGER PRIMARY KEY handed out through the view: each partition
+    -- would otherwise number new rows by itself
+    CREATE TABLE IF NOT EXISTS partition_keys (
+        table_name TEXT PRIMARY KEY,
+        last_key INTEGER NOT NULL
+    );
+'''
+
+Partition = namedtuple('Partition', ['key', 'low', 'high', 'file'])
+
+def partition_table(table, key):
+    return f'{table}_p{key}'
+
+def _period(value, grain):
+    # (key, low, high) of the period an ISO date falls in
+    year = int(value[:4])
+    if grain == 'year':
+        return str(year), f'{year:04d}-01-01', f'{year + 1:04d}-01-01'
+    month = int(value[5:7])
+    following = (year + month // 12, month % 12 + 1)
+    return f'{year:04d}_{month:02d}', f'{year:04d}-{month:02d}-01', f'{following[0]:04d}-{following[1]:02d}-01'
+
+def partitions(conn, table, schema='main'):
+    return [Partition(*row) for row in conn.execute(f'''
+        SELECT partition_key, low, high, file FROM {schema}.partition_catalog
+        WHERE table_name = ? ORDER BY low IS NULL, low
+    ''', (table,))]
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+def _primary_key(conn, table):
+    return [row[1] for row in sorted(conn.execute(f'PRAGMA table_info({table})'), key=lambda r: r[5]) if row[5]]
+
+def _integer_key(conn, table):
+    # The INTEGER PRIMARY KEY column that numbers new rows, or None
+    keys = [row for row in conn.execute(f'PRAGMA table_info({table})') if row[5]]
+    if len(keys) == 1 and keys[0][2].upper() == 'INTEGER':
+        return keys[0][1]
+    return None
+
+def _create_sql(conn, table):
+    return conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                        (table,)).fetchone()[0]
+
+CREATE_TABLE_NAME = re.compile(r'^\s*CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?("?\w+"?)', re.IGNORECASE)
+CREATE_INDEX = re.compile(r'^\s*CREATE\s+(UNIQUE\s+)?INDEX\s+(?:IF\s+NOT\s+EXISTS\s+)?"?(\w+)"?\s+ON\s+"?\w+"?',
+                          re.IGNORECASE)
+
+def _partition_ddl(create_sql, spec, name, low, high):
+    # The table's CREATE TABLE under another name, with a CHECK that keeps
+    # rows of other periods out
+    sql = CREATE_TABLE_NAME.sub(f'CREATE TABLE IF NOT EXISTS {name}', create_sql, count=1)
+    if low is None:
+        return sql
+    end = sql.rindex(')')
+    return (f"{sql[:end]},\n        CHECK ({spec.column} >= '{low}' AND {spec.column} < '{high}')"
+            f"{sql[end:]}")
+
+def _index_ddl(index_sqls, spec, name):
+    # The table's indexes on a partition, plus one on the date column
+    statements = [f'CREATE INDEX IF NOT EXISTS idx_{name}_{spec.column} ON {name} ({spec.column})']
+    for sql in index_sqls:
+        statements.append(CREATE_INDEX.sub(
+            lambda m: f'CREATE {m.group(1) or ""}INDEX IF NOT EXISTS {m.group(2)}_{name} ON {name}', sql, count=1))
+    return statements
+
+def _rebuild_view(conn, spec):
+    # The view over every partition still in the main database, and the
+    # INSTEAD OF triggers that send writes to the view on to a partition
+    table = spec.table
+    parts = [p for p in partitions(conn, table) if p.file is None]
+    columns = _columns(conn, partition_table(table, DEFAULT))
+    key = _primary_key(conn, partition_table(table, DEFAULT))
+    numbered = _integer_key(conn, partition_table(table, DEFAULT))
+    conn.execute(f'DROP VIEW IF EXISTS {table}')
+    conn.execute(f'CREATE VIEW {table} AS '
+                 + ' UNION ALL '.join(f'SELECT * FROM {partition_table(table, p.key)}' for p in parts))
+
+    def insert(row):
+        statements = []
+        if key:
+            # Each partition only checks its own rows
+            match = ' AND '.join(f'{c} = {row}.{c}' for c in key)
+            statements.append(f"SELECT RAISE(ABORT, 'UNIQUE constraint failed: {table}.{', '.join(key)}') "
+                              f"WHERE EXISTS (SELECT 1 FROM {table} WHERE {match});")
+        if numbered:
+            statements.append(f"UPDATE partition_keys SET last_key = max(last_key, "
+                              f"COALESCE({row}.{numbered}, last_key + 1)) WHERE table_name = '{table}';")
+        names = ', '.join(columns)
+        values = ', '.join(f"COALESCE({row}.{c}, (SELECT last_key FROM partition_keys "
+                           f"WHERE table_name = '{table}'))" if c == numbered else f'{row}.{c}'
+                           for c in columns)
+        statements += [f"INSERT INTO {partition_table(table, p.key)} ({names}) SELECT {values} "
+                       f"WHERE {row}.{spec.column} >= '{p.low}' AND {row}.{spec.column} < '{p.high}';"
+                       for p in parts if p.low is not None]
+        ranges = ' OR '.join(f"({row}.{spec.column} >= '{p.low}' AND {row}.{spec.column} < '{p.high}')"
+                             for p in parts if p.low is not None) or '0'
+        statements.append(f"INSERT INTO {partition_table(table, DEFAULT)} ({names}) SELECT {values} "
+                          f"WHERE {row}.{spec.column} IS NULL OR NOT ({ranges});")
+        return '\n'.join(statements)
+
+    def delete(row):
+        match = ' AND '.join(f'{c} = {row}.{c}' for c in key)
+        return '\n'.join(f'DELETE FROM {partition_table(table, p.key)} WHERE {match};' for p in parts)
+
+    # A table without a primary key can only be appended to
+    triggers = [f'CREATE TRIGGER {table}_insert INSTEAD OF INSERT ON {table} BEGIN {insert("new")} END']
+    if key:
+        triggers.append(f'CREATE TRIGGER {table}_delete INSTEAD OF DELETE ON {table} BEGIN {delete("old")} END')
+        triggers.append(f'CREATE TRIGGER {table}_update INSTEAD OF UPDATE ON {table} BEGIN '
+                        f'{delete("old")} {insert("new")} END')
+    for trigger in triggers:
+        conn.execute(trigger)
+
+def _create_partition(conn, spec, create_sql, index_sqls, key, low, high, source, where):
+    # One partition's table and indexes, filled from source in its order so
+    # the b-tree is built by appending
+    name = partition_table(spec.table, key)
+    conn.execute(_partition_ddl(create_sql, spec, name, low, high))
+    conn.execute(f'INSERT INTO {name} SELECT * FROM {source} WHERE {where} ORDER BY rowid')
+    for sql in _index_ddl(index_sqls, spec, name):
+        conn.execute(sql)
+    conn.execute('INSERT INTO partition_catalog (table_name, partition_key, low, high) VALUES (?, ?, ?, ?)',
+                 (spec.table, key, low, high))
+
+def is_partitioned(conn, table, schema='main'):
+    return conn.execute(f"SELECT type FROM {schema}.sqlite_master WHERE name = ?", (table,)).fetchone() == ('view',)
+
+def _has_catalog(conn, schema='main'):
+    return conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE name = 'partition_catalog'").fetchone() is not None
+
+def physical_tables(conn, table, schema='main'):
+    # The tables holding the rows of table: its partitions still in the
+    # database if it is partitioned, else table itself. Indexes and AFTER
+    # triggers go on these, as a view takes neither.
+    if not is_partitioned(conn, table, schema):
+        return [table]
+    parts = [partition_table(table, p.key) for p in partitions(conn, table, schema) if p.file is None] \
+        if _has_catalog(conn, schema) else []
+    if not parts:
+        raise ValueError(f"{table} is a view, not a table or a partitioned table")
+    return parts
+
+def on_partition(name, table, target):
+    # Name of the copy of an index or trigger of table on target, as
+    # partition() names them; extend() and unpartition() rely on it
+    return name if target == table else f'{name}_{target}'
+
+def parent_table(conn, name):
+    # The partitioned table name is a partition of, or name itself
+    if not _has_catalog(conn):
+        return name
+    row = conn.execute("SELECT table_name FROM partition_catalog WHERE table_name || '_p' || partition_key = ?",
+                       (name,)).fetchone()
+    return row[0] if row else name
+
+def create_index(conn, name, table, columns):
+    # CREATE INDEX IF NOT EXISTS on table, or on each of its partitions
+    for target in physical_tables(conn, table):
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {on_partition(name, table, target)} ON {target} ({columns})')
+
+def _number_keys(conn, table):
+    # Start the keys handed out through the view after the largest in the
+    # table, never below one handed out before, e.g. now archived
+    numbered = _integer_key(conn, partition_table(table, DEFAULT))
+    if numbered:
+        conn.execute(f'''
+            INSERT INTO partition_keys (table_name, last_key)
+            SELECT ?, COALESCE(MAX({numbered}), 0) FROM {table} WHERE true
+            ON CONFLICT (table_name) DO UPDATE SET last_key = max(last_key, excluded.last_key)
+        ''', (table,))
+
+def partition(conn, spec):
+    # Move the rows of spec.table into one table per period and replace the
+    # table by a view over them. Returns the number of partitions. On a
+    # partitioned table, gives new periods their partitions instead.
+    table = spec.table
+    if is_partitioned(conn, table):
+        conn.executescript(CATALOG_SCHEMA)
+        with loader.transaction(conn):
+            _number_keys(conn, table)
+            _rebuild_view(conn, spec)
+        extend(conn, spec)
+        return len(partitions(conn, table))
+    triggers = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ?", (table,))]
+    if triggers:
+        raise ValueError(f"{table} has triggers ({', '.join(triggers)}); a view cannot run AFTER "
+                         f"triggers, so drop them before partitioning")
+    create_sql = _create_sql(conn, table)
+    index_sqls = [row[0] for row in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (table,))]
+    width = GRAINS[spec.grain]
+    # Only dates from year 0001 on look like ISO dates to _period()
+    periods = [row[0] for row in conn.execute(f'''
+        SELECT DISTINCT substr({spec.column}, 1, {width}) FROM {table}
+        WHERE {spec.column} GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]*' ORDER BY 1
+    ''')]
+    conn.executescript(CATALOG_SCHEMA)
+    with loader.transaction(conn):
+        created = {}
+        for value in periods:
+            key, low, high = _period(value + '-01' if spec.grain == 'month' else value + '-01-01', spec.grain)
+            created[key] = (low, high)
+        created[DEFAULT] = (None, None)
+        for key, (low, high) in created.items():
+            if low is None:
+                ranges = ' OR '.join(f"({spec.column} >= '{l}' AND {spec.column} < '{h}')"
+                                     for l, h in created.values() if l is not None) or '0'
+                where = f'{spec.column} IS NULL OR NOT ({ranges})'
+            else:
+                where = f"{spec.column} >= '{low}' AND {spec.column} < '{high}'"
+            _create_partition(conn, spec, create_sql, index_sqls, key, low, high, table, where)
+        _number_keys(conn, table)
+        conn.execute(f'DROP TABLE {table}')
+        _rebuild_view(conn, spec)
+    return len(created)
+
+def extend(conn, spec, through=None):
+    # Give new periods partitions of their own: every period with rows in
+    # the default partition, which writes of dates past the last partition
+    # fall into, and every period up to the date through, so they can be
+    # made ahead of time. A trigger cannot create tables, so run this
+    # whenever a new period starts. Returns the keys of the new partitions.
+    table = spec.table
+    existing = {p.key for p in partitions(conn, table)}
+    default = partition_table(table, DEFAULT)
+    width = GRAINS[spec.grain]
+    values = [row[0] for row in conn.execute(f'''
+        SELECT DISTINCT substr({spec.column}, 1, {width}) FROM {default}
+        WHERE {spec.column} GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]*'
+    ''')]
+    periods = {}
+    for value in values:
+        period = _period(value + '-01' if spec.grain == 'month' else value + '-01-01', spec.grain)
+        periods[period[0]] = period
+    if through is not None:
+        last = max((p.high for p in partitions(conn, table) if p.high is not None), default=through)
+        while last <= through:
+            period = _period(last, spec.grain)
+            periods[period[0]] = period
+            last = period[2]
+    new = sorted(key for key in periods if key not in existing)
+    if not new:
+        return []
+    create_sql = _create_sql(conn, default)
+    index_sqls = [re.sub(rf'_{default}\s+ON\s+{default}\b', f' ON {table}', row[0], count=1)
+                  for row in conn.execute(
+                      "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? "
+                      "AND sql IS NOT NULL AND name <> ?", (default, f'idx_{default}_{spec.column}'))]
+    # Triggers on the partitions, e.g. cache.track's, are copied too
+    trigger_sqls = [row[0] for row in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ?", (default,))]
+    with loader.transaction(conn):
+        for key in new:
+            _, low, high = periods[key]
+            where = f"{spec.column} >= '{low}' AND {spec.column} < '{high}'"
+            _create_partition(conn, spec, create_sql, index_sqls, key, low, high, default, where)
+            for sql in trigger_sqls:
+                conn.execute(sql.replace(default, partition_table(table, key)))
+            conn.execute(f'DELETE FROM {default} WHERE {where}')
+        _rebuild_view(conn, spec)
+    return new
+
+def unpartition(conn, spec):
+    # Put every partition still in the main database back into one table
+    table = spec.table
+    parts = partitions(conn, table)
+    if not is_partitioned(conn, table):
+        return
+    default = partition_table(table, DEFAULT)
+    create_sql = CREATE_TABLE_NAME.sub(f'CREATE TABLE {table}', _create_sql(conn, default), count=1)
+    index_sqls = [row[0] for row in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL "
+        "AND name <> ?", (default, f'idx_{default}_{spec.column}'))]
+    trigger_sqls = [row[0] for row in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ?", (default,))]
+    with loader.transaction(conn):
+        conn.execute(f'DROP VIEW {table}')
+        conn.execute(create_sql)
+        for p in parts:
+            if p.file is None:
+                conn.execute(f'INSERT INTO {table} SELECT * FROM {partition_table(table, p.key)}')
+                conn.execute(f'DROP TABLE {partition_table(table, p.key)}')
+        for sql in index_sqls:
+            conn.execute(re.sub(rf'_{default}\s+ON\s+{default}\b', f' ON {table}', sql, count=1))
+        for sql in trigger_sqls:
+            conn.execute(sql.replace(f'_{default}', '').replace(default, table))
+        conn.execute('DELETE FROM partition_catalog WHERE table_name = ? AND file IS NULL', (table,))
+
+# =====================================
+# Dropping and archiving old partitions
+# =====================================
+def _catalog_row(conn, table, key):
+    parts = {p.key: p for p in partitions(conn, table)}
+    if key not in parts or key == DEFAULT:
+        raise KeyError(f"{table} has no partition {key!r}")
+    return parts[key]
+
+def drop_partition(conn, spec, key):
+    # Delete a period's rows by dropping its table: no other partition is
+    # read or written, whatever the size of the rest of the table
+    p = _catalog_row(conn, spec.table, key)
+    with loader.transaction(conn):
+        if p.file is None:
+            conn.execute(f'DROP TABLE {partition_table(spec.table, key)}')
+        conn.execute('DELETE FROM partition_catalog WHERE table_name = ? AND partition_key = ?',
+                     (spec.table, key))
+        _rebuild_view(conn, spec)
+    if p.file is not None and os.path.exists(p.file):
+        os.remove(p.file)
+
+def archive_partition(conn, spec, key, directory):
+    # Move a period to a database file of its own, written compactly and
+    # then left alone. The main view stops showing it; open_archive() adds
+    # archived periods back into a TEMP view for one connection.
+    p = _catalog_row(conn, spec.table, key)
+    if p.file is not None:
+        return p.file
+    name = partition_table(spec.table, key)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{name}.db')
+    if os.path.exists(path):
+        os.remove(path)
+    create_sql = _create_sql(conn, name)
+    conn.execute('ATTACH DATABASE ? AS archive', (path,))
+    try:
+        with loader.transaction(conn):
+            conn.execute(CREATE_TABLE_NAME.sub(f'CREATE TABLE archive.{name}', create_sql, count=1))
+            conn.execute(f'INSERT INTO archive.{name} SELECT * FROM main.{name} ORDER BY rowid')
+            conn.execute(f'CREATE INDEX archive.idx_{name}_{spec.column} ON {name} ({spec.column})')
+            conn.execute(f'DROP TABLE main.{name}')
+            conn.execute('UPDATE partition_catalog SET file = ? WHERE table_name = ? AND partition_key = ?',
+                         (path, spec.table, key))
+            _rebuild_view(conn, spec)
+    finally:
+        conn.execute('DETACH DATABASE archive')
+    return path
+
+def open_archive(conn, spec):
+    # Attach the archived partitions and shadow the view by a TEMP view
+    # over all partitions. SQLite attaches at most 10 files by default, so
+    # archive whole years rather than months.
+    table = spec.table
+    sources = []
+    for p in partitions(conn, table):
+        name = partition_table(table, p.key)
+        if p.file is None:
+            sources.append(f'main.{name}')
+        else:
+            alias = f'archive_{p.key}'
+            if alias not in [row[1] for row in conn.execute('PRAGMA database_list')]:
+                conn.execute(f'ATTACH DATABASE ? AS {alias}', (p.file,))
+            sources.append(f'{alias}.{name}')
+    conn.execute(f'DROP VIEW IF EXISTS temp.{table}')
+    conn.execute(f'CREATE TEMP VIEW {table} AS ' + ' UNION ALL '.join(f'SELECT * FROM {s}' for s in sources))
+
+def compact_archive(conn, spec, key):
+    # VACUUM an archived partition's file, e.g. after rows were deleted
+    p = _catalog_row(conn, spec.table, key)
+    if p.file is None:
+        raise ValueError(f"Partition {key!r} of {spec.table} is not archived")
+    conn.execute('ATTACH DATABASE ? AS archive', (p.file,))
+    try:
+        conn.execute('VACUUM archive')
+    finally:
+        conn.execute('DETACH DATABASE archive')
+
+# =====================================
+# Routing queries to the partitions of their date range
+# =====================================
+# Words that can follow a table name in FROM or JOIN, so are not an alias
+CLAUSE_WORDS = {'WHERE', 'GROUP', 'ORDER', 'LIMIT', 'HAVING', 'JOIN', 'LEFT', 'RIGHT', 'FULL', 'INNER',
+                'CROSS', 'NATURAL', 'OUTER', 'ON', 'USING', 'UNION', 'INTERSECT', 'EXCEPT', 'WINDOW'}
+
+# Clauses that end a WHERE clause
+WHERE_END = {'GROUP', 'ORDER', 'LIMIT', 'HAVING', 'WINDOW'}
+
+def _mask_strings(sql):
+    # sql with the text of its string literals blanked, at the same offsets
+    return re.sub(r"'(?:[^']|'')*'", lambda m: "'" + ' ' * (len(m.group()) - 2) + "'", sql)
+
+def _conjuncts(sql):
+    # The terms ANDed together at the top of the WHERE clause, when sql is
+    # a single SELECT; None for anything else or a top-level OR. A date
+    # compared inside CASE, the SELECT list or a subquery does not filter
+    # rows, so only these terms may narrow the partitions.
+    masked = _mask_strings(sql)
+    if len(re.findall(r'\bSELECT\b', masked, re.IGNORECASE)) != 1:
+        return None
+    terms, depth, start, end, between = [], 0, None, len(sql), False
+    for token in re.finditer(r'\w+|[()]', masked):
+        word = token.group().upper()
+        if word in ('(', 'CASE'):
+            depth += 1
+        elif word in (')', 'END'):
+            depth -= 1
+        elif depth:
+            continue
+        elif start is None:
+            if word == 'WHERE':
+                start = token.end()
+        elif word in WHERE_END:
+            end = token.start()
+            break
+        elif word == 'OR':
+            return None
+        elif word == 'BETWEEN':
+            between = True
+        elif word == 'AND':
+            if between:
+                between = False
+            else:
+                terms.append(sql[start:token.start()])
+                start = token.end()
+    if start is None:
+        return []
+    terms.append(sql[start:end].rstrip().rstrip(';'))
+    return [term.strip() for term in terms]
+
+def _date_range(sql, column, qualifiers=()):
+    # (low, high) such that the query only needs rows with low <= column
+    # < high, from WHERE terms comparing column, bare or qualified by one
+    # of qualifiers, with date literals; None where unbounded
+    terms = _conjuncts(sql)
+    if not terms:
+        return None, None
+    name = rf"(?:(?:{'|'.join(map(re.escape, qualifiers))})\.)?{column}" if qualifiers else column
+    low = high = None
+
+    def narrow(new_low=None, new_high=None):
+        nonlocal low, high
+        if new_low is not None and (low is None or new_low > low):
+            low = new_low
+        if new_high is not None and (high is None or new_high < high):
+            high = new_high
+
+    for term in terms:
+        if match := re.fullmatch(rf"{name}\s*(>=|<=|=|>|<)\s*'([^']*)'", term, re.IGNORECASE):
+            operator, value = match.groups()
+            # A string just above value, for inclusive upper bounds
+            after = value + '\uffff'
+            if operator in ('>=', '>'):
+                narrow(new_low=value)
+            elif operator == '<':
+                narrow(new_high=value)
+            elif operator == '<=':
+                narrow(new_high=after)
+            else:
+                narrow(value, after)
+        elif match := re.fullmatch(rf"{name}\s+BETWEEN\s+'([^']*)'\s+AND\s+'([^']*)'", term, re.IGNORECASE):
+            narrow(match.group(1), match.group(2) + '\uffff')
+        elif match := re.fullmatch(rf"{name}\s+LIKE\s+'([^'%_]+)%'", term, re.IGNORECASE):
+            prefix = match.group(1)
+            narrow(prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1))
+    return low, high
+
+def route(conn, spec, sql):
+    # sql with the partitioned table replaced by the UNION ALL of only the
+    # partitions its WHERE clause can match, and the keys of those
+    table = spec.table
+    reference = rf'\b(FROM|JOIN)\s+{table}\b(?:\s+(?:AS\s+)?(\w+))?'
+    references = list(re.finditer(reference, _mask_strings(sql), re.IGNORECASE))
+    alias = references[0].group(2) if len(references) == 1 else None
+    if alias and alias.upper() in CLAUSE_WORDS:
+        alias = None
+    low, high = _date_range(sql, spec.column, [table] + ([alias] if alias else []))
+    keep = [p for p in partitions(conn, table) if p.file is None and (
+        p.low is None or ((high is None or p.low < high) and (low is None or p.high > low)))]
+    if len(references) != 1 or (low is None and high is None):
+        return sql, [p.key for p in keep]
+    union = ' UNION ALL '.join(f'SELECT * FROM {partition_table(table, p.key)}' for p in keep)
+
+    def replace(match):
+        if alias:
+            return f'{match.group(1)} ({union}) {alias}'
+        return f'{match.group(1)} ({union}) AS {table}' + (f' {match.group(2)}' if match.group(2) else '')
+
+    match = references[0]
+    routed = sql[:match.start()] + replace(match) + sql[match.end():]
+    return routed, [p.key for p in keep]
+
+def query(conn, spec, sql, params=()):
+    return conn.execute(route(conn, spec, sql)[0], params)
+
+# =====================================
+# Comparison
+# =====================================
+# Date-range reports as the lessons would write them
+EXAMPLES = {
+    'orders': [
+        ('One day', "SELECT COUNT(*), SUM(amount) FROM orders WHERE order_date = '2023-06-15'"),
+        ('One month', "SELECT COUNT(*), SUM(amount) FROM orders "
+                      "WHERE order_date >= '2023-06-01' AND order_date < '2023-07-01'"),
+        ('One quarter by customer', "SELECT customer_id, COUNT(*) FROM orders o "
+                                    "WHERE o.order_date BETWEEN '2024-01-01' AND '2024-03-31' "
+                                    "GROUP BY customer_id ORDER BY 2 DESC LIMIT 10"),
+        ('One year', "SELECT COUNT(*) FROM orders WHERE order_date LIKE '2024%'"),
+        ('Everything', 'SELECT COUNT(*) FROM orders'),
+    ],
+    'employees': [
+        ('Hired in one year', "SELECT COUNT(*) FROM employees WHERE hire_date LIKE '2020%'"),
+        ('Hired since a date', "SELECT COUNT(*), AVG(salary) FROM employees WHERE hire_date >= '2022-07-01'"),
+        ('Everyone', 'SELECT COUNT(*) FROM employees'),
+    ],
+}
+
+def _time(conn, sql, runs):
+    return bench.time_callable(lambda: conn.execute(sql).fetchall(), runs)
+
+def _rows(conn, sql):
+    # SUM() over partitions adds in another order than over the table
+    return [tuple(round(v, 6) if isinstance(v, float) else v for v in row) for row in conn.execute(sql)]
+
+def compare(conn, spec, runs=5):
+    # Time each example on the plain table, then partition it and time the
+    # UNION ALL view and the routed query. Returns the partition count.
+    examples = EXAMPLES[spec.table]
+    before = {}
+    if not is_partitioned(conn, spec.table):
+        before = {name: (_time(conn, sql, runs), _rows(conn, sql)) for name, sql in examples}
+        started = time.perf_counter()
+        count = partition(conn, spec)
+        print(f"Partitioned {spec.table} by {spec.grain} into {count} tables "
+              f"in {time.perf_counter() - started:.2f}s\n")
+    print(f"{'Query':<26} {'table':>12} {'view':>12} {'routed':>12} {'partitions':>11} {'agrees':>7}")
+    for name, sql in examples:
+        routed, keys = route(conn, spec, sql)
+        view_ms, routed_ms = _time(conn, sql, runs), _time(conn, routed, runs)
+        table_ms, expected = before.get(name, (None, _rows(conn, sql)))
+        agrees = _rows(conn, routed) == expected
+        print(f"{name:<26} {bench.format_ms(table_ms)} {bench.format_ms(view_ms)} {bench.format_ms(routed_ms)} "
+              f"{len(keys):>11} {bench.format_agrees(agrees)}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Split a fact table into per-period tables behind a view.')
+    parser.add_argument('--schema', choices=PARTITIONED, default='joins')
+    parser.add_argument('--db', help='lesson database (default: generated at --scale)')
+    parser.add_argument('--scale', type=datagen.parse_scale, default=200000)
+    parser.add_argument('--data-dir', default=bench.DATA_DIR)
+    parser.add_argument('--grain', choices=GRAINS, help='period of a partition (default: per schema)')
+    parser.add_argument('--list', action='store_true', help='show the partitions and their rows')
+    parser.add_argument('--query', help='show how a query is routed and run it')
+    parser.add_argument('--drop', metavar='KEY', help="drop a partition, e.g. 2022_01")
+    parser.add_argument('--extend-through', metavar='DATE',
+                        help='also make empty partitions for the periods up to DATE')
+    parser.add_argument('--archive', metavar='KEY', help='move a partition to its own file in --archive-dir')
+    parser.add_argument('--archive-dir', default='archive')
+    parser.add_argument('--unpartition', action='store_true', help='put the partitions back into one table')
+    parser.add_argument('--compare', action='store_true', help='time date-range queries before and after')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    spec = PARTITIONED[args.schema]
+    if args.grain:
+        spec = spec._replace(grain=args.grain)
+    path = args.db or bench.database_for(args.schema, args.scale, args.data_dir)
+    conn = loader.connect(path)
+    if args.unpartition:
+        unpartition(conn, spec)
+        print(f"{spec.table} is one table again.")
+        return
+    if args.compare:
+        compare(conn, spec, args.runs)
+    else:
+        started = time.perf_counter()
+        count = partition(conn, spec)
+        print(f"{spec.table}: {count} partitions ready in {time.perf_counter() - started:.2f}s.")
+    if args.extend_through:
+        added = extend(conn, spec, args.extend_through)
+        print(f"Added partitions: {', '.join(added) or 'none'}.")
+    if args.drop:
+        drop_partition(conn, spec, args.drop)
+        print(f"Dropped partition {args.drop}.")
+    if args.archive:
+        print(f"Archived partition {args.archive} to {archive_partition(conn, spec, args.archive, args.archive_dir)}.")
+    if args.query:
+        routed, keys = route(conn, spec, args.query)
+        print(f"\nPartitions: {', '.join(keys)}")
+        for row in conn.execute(routed).fetchmany(20):
+            print(f"  {row}")
+    if args.list:
+        for p in partitions(conn, spec.table):
+            source = f"{p.file}" if p.file else partition_table(spec.table, p.key)
+            rows = '-' if p.file else f"{conn.execute(f'SELECT COUNT(*) FROM {source}').fetchone()[0]:,}"
+            print(f"  {p.key:<10} {p.low or '':<12} {p.high or '':<12} {rows:>10}  {source}")
+    conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+import argparse
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from warehouse import lessons, loader
+
+DEFAULT_POOL_SIZE = 4
+# Prepared statements kept per connection (sqlite3 defaults to 128)
+CACHED_STATEMENTS = 256
+
+class ConnectionPool:
+    # A fixed number of connections to one database file, opened on first use
+    # and handed to one thread at a time. Every connection gets the loader
+    # pragmas (WAL, so readers do not block each other or a writer) and an
+    # optional setup(conn) call, e.g. to register functions. Connections are
+    # reused, so their prepared statements are too.
+    def __init__(self, path, size=DEFAULT_POOL_SIZE, pragmas=None, setup=None,
+                 cached_statements=CACHED_STATEMENTS, timeout=30.0):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self.path = path
+        self.size = size
+        self.pragmas = pragmas
+        self.setup = setup
+        self.cached_statements = cached_statements
+        self.timeout = timeout
+        # LIFO hands out the most recently used connection, whose page cache
+        # and statements are the warmest
+        self.idle = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.opened = 0
+        self.closed = False
+
+    def _open(self):
+        conn = loader.connect(self.path, self.pragmas, check_same_thread=False,
+                              cached_statements=self.cached_statements)
+        if self.setup:
+            self.setup(conn)
+        return conn
+
+    def acquire(self, timeout=None):
+        if self.closed:
+            raise RuntimeError("Connection pool is closed")
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            grow = self.opened < self.size
+            if grow:
+                self.opened += 1
+        if grow:
+            try:
+                return self._open()
+            except BaseException:
+                with self.lock:
+                    self.opened -= 1
+                raise
+        try:
+            return self.idle.get(timeout=self.timeout if timeout is None else timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No connection to {self.path} free after "
+                               f"{self.timeout if timeout is None else timeout}s") from None
+
+    def release(self, conn):
+        # Never hand out a connection with someone else's open transaction
+        if conn.in_transaction:
+            conn.rollback()
+        if self.closed:
+            conn.close()
+        else:
+            self.idle.put(conn)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        # Close the idle connections; busy ones are closed when released
+        self.closed = True
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class QueryExecutor:
+    # Runs independent read queries on a thread pool, each on its own pooled
+    # connection. sqlite3 releases the GIL while SQLite works, so queries
+    # run in parallel on as many cores as there are workers.
+    def __init__(self, pool, workers=None):
+        self.pool = pool
+        self.workers = workers or pool.size
+        self.threads = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='query')
+
+    def _run(self, sql, params):
+        with self.pool.connection() as conn:
+            started = time.perf_counter()
+            rows = conn.execute(sql, params).fetchall()
+            return rows, time.perf_counter() - started
+
+    def submit(self, sql, params=()):
+        # Future of (rows, seconds)
+        return self.threads.submit(self._run, sql, params)
+
+    def map(self, queries):
+        # Rows of every query, in the order given. A query is SQL text or
+        # a (sql, params) pair.
+        futures = [self.submit(*((q,) if isinstance(q, str) else q)) for q in queries]
+        return [future.result()[0] for future in futures]
+
+    def run(self, named_queries):
+        # [(name, rows, seconds)] for [(name, sql)], in the order given
+        futures = [(name, self.submit(sql)) for name, sql in named_queries]
+        return [(name, *future.result()) for name, future in futures]
+
+    def close(self):
+        self.threads.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def compare(path, queries, workers, runs):
+    # Wall time of the batch run serially on one connection and concurrently
+    # on the pool, next to the slowest single query
+    conn = loader.connect(path)
+    serial = []
+    slowest = 0.0
+    for _ in range(runs):
+        started = time.perf_counter()
+        for _, sql in queries:
+            query_started = time.perf_counter()
+            conn.execute(sql).fetchall()
+            slowest = max(slowest, time.perf_counter() - query_started)
+        serial.append(time.perf_counter() - started)
+    conn.close()
+
+    concurrent = []
+    with ConnectionPool(path, workers) as pool, QueryExecutor(pool) as executor:
+        executor.run(queries)  # open and warm every connection
+        for _ in range(runs):
+            started = time.perf_counter()
+            executor.run(queries)
+            concurrent.append(time.perf_counter() - started)
+    return min(serial), min(concurrent), slowest
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a lesson query set concurrently on a connection pool.')
+    parser.add_argument('--schema', choices=lessons.QUERY_SETS, default='aggregation')
+    parser.add_argument('--db', required=True, help='lesson or generated database')
+    parser.add_argument('--workers', type=int, default=DEFAULT_POOL_SIZE)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    queries = lessons.queries(args.schema)
+    serial, concurrent, slowest = compare(args.db, queries, args.workers, args.runs)
+    print(f"{len(queries)} queries, {args.workers} workers")
+    print(f"  serial:         {serial * 1000:>10.2f} ms")
+    print(f"  concurrent:     {concurrent * 1000:>10.2f} ms ({serial / concurrent:.1f}x)")
+    print(f"  slowest query:  {slowest * 1000:>10.2f} ms")
+
+if __name__ == '__main__':
+    main()
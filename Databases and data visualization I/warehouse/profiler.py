@@ -0,0 +1,307 @@
+import argparse
+import contextlib
+import json
+import os
+import sqlite3
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from warehouse import bench, cache, datagen, lessons, loader
+
+# One statement run through a profiled cursor: wall time from execute()
+# until its last row was fetched, virtual machine steps, rows returned and
+# the EXPLAIN QUERY PLAN lines. statements counts what SQLite ran for it,
+# e.g. BEGIN before a write or the statements of triggers.
+Profile = namedtuple('Profile', ['sql', 'params', 'started', 'seconds', 'steps', 'rows', 'plan', 'statements'])
+
+# The progress handler runs every this many virtual machine instructions,
+# so steps are counted in units of it
+STEP_INTERVAL = 1000
+
+DEFAULT_SLOW_MS = 100
+
+# Plan lines worth a look in the report
+PLAN_WARNINGS = ('SCAN ', 'USE TEMP B-TREE')
+
+class ProfiledCursor:
+    # Just enough of the sqlite3.Cursor interface for the lesson runners;
+    # a statement is recorded once its rows run out or the cursor moves on
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self.cursor = profiler.conn.cursor()
+        self.current = None
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    def execute(self, sql, params=()):
+        self._finish()
+        self.current = self.profiler._start(sql, params)
+        try:
+            self.cursor.execute(sql, params)
+        except sqlite3.Error:
+            self._finish()
+            raise
+        self.current['seconds'] += time.perf_counter() - self.current['resumed']
+        if self.cursor.description is None:
+            self._finish()
+        return self
+
+    def executemany(self, sql, rows):
+        self._finish()
+        self.current = self.profiler._start(sql, ())
+        try:
+            self.cursor.executemany(sql, rows)
+        finally:
+            self.current['seconds'] += time.perf_counter() - self.current['resumed']
+            self._finish()
+        return self
+
+    def _fetch(self, fetch, *args):
+        if self.current is None:
+            return fetch(*args)
+        self.current['resumed'] = time.perf_counter()
+        result = fetch(*args)
+        self.current['seconds'] += time.perf_counter() - self.current['resumed']
+        return result
+
+    def fetchone(self):
+        row = self._fetch(self.cursor.fetchone)
+        if self.current is not None:
+            if row is None:
+                self._finish()
+            else:
+                self.current['rows'] += 1
+        return row
+
+    def fetchmany(self, size=1):
+        rows = self._fetch(self.cursor.fetchmany, size)
+        if self.current is not None:
+            self.current['rows'] += len(rows)
+            if len(rows) < size:
+                self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._fetch(self.cursor.fetchall)
+        if self.current is not None:
+            self.current['rows'] += len(rows)
+            self._finish()
+        return rows
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def _finish(self):
+        if self.current is not None:
+            self.profiler._record(self.current)
+            self.current = None
+
+    def close(self):
+        self._finish()
+        self.cursor.close()
+
+class Profiler:
+    # Wraps a connection: statements run through its cursor() or execute()
+    # are timed and recorded, the rest of the connection is passed through,
+    # so it can stand in for the connection of a lesson runner. Statements
+    # slower than slow_ms are appended to log_path as JSON lines.
+    #
+    # The step counter belongs to the connection, so statements whose rows
+    # are fetched alternately from two cursors share their steps.
+    def __init__(self, conn, slow_ms=DEFAULT_SLOW_MS, log_path=None, explain=True):
+        self.conn = conn
+        self.slow_ms = slow_ms
+        self.log_path = log_path
+        self.explain = explain
+        self.profiles = []
+        self.plans = {}
+        self.steps = 0
+        self.untimed = 0
+        self.active = None
+        self.cursors = []
+        self.database = conn.execute('PRAGMA database_list').fetchone()[2]
+        conn.set_progress_handler(self._progress, STEP_INTERVAL)
+        conn.set_trace_callback(self._trace)
+
+    def _progress(self):
+        self.steps += STEP_INTERVAL
+        return 0
+
+    def _trace(self, statement):
+        if self.active is None:
+            # Run on the connection directly, not through a profiled cursor
+            self.untimed += 1
+        else:
+            self.active['statements'] += 1
+
+    def cursor(self):
+        cursor = ProfiledCursor(self)
+        self.cursors = [c for c in self.cursors if c.current is not None] + [cursor]
+        return cursor
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, rows):
+        return self.cursor().executemany(sql, rows)
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def _start(self, sql, params):
+        self.active = {'sql': sql, 'params': params, 'started': time.time(), 'seconds': 0.0,
+                       'steps': self.steps, 'rows': 0, 'statements': 0, 'resumed': time.perf_counter()}
+        return self.active
+
+    def _plan(self, sql, params):
+        # Explaining prepares the statement again, so each text once
+        key = cache.normalize(sql)
+        if key not in self.plans:
+            self.conn.set_trace_callback(None)
+            try:
+                self.plans[key] = [row[3] for row in self.conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+            except sqlite3.Error:
+                self.plans[key] = []
+            finally:
+                self.conn.set_trace_callback(self._trace)
+        return self.plans[key]
+
+    def _record(self, current):
+        if self.active is current:
+            self.active = None
+        steps = self.steps - current['steps']
+        plan = self._plan(current['sql'], current['params']) if self.explain else []
+        profile = Profile(current['sql'], current['params'], current['started'], current['seconds'],
+                          steps, current['rows'], plan, current['statements'])
+        self.profiles.append(profile)
+        if self.log_path and profile.seconds * 1000 >= self.slow_ms:
+            self._log(profile)
+
+    def _log(self, profile):
+        entry = {
+            'time': datetime.fromtimestamp(profile.started).isoformat(timespec='milliseconds'),
+            'database': self.database,
+            'ms': round(profile.seconds * 1000, 3),
+            'steps': profile.steps,
+            'rows': profile.rows,
+            'statements': profile.statements,
+            'sql': cache.normalize(profile.sql),
+            'params': profile.params,
+            'plan': profile.plan,
+        }
+        with open(self.log_path, 'a') as log:
+            # Parameters without a JSON type, such as bytes, are written as repr()
+            log.write(json.dumps(entry, default=repr) + '\n')
+
+    def flush(self):
+        # Record statements whose rows were not all fetched
+        for cursor in self.cursors:
+            cursor._finish()
+        self.cursors = [c for c in self.cursors if c.current is not None]
+
+    def close(self):
+        self.flush()
+        self.conn.set_progress_handler(None, 0)
+        self.conn.set_trace_callback(None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+# =====================================
+# Report
+# =====================================
+Summary = namedtuple('Summary', ['sql', 'calls', 'seconds', 'max_seconds', 'steps', 'rows', 'plan'])
+
+def summarize(profiles):
+    # One Summary per statement text, slowest in total first
+    groups = {}
+    for p in profiles:
+        groups.setdefault(cache.normalize(p.sql), []).append(p)
+    summaries = [Summary(sql, len(group), sum(p.seconds for p in group), max(p.seconds for p in group),
+                         sum(p.steps for p in group), sum(p.rows for p in group), group[0].plan)
+                 for sql, group in groups.items()]
+    return sorted(summaries, key=lambda s: s.seconds, reverse=True)
+
+def report(profiler, top=10, file=None):
+    profiler.flush()
+    out = lambda line='': print(line, file=file)
+    profiles = profiler.profiles
+    total = sum(p.seconds for p in profiles)
+    slow = [p for p in profiles if p.seconds * 1000 >= profiler.slow_ms]
+    out(f"{len(profiles):,} statements in {total * 1000:.2f} ms, {sum(p.rows for p in profiles):,} rows, "
+        f"~{sum(p.steps for p in profiles):,} VM steps; {len(slow)} over {profiler.slow_ms:g} ms"
+        + (f", {profiler.untimed} run outside the profiler" if profiler.untimed else ''))
+    if total:
+        times = [p.seconds * 1000 for p in profiles]
+        out(f"per statement: p50 {bench.percentile(times, 50):.2f} ms, p95 {bench.percentile(times, 95):.2f} ms, "
+            f"max {max(times):.2f} ms")
+    out()
+    out(f"{'calls':>5} {'total':>12} {'max':>12} {'share':>6} {'rows':>10} {'steps':>12}  statement")
+    for s in summarize(profiles)[:top]:
+        sql = s.sql if len(s.sql) <= 70 else s.sql[:67] + '...'
+        share = s.seconds / total if total else 0
+        out(f"{s.calls:>5} {s.seconds * 1000:>9.2f} ms {s.max_seconds * 1000:>9.2f} ms {share:>6.0%} "
+            f"{s.rows:>10,} {s.steps:>12,}  {sql}")
+        for line in s.plan:
+            if line.startswith(PLAN_WARNINGS):
+                out(f"{'':>62}  plan: {line}")
+
+# =====================================
+# Profiling a lesson run
+# =====================================
+# The function of each lesson script that runs its examples on a connection
+RUNNERS = {
+    'aggregation': 'demonstrate_aggregations',
+    'joins': 'run_example_queries',
+    'tasks': 'run_tasks',
+}
+
+def profile_lesson(conn, name, slow_ms=DEFAULT_SLOW_MS, log_path=None, quiet=True):
+    # Run a lesson's examples with the profiler standing in for the
+    # connection; the lesson's own output is dropped when quiet
+    runner = getattr(lessons.load(name), RUNNERS[name])
+    with Profiler(conn, slow_ms, log_path) as profiler, open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(devnull) if quiet else contextlib.nullcontext():
+            runner(profiler)
+    return profiler
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile a lesson's queries and log the slow ones.")
+    parser.add_argument('--lesson', choices=RUNNERS, default='aggregation')
+    parser.add_argument('--db', help='lesson database (default: generated at --scale)')
+    parser.add_argument('--scale', type=datagen.parse_scale, default=200000)
+    parser.add_argument('--data-dir', default=bench.DATA_DIR)
+    parser.add_argument('--slow-ms', type=float, default=DEFAULT_SLOW_MS,
+                        help=f'log statements slower than this (default: {DEFAULT_SLOW_MS})')
+    parser.add_argument('--log', default='slow_queries.jsonl', help='slow-query log, one JSON object per line')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--verbose', action='store_true', help="show the lesson's own output")
+    args = parser.parse_args()
+
+    path = args.db or bench.database_for(args.lesson, args.scale, args.data_dir)
+    conn = loader.connect(path)
+    profiler = profile_lesson(conn, args.lesson, args.slow_ms, args.log, quiet=not args.verbose)
+    report(profiler, args.top)
+    print(f"\nSlow statements appended to {args.log}.")
+    conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+import argparse
+import re
+import time
+from collections import namedtuple
+
+from warehouse import bench, loader
+
+# The table an FTS5 index covers: its INTEGER PRIMARY KEY and text columns
+SearchIndex = namedtuple('SearchIndex', ['table', 'key', 'columns', 'weights'])
+
+# products of text.py; a hit in the name counts more than one in the tags,
+# and both more than one in the description
+PRODUCTS = SearchIndex('products', 'product_id', ('product_name', 'description', 'tags'),
+                       (10.0, 1.0, 5.0))
+
+# The categories of text.py's "Product categorization" CASE, in the same
+# order, so a product that matches several gets the first one
+CATEGORIES = [('Camera', 'camera'), ('Lens', 'lens'), ('Tripod', 'tripod')]
+
+# unicode61 splits on anything that is not a letter or digit, so the
+# comma-separated tags become separate tokens
+TOKENIZER = 'unicode61 remove_diacritics 2'
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+
+def fts_table(index):
+    return f'{index.table}_fts'
+
+def create_sql(index):
+    fts = fts_table(index)
+    columns = ', '.join(index.columns)
+    new = ', '.join(f'new.{c}' for c in index.columns)
+    old = ', '.join(f'old.{c}' for c in index.columns)
+    # External-content table: the text is stored once, in the source table,
+    # and the triggers keep the inverted index in step with it
+    return f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+        {columns}, content='{index.table}', content_rowid='{index.key}',
+        tokenize='{TOKENIZER}'
+    );
+
+    CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {index.table} BEGIN
+        INSERT INTO {fts} (rowid, {columns}) VALUES (new.{index.key}, {new});
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {index.table} BEGIN
+        INSERT INTO {fts} ({fts}, rowid, {columns}) VALUES ('delete', old.{index.key}, {old});
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {index.key}, {columns}
+    ON {index.table} BEGIN
+        INSERT INTO {fts} ({fts}, rowid, {columns}) VALUES ('delete', old.{index.key}, {old});
+        INSERT INTO {fts} (rowid, {columns}) VALUES (new.{index.key}, {new});
+    END;
+    '''
+
+def exists(conn, index=PRODUCTS):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?",
+                        (fts_table(index),)).fetchone() is not None
+
+def create_index(conn, index=PRODUCTS, rebuild=False):
+    # Create the index and its triggers; fill it from the rows already there
+    new = not exists(conn, index)
+    conn.executescript(create_sql(index))
+    if new or rebuild:
+        fts = fts_table(index)
+        with loader.transaction(conn):
+            conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+def drop_index(conn, index=PRODUCTS):
+    fts = fts_table(index)
+    conn.executescript(f'''
+        DROP TRIGGER IF EXISTS {fts}_insert;
+        DROP TRIGGER IF EXISTS {fts}_delete;
+        DROP TRIGGER IF EXISTS {fts}_update;
+        DROP TABLE IF EXISTS {fts};
+    ''')
+
+def optimize(conn, index=PRODUCTS):
+    # Merge the index segments that many small writes leave behind
+    fts = fts_table(index)
+    with loader.transaction(conn):
+        conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('optimize')")
+
+def match_expression(text, columns=None, prefix=False, match_all=True):
+    # Turn free text into an FTS5 query. Every word is quoted, so user input
+    # cannot inject FTS5 syntax; prefix=True also matches longer words.
+    terms = [f'"{word}"' + ('*' if prefix else '') for word in TOKEN.findall(text)]
+    if not terms:
+        raise ValueError(f"No searchable words in {text!r}")
+    expr = (' AND ' if match_all else ' OR ').join(terms)
+    if columns:
+        return f'{{{" ".join(columns)}}}: ({expr})'
+    return expr
+
+def search(conn, text, index=PRODUCTS, columns=None, limit=20, prefix=False, match_all=True):
+    # Best matches first: [(key, first column, score)]. bm25() is lower for
+    # better matches, so its negation is returned as the score.
+    fts = fts_table(index)
+    weights = ', '.join(str(w) for w in index.weights)
+    return conn.execute(f'''
+        SELECT rowid, {index.columns[0]}, -bm25({fts}, {weights}) AS score
+        FROM {fts}
+        WHERE {fts} MATCH ?
+        ORDER BY bm25({fts}, {weights})
+        LIMIT ?
+    ''', (match_expression(text, columns, prefix, match_all), limit)).fetchall()
+
+def search_tags(conn, tags, match_all=True, index=PRODUCTS):
+    # Keys of the rows tagged with all (or any) of tags, in key order
+    fts = fts_table(index)
+    query = match_expression(' '.join(tags), ['tags'], match_all=match_all)
+    return [row[0] for row in conn.execute(
+        f'SELECT rowid FROM {fts} WHERE {fts} MATCH ? ORDER BY rowid', (query,))]
+
+def category_query(category):
+    # FTS5 query for the products text.py would put in category: a name
+    # word starting with its term and none starting with an earlier one
+    names = [name for name, _ in CATEGORIES]
+    earlier = [term for _, term in CATEGORIES[:names.index(category)]]
+    query = match_expression(dict(CATEGORIES)[category], ['product_name'], prefix=True)
+    if earlier:
+        query += ' NOT ' + match_expression(' '.join(earlier), ['product_name'],
+                                            prefix=True, match_all=False)
+    return query
+
+def products_in_category(conn, category):
+    fts = fts_table(PRODUCTS)
+    return [row[0] for row in conn.execute(
+        f'SELECT rowid FROM {fts} WHERE {fts} MATCH ? ORDER BY rowid', (category_query(category),))]
+
+def category_counts(conn):
+    fts = fts_table(PRODUCTS)
+    counts = {name: conn.execute(f'SELECT COUNT(*) FROM {fts} WHERE {fts} MATCH ?',
+                                 (category_query(name),)).fetchone()[0]
+              for name, _ in CATEGORIES}
+    total = conn.execute(f'SELECT COUNT(*) FROM {PRODUCTS.table}').fetchone()[0]
+    counts['Other'] = total - sum(counts.values())
+    return counts
+
+# The LIKE version from text.py, for comparison
+LIKE_CATEGORY_COUNTS = '''
+    SELECT CASE
+               WHEN product_name LIKE '%Camera%' THEN 'Camera'
+               WHEN product_name LIKE '%Lens%' THEN 'Lens'
+               WHEN product_name LIKE '%Tripod%' THEN 'Tripod'
+               ELSE 'Other'
+           END AS product_category,
+           COUNT(*)
+    FROM products
+    GROUP BY product_category
+'''
+
+def compare(conn, runs=5):
+    # Category counts and a tag search by LIKE scan and by FTS5 lookup
+    like = dict(conn.execute(LIKE_CATEGORY_COUNTS).fetchall())
+    fts = category_counts(conn)
+    agree = all(like.get(name, 0) == count for name, count in fts.items())
+    print(f"Category counts agree: {'yes' if agree else 'NO'} {fts}")
+
+    timings = [
+        ('Category counts',
+         lambda: conn.execute(LIKE_CATEGORY_COUNTS).fetchall(),
+         lambda: category_counts(conn)),
+        ("Lens products",
+         lambda: conn.execute("SELECT product_id FROM products WHERE product_name LIKE '%Lens%' "
+                              "AND product_name NOT LIKE '%Camera%'").fetchall(),
+         lambda: products_in_category(conn, 'Lens')),
+        ("Tagged 'pro' and 'camera'",
+         lambda: conn.execute("SELECT product_id FROM products WHERE ',' || tags || ',' LIKE '%,pro,%' "
+                              "AND ',' || tags || ',' LIKE '%,camera,%'").fetchall(),
+         lambda: search_tags(conn, ['pro', 'camera'])),
+    ]
+    print(f"\n{'Query':<28} {'LIKE':>12} {'FTS5':>12} {'speedup':>9}")
+    for name, scan, lookup in timings:
+        before, after = bench.time_callable(scan, runs), bench.time_callable(lookup, runs)
+        print(f"{name:<28} {bench.format_ms(before)} {bench.format_ms(after)} {bench.format_speedup(before, after)}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Full-text search over the products of text.py.')
+    parser.add_argument('--db', required=True, help='database built by text.py')
+    parser.add_argument('--rebuild', action='store_true', help='refill the index from products')
+    parser.add_argument('--drop', action='store_true', help='remove the index and its triggers')
+    parser.add_argument('--query', help='free-text search, best matches first')
+    parser.add_argument('--tags', nargs='+', help='products carrying all of these tags')
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--compare', action='store_true', help='time LIKE scans against the index')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    conn = loader.connect(args.db)
+    if args.drop:
+        drop_index(conn)
+        print(f"Dropped {fts_table(PRODUCTS)}.")
+        return
+    started = time.perf_counter()
+    create_index(conn, rebuild=args.rebuild)
+    print(f"Index ready in {time.perf_counter() - started:.2f}s.")
+
+    if args.query:
+        print(f"\nTop matches for {args.query!r}:")
+        for key, name, score in search(conn, args.query, limit=args.limit, prefix=True):
+            print(f"  {key:>8}  {score:6.2f}  {name}")
+    if args.tags:
+        keys = search_tags(conn, args.tags)
+        print(f"\n{len(keys):,} products tagged {', '.join(args.tags)}: {keys[:args.limit]}")
+    if args.compare:
+        print()
+        compare(conn, args.runs)
+    conn.close()
+
+if __name__ == '__main__':
+    main()
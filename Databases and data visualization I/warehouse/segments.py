@@ -0,0 +1,257 @@
+import argparse
+import itertools
+import time
+from collections import namedtuple
+
+from warehouse import bench, cache, datagen, loader, tags
+from warehouse.bitmap import CHUNK_SIZE, Bitmap
+
+# A set of customer ids kept as a compressed bitmap, built from one column
+# of a table. Set algebra over segments then runs on the bitmaps instead of
+# sorting or hashing the tables for every UNION, INTERSECT or EXCEPT.
+Segment = namedtuple('Segment', ['name', 'table', 'column'])
+
+SEGMENTS = {
+    'joins': [
+        Segment('active_customers', 'active_customers', 'customer_id'),
+        Segment('premium_members', 'premium_members', 'customer_id'),
+        Segment('all_customers', 'all_customers', 'customer_id'),
+        Segment('opted_out_customers', 'opted_out_customers', 'customer_id'),
+        Segment('orders_2023', 'orders_2023', 'customer_id'),
+        Segment('orders_2024', 'orders_2024', 'customer_id'),
+    ],
+}
+
+# NOT x means everyone in this segment but x
+UNIVERSE = {'joins': 'all_customers'}
+
+# Serialized bitmaps, so a store opens without reading the tables again.
+# version is the source table's write counter (warehouse.cache) when the
+# bitmap was built.
+SEGMENT_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS segment_bitmaps (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL,
+        cardinality INTEGER NOT NULL,
+        bitmap BLOB NOT NULL
+    );
+'''
+
+# Lower and upper bound and an estimate of a result's size
+Estimate = namedtuple('Estimate', ['low', 'high', 'expected'])
+
+class SegmentStore:
+    # Segments of one lesson schema, loaded on first use and rebuilt when
+    # their table was written to since. Expressions use the tag syntax of
+    # warehouse.tags with segment names: AND for INTERSECT, OR for UNION
+    # and AND NOT for EXCEPT, e.g. '(orders_2023 OR orders_2024) AND NOT
+    # opted_out_customers'.
+    def __init__(self, conn, schema='joins'):
+        self.conn = conn
+        self.segments = {s.name: s for s in SEGMENTS[schema]}
+        self.universe = UNIVERSE[schema]
+        self.bitmaps = {}
+        self.versions = {}
+        conn.executescript(SEGMENT_SCHEMA)
+        tracked = cache.tracked_tables(conn)
+        for segment in self.segments.values():
+            if segment.table not in tracked:
+                cache.track(conn, segment.table)
+
+    def _version(self, table):
+        return self.conn.execute('SELECT version FROM cache_table_versions WHERE table_name = ?',
+                                 (table,)).fetchone()[0]
+
+    def build(self, name):
+        # Read the segment's table into a bitmap and store it
+        segment = self.segments[name]
+        with loader.transaction(self.conn):
+            version = self._version(segment.table)
+            rows = self.conn.execute(f'SELECT {segment.column} FROM {segment.table} '
+                                     f'WHERE {segment.column} IS NOT NULL')
+            bitmap = Bitmap(row[0] for row in rows).optimize()
+            self.conn.execute('''
+                INSERT OR REPLACE INTO segment_bitmaps (name, version, cardinality, bitmap)
+                VALUES (?, ?, ?, ?)
+            ''', (name, version, len(bitmap), bitmap.to_bytes()))
+        self.bitmaps[name], self.versions[name] = bitmap, version
+        return bitmap
+
+    def get(self, name):
+        # Bitmap of a segment: from memory, from segment_bitmaps, or built
+        # again from its table if that changed since
+        if name not in self.segments:
+            raise KeyError(f"Unknown segment: {name}")
+        version = self._version(self.segments[name].table)
+        if self.versions.get(name) == version:
+            return self.bitmaps[name]
+        stored = self.conn.execute('SELECT version, bitmap FROM segment_bitmaps WHERE name = ?',
+                                   (name,)).fetchone()
+        if stored is None or stored[0] != version:
+            return self.build(name)
+        self.bitmaps[name], self.versions[name] = Bitmap.from_bytes(stored[1]), version
+        return self.bitmaps[name]
+
+    def cardinality(self, name):
+        # Size of a stored segment, without loading its bitmap
+        row = self.conn.execute('SELECT version, cardinality FROM segment_bitmaps WHERE name = ?',
+                                (name,)).fetchone()
+        if row is None or row[0] != self._version(self.segments[name].table):
+            return len(self.build(name))
+        return row[1]
+
+    def evaluate(self, expression):
+        return self._evaluate(tags.parse(expression))
+
+    def _evaluate(self, tree):
+        kind = tree[0]
+        if kind == 'tag':
+            return self.get(tree[1])
+        if kind == 'not':
+            return self.get(self.universe) - self._evaluate(tree[1])
+        left, right = self._evaluate(tree[1]), self._evaluate(tree[2])
+        return left & right if kind == 'and' else left | right
+
+    def count(self, expression):
+        return len(self.evaluate(expression))
+
+    def estimate(self, expression):
+        # Size of a result from the value counts of the segments' chunks
+        # alone, without combining any container. The bounds hold for any
+        # ids; the estimate assumes that within a chunk the segments pick
+        # their ids independently from the universe segment.
+        tree = tags.parse(expression)
+        names = {self.universe}
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            if node[0] == 'tag':
+                names.add(node[1])
+            else:
+                stack.extend(node[1:])
+        counts = {name: self.get(name).chunk_counts() for name in names}
+        low = high = expected = 0
+        for key in set().union(*counts.values()):
+            population = max(chunks.get(key, 0) for chunks in counts.values())
+            chunk_low, chunk_high, share = self._chunk_estimate(tree, counts, key, population)
+            low += chunk_low
+            high += chunk_high
+            expected += share * population
+        return Estimate(low, high, round(expected))
+
+    def _chunk_estimate(self, tree, counts, key, population):
+        # (low, high, share of population) of tree within one chunk
+        kind = tree[0]
+        if kind == 'tag':
+            n = counts[tree[1]].get(key, 0)
+            return n, n, n / population
+        if kind == 'not':
+            universe = counts[self.universe].get(key, 0)
+            low, high, share = self._chunk_estimate(tree[1], counts, key, population)
+            return max(0, universe - high), universe, max(0.0, universe / population - share)
+        low1, high1, p1 = self._chunk_estimate(tree[1], counts, key, population)
+        low2, high2, p2 = self._chunk_estimate(tree[2], counts, key, population)
+        if kind == 'and':
+            return max(0, low1 + low2 - CHUNK_SIZE), min(high1, high2), p1 * p2
+        return max(low1, low2), min(CHUNK_SIZE, high1 + high2), p1 + p2 - p1 * p2
+
+    def materialize(self, expression, table, column='customer_id'):
+        # Write a result to a table of its own, replacing its rows; returns
+        # the number of ids written. Ids come out sorted, so the inserts
+        # append to the primary key b-tree.
+        bitmap = self.evaluate(expression)
+        with loader.transaction(self.conn):
+            self.conn.execute(f'CREATE TABLE IF NOT EXISTS {table} ({column} INTEGER PRIMARY KEY)')
+            self.conn.execute(f'DELETE FROM {table}')
+            for chunk in loader.chunked(((value,) for value in bitmap), loader.BATCH_SIZE):
+                self.conn.executemany(f'INSERT INTO {table} ({column}) VALUES (?)', chunk)
+        return len(bitmap)
+
+def drop(conn):
+    conn.execute('DROP TABLE IF EXISTS segment_bitmaps')
+    conn.commit()
+
+# =====================================
+# Comparison against SQL set operations
+# =====================================
+def to_sql(tree, store):
+    # The same expression as a compound SELECT over the segment tables
+    kind = tree[0]
+    if kind == 'tag':
+        segment = store.segments[tree[1]]
+        return f'SELECT {segment.column} FROM {segment.table}'
+    if kind == 'not':
+        return f"{to_sql(('tag', store.universe), store)} EXCEPT SELECT * FROM ({to_sql(tree[1], store)})"
+    operator = 'INTERSECT' if kind == 'and' else 'UNION'
+    return f"SELECT * FROM ({to_sql(tree[1], store)}) {operator} SELECT * FROM ({to_sql(tree[2], store)})"
+
+# The set operations of joins.py and a few campaign-style combinations
+EXAMPLES = {
+    'joins': [
+        'orders_2023 OR orders_2024',
+        'active_customers AND premium_members',
+        'all_customers AND NOT opted_out_customers',
+        'orders_2023 AND NOT orders_2024',
+        '(active_customers OR orders_2024) AND premium_members AND NOT opted_out_customers',
+    ],
+}
+
+def compare(store, expressions, runs=5):
+    print(f"{'Expression':<44} {'SQL':>12} {'bitmaps':>12} {'count':>12} {'speedup':>9} "
+          f"{'agrees':>7}  estimate")
+    for expression in expressions:
+        sql = f'{to_sql(tags.parse(expression), store)} ORDER BY 1'
+        run_sql = lambda: [row[0] for row in store.conn.execute(sql)]
+        expected = run_sql()
+        agrees = list(store.evaluate(expression)) == expected
+        before = bench.time_callable(run_sql, runs)
+        after = bench.time_callable(lambda: list(store.evaluate(expression)), runs)
+        counted = bench.time_callable(lambda: store.count(expression), runs)
+        estimate = store.estimate(expression)
+        label = expression if len(expression) <= 44 else expression[:41] + '...'
+        print(f"{label:<44} {bench.format_ms(before)} {bench.format_ms(after)} {bench.format_ms(counted)} "
+              f"{bench.format_speedup(before, after)} {bench.format_agrees(agrees)}  {estimate.expected:,} in [{estimate.low:,}, {estimate.high:,}], "
+              f"actual {len(expected):,}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Customer segments as compressed bitmaps.')
+    parser.add_argument('--db', help='joins database (default: generated at --scale)')
+    parser.add_argument('--scale', type=datagen.parse_scale, default=200000)
+    parser.add_argument('--data-dir', default=bench.DATA_DIR)
+    parser.add_argument('--query', help="segment expression, e.g. 'active_customers AND NOT opted_out_customers'")
+    parser.add_argument('--into', help='table to write the result of --query to')
+    parser.add_argument('--compare', action='store_true', help='time the examples against SQL set operations')
+    parser.add_argument('--drop', action='store_true', help='remove the stored bitmaps')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    path = args.db or bench.database_for('joins', args.scale, args.data_dir)
+    conn = loader.connect(path)
+    if args.drop:
+        drop(conn)
+        print("Dropped the stored bitmaps.")
+        return
+    store = SegmentStore(conn)
+    started = time.perf_counter()
+    for name in store.segments:
+        store.get(name)
+    print(f"Segments ready in {time.perf_counter() - started:.2f}s:")
+    for name, bitmap in store.bitmaps.items():
+        print(f"  {name:<22} {len(bitmap):>12,} ids {bitmap.nbytes:>12,} bytes")
+
+    if args.query:
+        estimate = store.estimate(args.query)
+        print(f"\nEstimate: {estimate.expected:,} ({estimate.low:,} to {estimate.high:,})")
+        if args.into:
+            count = store.materialize(args.query, args.into)
+            print(f"Wrote {count:,} ids to {args.into}")
+        else:
+            result = store.evaluate(args.query)
+            print(f"{len(result):,} ids: {list(itertools.islice(result, 20))}")
+    if args.compare:
+        print()
+        compare(store, EXAMPLES['joins'], args.runs)
+    conn.close()
+
+if __name__ == '__main__':
+    main()
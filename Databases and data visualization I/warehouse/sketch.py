@@ -0,0 +1,203 @@
+import hashlib
+import math
+import struct
+
+# Fixed-size summaries of a column that answer one question approximately
+# and can be merged: a HyperLogLog estimates how many distinct values were
+# added, a t-digest estimates quantiles. Both are built one value at a time,
+# so they fit SQLite aggregate functions (see warehouse.approx).
+
+MASK64 = (1 << 64) - 1
+
+def hash64(value):
+    # 64-bit hash that is the same in every process, unlike hash(). Values
+    # SQLite's DISTINCT treats as equal (1 and 1.0) hash the same.
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, int):
+        # The value-th output of splitmix64: consecutive ids land far apart
+        z = ((value + 1) * 0x9E3779B97F4A7C15) & MASK64
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+        return z ^ (z >> 31)
+    if isinstance(value, str):
+        data = value.encode()
+    elif isinstance(value, bytes):
+        data = value
+    else:
+        data = repr(value).encode()
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+
+# =====================================
+# HyperLogLog
+# =====================================
+# 2**14 one-byte registers: 16 KB and a standard error of 0.8%
+DEFAULT_PRECISION = 14
+
+# 2**-rank of every register value, so count() only adds
+POWERS = [2.0 ** -rank for rank in range(66)]
+
+class HyperLogLog:
+    def __init__(self, precision=DEFAULT_PRECISION):
+        if not 4 <= precision <= 18:
+            raise ValueError(f"HyperLogLog precision must be 4 to 18, not {precision}")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    @property
+    def error(self):
+        # Relative standard error of count()
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def add(self, value):
+        # The first precision bits of the hash pick a register, which keeps
+        # the longest run of leading zeros seen in the remaining bits
+        h = hash64(value)
+        rest_bits = 64 - self.precision
+        index = h >> rest_bits
+        rank = rest_bits - (h & ((1 << rest_bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        m = len(self.registers)
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        estimate = alpha * m * m / sum(POWERS[r] for r in self.registers)
+        zeros = self.registers.count(0)
+        # Few values: count the empty registers instead (linear counting)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def merge(self, other):
+        # Add every value added to other; the result estimates the union
+        if other.precision != self.precision:
+            raise ValueError(f"Cannot merge HyperLogLogs of precision {self.precision} and {other.precision}")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def __len__(self):
+        return self.count()
+
+    def to_bytes(self):
+        return bytes([self.precision]) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data):
+        sketch = cls(data[0])
+        if len(data) != 1 + len(sketch.registers):
+            raise ValueError(f"Expected {1 + len(sketch.registers)} bytes, got {len(data)}")
+        sketch.registers = bytearray(data[1:])
+        return sketch
+
+# =====================================
+# t-digest
+# =====================================
+# Larger compression keeps more centroids: more accurate and larger
+DEFAULT_COMPRESSION = 200
+
+# Values added before the buffer is sorted into the centroids, per unit of
+# compression
+BUFFER_FACTOR = 5
+
+class TDigest:
+    # Sorted centroids (mean, weight). Centroids near the median hold many
+    # values and those near the tails few, so extreme quantiles stay
+    # accurate (the k1 scale function of Dunning's merging t-digest).
+    def __init__(self, compression=DEFAULT_COMPRESSION):
+        self.compression = compression
+        self.means = []
+        self.weights = []
+        self.buffer = []
+        self.total = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value, weight=1):
+        self.buffer.append((value, weight))
+        self.total += weight
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if len(self.buffer) >= BUFFER_FACTOR * self.compression:
+            self._compress()
+
+    def _k(self, q):
+        return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+    def _q(self, k):
+        # Inverse of _k()
+        if k >= self.compression / 4:
+            return 1.0
+        return (math.sin(k * 2 * math.pi / self.compression) + 1) / 2
+
+    def _compress(self):
+        if not self.buffer:
+            return
+        points = sorted(list(zip(self.means, self.weights)) + self.buffer)
+        self.buffer = []
+        means, weights = [], []
+        mean, weight = points[0]
+        before = 0
+        limit = self._q(self._k(0) + 1) * self.total
+        for value, w in points[1:]:
+            if before + weight + w <= limit:
+                weight += w
+                mean += (value - mean) * w / weight
+            else:
+                means.append(mean)
+                weights.append(weight)
+                before += weight
+                limit = self._q(self._k(before / self.total) + 1) * self.total
+                mean, weight = value, w
+        means.append(mean)
+        weights.append(weight)
+        self.means, self.weights = means, weights
+
+    def merge(self, other):
+        other._compress()
+        for mean, weight in zip(other.means, other.weights):
+            self.add(mean, weight)
+        self.min, self.max = min(self.min, other.min), max(self.max, other.max)
+        return self
+
+    def quantile(self, q):
+        # Value below which a share q of the added values fall; None if
+        # nothing was added. Interpolates between centroid centers.
+        self._compress()
+        if not self.means:
+            return None
+        if len(self.means) == 1:
+            return self.means[0]
+        target = min(max(q, 0.0), 1.0) * self.total
+        # Below the first center and above the last, toward min and max
+        first, last = self.weights[0] / 2, self.weights[-1] / 2
+        if target < first:
+            return self.min + (self.means[0] - self.min) * target / first
+        if target > self.total - last:
+            return self.means[-1] + (self.max - self.means[-1]) * (target - self.total + last) / last
+        before = 0
+        for i in range(len(self.means) - 1):
+            left = before + self.weights[i] / 2
+            right = before + self.weights[i] + self.weights[i + 1] / 2
+            if target <= right:
+                return self.means[i] + (self.means[i + 1] - self.means[i]) * (target - left) / (right - left)
+            before += self.weights[i]
+        return self.means[-1]
+
+    def __len__(self):
+        return self.total
+
+    def to_bytes(self):
+        self._compress()
+        return struct.pack(f'<dddd{2 * len(self.means)}d', self.compression, self.total, self.min, self.max,
+                           *(v for pair in zip(self.means, self.weights) for v in pair))
+
+    @classmethod
+    def from_bytes(cls, data):
+        values = struct.unpack(f'<{len(data) // 8}d', data)
+        digest = cls(int(values[0]))
+        digest.total, digest.min, digest.max = values[1], values[2], values[3]
+        digest.means, digest.weights = list(values[4::2]), list(values[5::2])
+        return digest
@@ -0,0 +1,450 @@
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+from collections import namedtuple
+
+from warehouse import bench, incremental, lessons, loader
+
+# Star schema built from the OLTP practice tables. Dimensions get surrogate
+# integer keys; the natural keys are kept (and indexed) to load the facts.
+STAR_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS dim_date (
+        date_key INTEGER PRIMARY KEY,     -- yyyymmdd
+        full_date DATE NOT NULL,
+        year INTEGER NOT NULL,
+        quarter INTEGER NOT NULL,
+        month INTEGER NOT NULL,
+        day INTEGER NOT NULL,
+        weekday INTEGER NOT NULL          -- 0 = Sunday
+    );
+
+    CREATE TABLE IF NOT EXISTS dim_department (
+        department_key INTEGER PRIMARY KEY,
+        dept_id INTEGER NOT NULL UNIQUE,
+        dept_name VARCHAR(50),
+        location VARCHAR(50)
+    );
+
+    CREATE TABLE IF NOT EXISTS dim_employee (
+        employee_key INTEGER PRIMARY KEY,
+        emp_id INTEGER NOT NULL UNIQUE,
+        name VARCHAR(50),
+        salary DECIMAL(10,2),
+        department_key INTEGER,
+        dept_name VARCHAR(50),            -- denormalized from dim_department
+        manager_id INTEGER,
+        manager_key INTEGER,
+        hire_date_key INTEGER
+    );
+
+    CREATE TABLE IF NOT EXISTS dim_project (
+        project_key INTEGER PRIMARY KEY,
+        project_id INTEGER NOT NULL UNIQUE,
+        project_name VARCHAR(50),
+        budget DECIMAL(10,2),
+        department_key INTEGER
+    );
+
+    CREATE TABLE IF NOT EXISTS dim_customer (
+        customer_key INTEGER PRIMARY KEY,
+        customer_id INTEGER NOT NULL UNIQUE,
+        name VARCHAR(100),
+        email VARCHAR(100)
+    );
+
+    CREATE TABLE IF NOT EXISTS fact_hours (
+        source_rowid INTEGER NOT NULL,    -- employee_projects row, to replace on change
+        employee_key INTEGER NOT NULL,
+        project_key INTEGER NOT NULL,
+        department_key INTEGER NOT NULL,  -- department that owns the project
+        hours_worked DECIMAL(10,2),
+        labor_cost DECIMAL(10,2)          -- hours * hourly rate (salary / 2080)
+    );
+
+    CREATE TABLE IF NOT EXISTS fact_orders (
+        order_id INTEGER PRIMARY KEY,     -- degenerate dimension
+        date_key INTEGER,
+        customer_key INTEGER,
+        amount DECIMAL(10,2)
+    );
+'''
+
+STAR_TABLES = ['fact_hours', 'fact_orders', 'dim_employee', 'dim_project', 'dim_department',
+               'dim_customer', 'dim_date']
+
+# Foreign keys of the fact tables, indexed after the load
+STAR_INDEXES = '''
+    CREATE INDEX IF NOT EXISTS idx_fact_hours_project ON fact_hours (project_key, hours_worked);
+    CREATE INDEX IF NOT EXISTS idx_fact_hours_department ON fact_hours (department_key, labor_cost);
+    CREATE INDEX IF NOT EXISTS idx_fact_hours_employee ON fact_hours (employee_key);
+    CREATE INDEX IF NOT EXISTS idx_fact_hours_source ON fact_hours (source_rowid);
+    CREATE INDEX IF NOT EXISTS idx_fact_orders_customer ON fact_orders (customer_key);
+    CREATE INDEX IF NOT EXISTS idx_fact_orders_date ON fact_orders (date_key);
+    CREATE INDEX IF NOT EXISTS idx_dim_employee_department ON dim_employee (department_key);
+    CREATE INDEX IF NOT EXISTS idx_dim_employee_hire_date ON dim_employee (hire_date_key);
+'''
+
+# Transform steps per source: Step(name, source table, key column,
+# statements, pending). Sources are attached as `src`, and every step only
+# reads the source rows in {changed}: those inserted, updated or deleted
+# since its last run, from the table's change log (incremental.
+# track_changes), so a full build and an incremental run share the same
+# set-based SQL. Dimensions are upserted on their natural key; facts are
+# replaced by source row. pending selects changed rows whose dimension rows
+# are not loaded yet: the step stops before the first of them.
+Step = namedtuple('Step', ['name', 'table', 'key', 'sql', 'pending'], defaults=(None,))
+
+TASKS_TRANSFORM = [
+    Step('departments', 'departments', 'dept_id', '''
+        INSERT INTO dim_department (dept_id, dept_name, location)
+        SELECT dept_id, dept_name, location
+        FROM src.departments
+        WHERE dept_id IN {changed}
+        ORDER BY dept_id
+        ON CONFLICT (dept_id) DO UPDATE SET
+            dept_name = excluded.dept_name,
+            location = excluded.location
+        WHERE (dept_name, location) IS NOT (excluded.dept_name, excluded.location)
+    '''),
+    # dim_employee keeps a copy of the department name
+    Step('department_names', 'departments', 'dept_id', '''
+        UPDATE dim_employee
+        SET dept_name = (SELECT d.dept_name FROM dim_department d
+                         WHERE d.department_key = dim_employee.department_key)
+        WHERE department_key IN (SELECT department_key FROM dim_department WHERE dept_id IN {changed})
+          AND dept_name IS NOT (SELECT d.dept_name FROM dim_department d
+                                WHERE d.department_key = dim_employee.department_key)
+    '''),
+    Step('employees', 'employees', 'emp_id', '''
+        INSERT INTO dim_employee (emp_id, name, salary, department_key, dept_name,
+                                  manager_id, hire_date_key)
+        SELECT e.emp_id, e.name, e.salary, d.department_key, d.dept_name,
+               e.manager_id, CAST(strftime('%Y%m%d', e.hire_date) AS INTEGER)
+        FROM src.employees e
+        LEFT JOIN dim_department d ON d.dept_id = e.department_id
+        WHERE e.emp_id IN {changed}
+        ORDER BY e.emp_id
+        ON CONFLICT (emp_id) DO UPDATE SET
+            name = excluded.name,
+            salary = excluded.salary,
+            department_key = excluded.department_key,
+            dept_name = excluded.dept_name,
+            manager_id = excluded.manager_id,
+            hire_date_key = excluded.hire_date_key
+        WHERE (name, salary, department_key, dept_name, manager_id, hire_date_key)
+              IS NOT (excluded.name, excluded.salary, excluded.department_key, excluded.dept_name,
+                      excluded.manager_id, excluded.hire_date_key)
+    '''),
+    # Managers may arrive in the same batch as their reports, or after
+    # them, so resolve the manager's surrogate key once all are loaded
+    Step('employee_managers', 'employees', 'emp_id', '''
+        UPDATE dim_employee
+        SET manager_key = (SELECT m.employee_key FROM dim_employee m
+                           WHERE m.emp_id = dim_employee.manager_id)
+        WHERE emp_id IN {changed} OR manager_id IN {changed}
+    '''),
+    Step('projects', 'projects', 'project_id', '''
+        INSERT INTO dim_project (project_id, project_name, budget, department_key)
+        SELECT p.project_id, p.project_name, p.budget, d.department_key
+        FROM src.projects p
+        LEFT JOIN dim_department d ON d.dept_id = p.dept_id
+        WHERE p.project_id IN {changed}
+        ORDER BY p.project_id
+        ON CONFLICT (project_id) DO UPDATE SET
+            project_name = excluded.project_name,
+            budget = excluded.budget,
+            department_key = excluded.department_key
+        WHERE (project_name, budget, department_key)
+              IS NOT (excluded.project_name, excluded.budget, excluded.department_key)
+    '''),
+    # employee_projects has no key of its own, so its facts are replaced by
+    # rowid: deleted for every changed row, inserted for those still there
+    Step('employee_projects', 'employee_projects', 'rowid', '''
+        DELETE FROM fact_hours WHERE source_rowid IN {changed};
+        INSERT INTO fact_hours (source_rowid, employee_key, project_key, department_key,
+                                hours_worked, labor_cost)
+        SELECT ep.rowid, e.employee_key, p.project_key, p.department_key, ep.hours_worked,
+               ep.hours_worked * COALESCE(e.salary, 0) / 2080
+        FROM src.employee_projects ep
+        JOIN dim_employee e ON e.emp_id = ep.emp_id
+        JOIN dim_project p ON p.project_id = ep.project_id
+        WHERE ep.rowid IN {changed}
+    ''', '''
+        SELECT ep.rowid FROM src.employee_projects ep
+        WHERE ep.rowid IN {changed}
+          AND (NOT EXISTS (SELECT 1 FROM dim_employee e WHERE e.emp_id = ep.emp_id)
+               OR NOT EXISTS (SELECT 1 FROM dim_project p WHERE p.project_id = ep.project_id))
+    '''),
+]
+
+JOINS_TRANSFORM = [
+    Step('customers', 'customers', 'customer_id', '''
+        INSERT INTO dim_customer (customer_id, name, email)
+        SELECT customer_id, name, email
+        FROM src.customers
+        WHERE customer_id IN {changed}
+        ORDER BY customer_id
+        ON CONFLICT (customer_id) DO UPDATE SET
+            name = excluded.name,
+            email = excluded.email
+        WHERE (name, email) IS NOT (excluded.name, excluded.email)
+    '''),
+    Step('orders', 'orders', 'order_id', '''
+        DELETE FROM fact_orders
+        WHERE order_id IN {changed} AND order_id NOT IN (SELECT order_id FROM src.orders);
+        INSERT INTO fact_orders (order_id, date_key, customer_key, amount)
+        SELECT o.order_id, CAST(strftime('%Y%m%d', o.order_date) AS INTEGER),
+               c.customer_key, o.amount
+        FROM src.orders o
+        LEFT JOIN dim_customer c ON c.customer_id = o.customer_id
+        WHERE o.order_id IN {changed}
+        ORDER BY o.order_id
+        ON CONFLICT (order_id) DO UPDATE SET
+            date_key = excluded.date_key,
+            customer_key = excluded.customer_key,
+            amount = excluded.amount
+        WHERE (date_key, customer_key, amount)
+              IS NOT (excluded.date_key, excluded.customer_key, excluded.amount)
+    '''),
+]
+
+# Calendar rows for every day between the first and last date in the sources
+DIM_DATE_FILL = '''
+    WITH RECURSIVE days(d) AS (
+        SELECT date(?)
+        UNION ALL
+        SELECT date(d, '+1 day') FROM days WHERE d < date(?)
+    )
+    INSERT OR IGNORE INTO dim_date (date_key, full_date, year, quarter, month, day, weekday)
+    SELECT CAST(strftime('%Y%m%d', d) AS INTEGER), d,
+           CAST(strftime('%Y', d) AS INTEGER),
+           (CAST(strftime('%m', d) AS INTEGER) + 2) / 3,
+           CAST(strftime('%m', d) AS INTEGER),
+           CAST(strftime('%d', d) AS INTEGER),
+           CAST(strftime('%w', d) AS INTEGER)
+    FROM days
+'''
+
+# Department and project reports from run_tasks() against the star schema,
+# titled like the tasks they replace: [(title, query), ...]
+REPORTS = [
+    ("Task 3 - Employees per Department", '''
+        SELECT
+            d.dept_name,
+            COUNT(e.employee_key) as employee_count
+        FROM dim_department d
+        LEFT JOIN dim_employee e ON e.department_key = d.department_key
+        GROUP BY d.dept_name
+    '''),
+    ("Task 4 - Project Employee Hours", '''
+        SELECT
+            p.project_name,
+            COALESCE(SUM(f.hours_worked), 0) as total_hours
+        FROM dim_project p
+        LEFT JOIN fact_hours f ON f.project_key = p.project_key
+        GROUP BY p.project_name
+    '''),
+    # Needs departments, projects, employee_projects and employees in the
+    # OLTP schema; the fact table already carries the department and cost
+    ("Department Labor Cost", '''
+        SELECT
+            d.dept_name,
+            ROUND(SUM(f.labor_cost), 2) as labor_cost
+        FROM fact_hours f
+        JOIN dim_department d ON d.department_key = f.department_key
+        GROUP BY d.dept_name
+    '''),
+]
+
+# The same department labor cost report written against the OLTP tables
+OLTP_LABOR_COST = '''
+    SELECT
+        d.dept_name,
+        ROUND(SUM(ep.hours_worked * COALESCE(e.salary, 0) / 2080), 2) as labor_cost
+    FROM employee_projects ep
+    JOIN employees e ON e.emp_id = ep.emp_id
+    JOIN projects p ON p.project_id = ep.project_id
+    JOIN departments d ON d.dept_id = p.dept_id
+    GROUP BY d.dept_name
+'''
+
+def create_star_schema(conn, rebuild=False):
+    if rebuild:
+        for table in STAR_TABLES:
+            conn.execute(f'DROP TABLE IF EXISTS {table}')
+    incremental.create_watermark_table(conn)
+    columns = loader.table_columns(conn, 'fact_hours')
+    if columns and 'source_rowid' not in columns:
+        # Facts loaded before they were kept by source row cannot be
+        # replaced one by one; load them again
+        conn.execute('DROP TABLE fact_hours')
+        incremental.reset_watermarks(conn, 'tasks.employee_projects')
+    conn.executescript(STAR_SCHEMA)
+    if rebuild:
+        incremental.reset_watermarks(conn)
+
+def _run_transform(conn, label, source_path, steps, watermarks=None):
+    # Attach an OLTP database as `src` and run its transform steps on the
+    # rows changed since the stored watermarks. Data and watermarks commit
+    # together. watermarks maps a source table to a column that grows on
+    # every write, e.g. updated_at, to use instead of its change log.
+    watermarks = watermarks or {}
+    conn.execute('ATTACH DATABASE ? AS src', (source_path,))
+    try:
+        for table, key in {step.table: step.key for step in steps}.items():
+            if table not in watermarks:
+                incremental.track_changes(conn, 'src', table, key)
+        with loader.transaction(conn):
+            for step in steps:
+                rows, seconds, waiting = incremental.run_step(
+                    conn, f'{label}.{step.name}', step.table, step.key, step.sql,
+                    column=watermarks.get(step.table), pending=step.pending)
+                print(f"  {step.name:<18} {rows:>12,} rows  {seconds:.2f}s"
+                      + (f"  ({waiting:,} waiting for their dimension rows)" if waiting else ''))
+    finally:
+        conn.execute('DETACH DATABASE src')
+
+def fill_dim_date(conn):
+    # Cover hire dates and order dates that made it into the star. Separate
+    # MIN/MAX lookups are answered from the indexes without a scan.
+    bounds = conn.execute('''
+        SELECT (SELECT MIN(hire_date_key) FROM dim_employee),
+               (SELECT MAX(hire_date_key) FROM dim_employee),
+               (SELECT MIN(date_key) FROM fact_orders),
+               (SELECT MAX(date_key) FROM fact_orders)
+    ''').fetchone()
+    keys = [key for key in bounds if key is not None]
+    first, last = (min(keys), max(keys)) if keys else (None, None)
+    if first is None:
+        return 0
+    to_date = lambda key: f'{key // 10000:04d}-{key // 100 % 100:02d}-{key % 100:02d}'
+    changes = conn.total_changes
+    with loader.transaction(conn):
+        conn.execute(DIM_DATE_FILL, (to_date(first), to_date(last)))
+    return conn.total_changes - changes
+
+def build(conn, tasks_db=None, joins_db=None, incremental_load=False, watermarks=None):
+    # Full rebuild of the star schema from the practice databases, or with
+    # incremental_load=True only the source rows changed since the last run
+    create_star_schema(conn, rebuild=not incremental_load)
+    if tasks_db:
+        print(f"Transforming {tasks_db}...")
+        _run_transform(conn, 'tasks', tasks_db, TASKS_TRANSFORM, watermarks)
+    if joins_db:
+        print(f"Transforming {joins_db}...")
+        _run_transform(conn, 'joins', joins_db, JOINS_TRANSFORM, watermarks)
+    print(f"  {'dim_date':<18} {fill_dim_date(conn):>12,} rows")
+    conn.executescript(STAR_INDEXES)
+    if incremental_load:
+        # ANALYZE reads every table; let SQLite decide whether it is needed
+        conn.execute('PRAGMA optimize')
+    else:
+        conn.execute('ANALYZE')
+    conn.commit()
+
+def run_reports(conn):
+    cursor = conn.cursor()
+    for title, query in REPORTS:
+        print(f"\n{title}:")
+        cursor.execute(query)
+        print(cursor.fetchall())
+
+def compare(star_conn, tasks_conn, runs=5):
+    # Time each star report against the query it replaces in run_tasks()
+    oltp = dict(lessons.queries('tasks'))
+    oltp['Department Labor Cost'] = OLTP_LABOR_COST
+    print(f"\n{'Report':<40} {'OLTP':>12} {'star':>12} {'speedup':>9}")
+    for title, query in REPORTS:
+        before = bench.time_query(tasks_conn, oltp[title], runs)['p50_ms']
+        after = bench.time_query(star_conn, query, runs)['p50_ms']
+        print(f"{title:<40} {before:>9.2f} ms {after:>9.2f} ms {before / after:>8.1f}x")
+
+# Sample rows edited before the lessons run again; the lessons' upserts
+# then write them back through the change-log triggers
+CHECK_EDITS = {
+    'tasks': ('practice.db', "UPDATE departments SET dept_name = dept_name || ' (renamed)'"),
+    'joins': ('joins_guide.db', "UPDATE customers SET name = name || ' (renamed)'"),
+}
+
+def check(scale=1000):
+    # Build the star from fresh tasks.py and joins.py databases, so their
+    # tables carry change logs, then rerun both lessons after a sample row
+    # was edited and after a refill at scale, each followed by an
+    # incremental load. Returns the steps that failed.
+    failed = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            modules = {name: lessons.load(name) for name in CHECK_EDITS}
+            for module in modules.values():
+                module.create_database().close()
+            conn = loader.connect('warehouse.db')
+            build(conn, 'practice.db', 'joins_guide.db')
+            for name, (path, sql) in CHECK_EDITS.items():
+                source = loader.connect(path)
+                with loader.transaction(source):
+                    source.execute(sql)
+                source.close()
+            for step, kwargs in [('rerun after an edit', {}), ('refill', {'scale': scale}),
+                                 ('rerun after a refill', {})]:
+                for name, module in modules.items():
+                    try:
+                        module.create_database(**kwargs).close()
+                    except sqlite3.Error as e:
+                        failed.append(f'{name}.py {step}: {e}')
+                try:
+                    build(conn, 'practice.db', 'joins_guide.db', incremental_load=True)
+                except sqlite3.Error as e:
+                    failed.append(f'incremental load after {step}: {e}')
+            conn.close()
+        finally:
+            os.chdir(cwd)
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a star schema from the practice databases.')
+    parser.add_argument('--db', default='warehouse.db', help='star schema database')
+    parser.add_argument('--tasks-db', help='source database built by tasks.py (e.g. practice.db)')
+    parser.add_argument('--joins-db', help='source database built by joins.py (e.g. joins_guide.db)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='load only source rows past the stored watermarks')
+    parser.add_argument('--watermark', action='append', default=[], metavar='TABLE=COLUMN',
+                        help='column that grows on every write of a source table, to use instead '
+                             'of its change log, e.g. orders=updated_at')
+    parser.add_argument('--compare', action='store_true',
+                        help='time the reports against the OLTP queries in run_tasks()')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--check', action='store_true',
+                        help='only verify that the lessons rerun on change-logged sources; '
+                             'exit status 1 if not')
+    args = parser.parse_args()
+    if args.check:
+        failed = check()
+        for failure in failed:
+            print(f"Failed: {failure}")
+        print(f"{len(failed)} failures rerunning the lessons after track_changes.")
+        raise SystemExit(1 if failed else 0)
+    if not (args.tasks_db or args.joins_db):
+        parser.error('pass --tasks-db and/or --joins-db')
+
+    watermarks = dict(item.split('=', 1) for item in args.watermark)
+
+    conn = loader.connect(args.db)
+    started = time.perf_counter()
+    build(conn, args.tasks_db, args.joins_db, args.incremental, watermarks)
+    mode = 'updated' if args.incremental else 'built'
+    print(f"\nStar schema '{args.db}' {mode} in {time.perf_counter() - started:.1f}s.")
+
+    if args.tasks_db:
+        run_reports(conn)
+        if args.compare:
+            tasks_conn = loader.connect(args.tasks_db)
+            compare(conn, tasks_conn, args.runs)
+            tasks_conn.close()
+    conn.close()
+
+if __name__ == '__main__':
+    main()
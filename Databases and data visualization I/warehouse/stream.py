@@ -0,0 +1,48 @@
+import functools
+import sys
+from collections import namedtuple
+
+# Rows fetched per fetchmany() call: large enough to amortize the Python
+# overhead per call, small enough that memory does not grow with the result
+FETCH_SIZE = 1000
+
+def rows(cursor, batch_size=FETCH_SIZE):
+    # Yield the rows of an executed cursor; only one batch is held at a time
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            return
+        yield from batch
+
+def query(conn, sql, params=(), batch_size=FETCH_SIZE, row_factory=None):
+    # Execute sql on a cursor of its own and stream the rows. row_factory is
+    # set on that cursor only, e.g. sqlite3.Row or dict_factory.
+    cursor = conn.cursor()
+    if row_factory:
+        cursor.row_factory = row_factory
+    try:
+        cursor.execute(sql, params)
+        yield from rows(cursor, batch_size)
+    finally:
+        cursor.close()
+
+def dict_factory(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+@functools.lru_cache(maxsize=None)
+def _row_class(fields):
+    # rename=True turns names like COUNT(*) into valid field names
+    return namedtuple('Row', fields, rename=True)
+
+def namedtuple_factory(cursor, row):
+    return _row_class(tuple(column[0] for column in cursor.description))(*row)
+
+def print_list(rows, file=None):
+    # Same output as print(list(rows)), written row by row
+    file = file or sys.stdout
+    file.write('[')
+    for number, row in enumerate(rows):
+        if number:
+            file.write(', ')
+        file.write(repr(row))
+    file.write(']\n')
@@ -0,0 +1,328 @@
+import argparse
+import itertools
+import re
+import time
+
+from warehouse import bench, loader
+from warehouse.bitmap import Bitmap
+
+# products.tags ('camera,electronics,pro') split into a tag dimension and a
+# bridge table. products.tags stays the source of truth; the triggers below
+# keep the bridge in step with it and log which products changed.
+TAGS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS tags (
+        tag_id INTEGER PRIMARY KEY,
+        tag TEXT NOT NULL UNIQUE            -- trimmed and lower case
+    );
+
+    CREATE TABLE IF NOT EXISTS product_tags (
+        product_id INTEGER NOT NULL,
+        tag_id INTEGER NOT NULL REFERENCES tags (tag_id),
+        PRIMARY KEY (product_id, tag_id)
+    ) WITHOUT ROWID;
+
+    CREATE INDEX IF NOT EXISTS idx_product_tags_tag ON product_tags (tag_id, product_id);
+
+    -- Last change per product, for refreshing in-memory bitmaps
+    CREATE TABLE IF NOT EXISTS product_tag_changes (
+        product_id INTEGER PRIMARY KEY,
+        seq INTEGER NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_product_tag_changes_seq ON product_tag_changes (seq);
+'''
+
+def _tag_list(column):
+    # JSON array of the comma-separated values of column, for json_each().
+    # Triggers cannot use a recursive CTE to split strings, but they can
+    # call json_each. json_quote() escapes quotes, backslashes and control
+    # characters, none of them with a comma, so any text gives valid JSON.
+    return f"""'[' || replace(json_quote(CAST({column} AS TEXT)), ',', '","') || ']'"""
+
+# Spaces and control characters around a tag are not part of it
+BLANKS = f"char({', '.join(str(code) for code in range(1, 33))})"
+
+def _tag(value):
+    return f'lower(trim({value}, {BLANKS}))'
+
+# The statements below run inside triggers, where OR IGNORE / OR REPLACE
+# would give way to the conflict policy of the statement that fired them
+# (ABORT under loader.upsert); ON CONFLICT clauses keep their own. WHERE
+# true keeps the parser from reading ON CONFLICT as a join constraint.
+def _insert_tags(row):
+    values = f"json_each({_tag_list(f'{row}.tags')})"
+    return f'''
+        INSERT INTO tags (tag)
+        SELECT DISTINCT {_tag('value')} FROM {values} WHERE {_tag('value')} <> ''
+        ON CONFLICT (tag) DO NOTHING;
+        INSERT INTO product_tags (product_id, tag_id)
+        SELECT {row}.product_id, tags.tag_id
+        FROM {values} AS item JOIN tags ON tags.tag = {_tag('item.value')} WHERE true
+        ON CONFLICT (product_id, tag_id) DO NOTHING;
+    '''
+
+def _log_change(row):
+    return f'''
+        INSERT INTO product_tag_changes (product_id, seq)
+        VALUES ({row}.product_id, (SELECT COALESCE(MAX(seq), 0) + 1 FROM product_tag_changes))
+        ON CONFLICT (product_id) DO UPDATE SET seq = excluded.seq;
+    '''
+
+TRIGGERS = f'''
+    DROP TRIGGER IF EXISTS product_tags_insert;
+    DROP TRIGGER IF EXISTS product_tags_delete;
+    DROP TRIGGER IF EXISTS product_tags_update;
+
+    CREATE TRIGGER product_tags_insert AFTER INSERT ON products BEGIN
+        {_insert_tags('new')}
+        {_log_change('new')}
+    END;
+
+    CREATE TRIGGER product_tags_delete AFTER DELETE ON products BEGIN
+        DELETE FROM product_tags WHERE product_id = old.product_id;
+        {_log_change('old')}
+    END;
+
+    CREATE TRIGGER product_tags_update AFTER UPDATE OF product_id, tags ON products BEGIN
+        DELETE FROM product_tags WHERE product_id = old.product_id;
+        {_insert_tags('new')}
+        {_log_change('old')}
+        {_log_change('new')}
+    END;
+'''
+
+# Fill the bridge from the products already there
+BACKFILL = f'''
+    INSERT OR IGNORE INTO tags (tag)
+    SELECT DISTINCT {_tag('item.value')}
+    FROM products, json_each({_tag_list('products.tags')}) AS item
+    WHERE {_tag('item.value')} <> '';
+
+    INSERT OR IGNORE INTO product_tags (product_id, tag_id)
+    SELECT products.product_id, tags.tag_id
+    FROM products, json_each({_tag_list('products.tags')}) AS item
+    JOIN tags ON tags.tag = {_tag('item.value')};
+'''
+
+def exists(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'product_tags'").fetchone() is not None
+
+def migrate(conn, rebuild=False):
+    # Create the tag tables and triggers; fill them from the rows already
+    # there. Once they exist the triggers keep them in sync.
+    new = not exists(conn)
+    conn.executescript(TAGS_SCHEMA + TRIGGERS)
+    if new or rebuild:
+        with loader.transaction(conn):
+            for statement in BACKFILL.split(';'):
+                if statement.strip():
+                    conn.execute(statement)
+
+def drop(conn):
+    conn.executescript('''
+        DROP TRIGGER IF EXISTS product_tags_insert;
+        DROP TRIGGER IF EXISTS product_tags_delete;
+        DROP TRIGGER IF EXISTS product_tags_update;
+        DROP TABLE IF EXISTS product_tag_changes;
+        DROP TABLE IF EXISTS product_tags;
+        DROP TABLE IF EXISTS tags;
+    ''')
+
+# =====================================
+# Tag expressions: camera AND (pro OR lite) AND NOT tripod
+# =====================================
+TOKEN = re.compile(r'\(|\)|[^\s()]+')
+
+def parse(expression):
+    # Parse tree of ('tag', name), ('not', x), ('and', x, y), ('or', x, y).
+    # NOT binds tightest, then AND, then OR; two tags in a row mean AND.
+    tokens = TOKEN.findall(expression)
+    position = 0
+
+    def peek():
+        return tokens[position].upper() if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def parse_or():
+        node = parse_and()
+        while peek() == 'OR':
+            take()
+            node = ('or', node, parse_and())
+        return node
+
+    def parse_and():
+        node = parse_not()
+        while peek() not in (None, 'OR', ')'):
+            if peek() == 'AND':
+                take()
+            node = ('and', node, parse_not())
+        return node
+
+    def parse_not():
+        if peek() == 'NOT':
+            take()
+            return ('not', parse_not())
+        if peek() == '(':
+            take()
+            node = parse_or()
+            if peek() != ')':
+                raise ValueError(f"Missing ) in {expression!r}")
+            take()
+            return node
+        if peek() in (None, 'AND', 'OR', ')'):
+            raise ValueError(f"Expected a tag in {expression!r}")
+        return ('tag', take().strip().lower())
+
+    tree = parse_or()
+    if position != len(tokens):
+        raise ValueError(f"Unexpected {tokens[position]!r} in {expression!r}")
+    return tree
+
+def to_sql(tree):
+    # The same expression as a compound SELECT over the bridge table
+    kind = tree[0]
+    if kind == 'tag':
+        tag = tree[1].replace("'", "''")
+        return (f"SELECT product_id FROM product_tags "
+                f"WHERE tag_id = (SELECT tag_id FROM tags WHERE tag = '{tag}')")
+    if kind == 'not':
+        return f"SELECT product_id FROM products EXCEPT SELECT * FROM ({to_sql(tree[1])})"
+    operator = 'INTERSECT' if kind == 'and' else 'UNION'
+    return f"SELECT * FROM ({to_sql(tree[1])}) {operator} SELECT * FROM ({to_sql(tree[2])})"
+
+def to_like(tree):
+    # ... and as a WHERE clause on the packed products.tags string
+    kind = tree[0]
+    if kind == 'tag':
+        tag = tree[1].replace("'", "''")
+        return f"(',' || replace(tags, ' ', '') || ',') LIKE '%,{tag},%'"
+    if kind == 'not':
+        return f"NOT {to_like(tree[1])}"
+    operator = 'AND' if kind == 'and' else 'OR'
+    return f"({to_like(tree[1])} {operator} {to_like(tree[2])})"
+
+class TagIndex:
+    # tag -> Bitmap of product_ids, loaded from the bridge table and kept
+    # current from product_tag_changes by refresh()
+    def __init__(self, conn):
+        self.conn = conn
+        self.bitmaps = {}
+        self.all = Bitmap()
+        self.seq = 0
+        self.load()
+
+    def load(self):
+        # Read the change position first: changes made while loading are
+        # replayed by the next refresh()
+        self.seq = self.conn.execute('SELECT COALESCE(MAX(seq), 0) FROM product_tag_changes').fetchone()[0]
+        names = dict(self.conn.execute('SELECT tag_id, tag FROM tags'))
+        rows = self.conn.execute('SELECT tag_id, product_id FROM product_tags ORDER BY tag_id, product_id')
+        self.bitmaps = {names[tag_id]: Bitmap(product_id for _, product_id in group)
+                        for tag_id, group in itertools.groupby(rows, key=lambda row: row[0])}
+        self.all = Bitmap(row[0] for row in self.conn.execute('SELECT product_id FROM products'))
+
+    def refresh(self):
+        # Re-read the tags of the products changed since the last refresh
+        # and return how many there were
+        changes = self.conn.execute('''
+            SELECT product_id, seq FROM product_tag_changes WHERE seq > ? ORDER BY seq
+        ''', (self.seq,)).fetchall()
+        if not changes:
+            return 0
+        changed = sorted({product_id for product_id, _ in changes})
+        for product_id in changed:
+            self.all.discard(product_id)
+            for bitmap in self.bitmaps.values():
+                bitmap.discard(product_id)
+        for chunk in loader.chunked(changed, 500):
+            placeholders = ', '.join('?' for _ in chunk)
+            for (product_id,) in self.conn.execute(
+                    f'SELECT product_id FROM products WHERE product_id IN ({placeholders})', chunk):
+                self.all.add(product_id)
+            for tag, product_id in self.conn.execute(f'''
+                SELECT tags.tag, product_tags.product_id
+                FROM product_tags JOIN tags USING (tag_id)
+                WHERE product_tags.product_id IN ({placeholders})
+            ''', chunk):
+                self.bitmaps.setdefault(tag, Bitmap()).add(product_id)
+        self.seq = changes[-1][1]
+        return len(changed)
+
+    def evaluate(self, tree):
+        kind = tree[0]
+        if kind == 'tag':
+            return self.bitmaps.get(tree[1], Bitmap())
+        if kind == 'not':
+            return self.all - self.evaluate(tree[1])
+        left, right = self.evaluate(tree[1]), self.evaluate(tree[2])
+        return left & right if kind == 'and' else left | right
+
+    def query(self, expression, refresh=True):
+        # Bitmap of the product_ids matching a tag expression
+        if refresh:
+            self.refresh()
+        return self.evaluate(parse(expression))
+
+    def tags(self):
+        # {tag: number of products}
+        return {tag: len(bitmap) for tag, bitmap in sorted(self.bitmaps.items())}
+
+def compare(conn, expression, runs=5):
+    # One tag expression by LIKE on products.tags, by the bridge table and
+    # by the bitmaps
+    tree = parse(expression)
+    index = TagIndex(conn)
+    methods = [
+        ('LIKE on products.tags',
+         lambda: [row[0] for row in conn.execute(
+             f'SELECT product_id FROM products WHERE {to_like(tree)} ORDER BY product_id')]),
+        ('product_tags bridge',
+         lambda: [row[0] for row in conn.execute(f'{to_sql(tree)} ORDER BY 1')]),
+        ('bitmap index', lambda: list(index.query(expression))),
+        ('bitmap index (count)', lambda: len(index.query(expression))),
+    ]
+    expected = methods[0][1]()
+    print(f"{expression!r}: {len(expected):,} products")
+    print(f"\n{'Method':<24} {'p50':>12} {'agrees':>7}")
+    for name, function in methods:
+        result = function()
+        agrees = result == (len(expected) if isinstance(result, int) else expected)
+        print(f"{name:<24} {bench.format_ms(bench.time_callable(function, runs, warmup=0), 3)} "
+              f"{bench.format_agrees(agrees)}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Tag dimension, bridge table and bitmap tag queries.')
+    parser.add_argument('--db', required=True, help='database built by text.py')
+    parser.add_argument('--query', help="tag expression, e.g. 'camera AND pro AND NOT tripod'")
+    parser.add_argument('--compare', action='store_true',
+                        help='time the query by LIKE, bridge table and bitmaps')
+    parser.add_argument('--drop', action='store_true', help='remove the tag tables and triggers')
+    parser.add_argument('--rebuild', action='store_true', help='refill the tag tables from products')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    conn = loader.connect(args.db)
+    if args.drop:
+        drop(conn)
+        print("Dropped the tag tables.")
+        return
+    started = time.perf_counter()
+    migrate(conn, rebuild=args.rebuild)
+    print(f"Tag tables ready in {time.perf_counter() - started:.2f}s.")
+
+    if args.compare and args.query:
+        compare(conn, args.query, args.runs)
+    elif args.query:
+        result = TagIndex(conn).query(args.query)
+        print(f"{len(result):,} products: {list(itertools.islice(result, 20))}")
+    else:
+        for tag, count in TagIndex(conn).tags().items():
+            print(f"  {tag:<20} {count:>10,}")
+    conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,413 @@
+import argparse
+import re
+import sqlite3
+import time
+from collections import namedtuple
+from datetime import date, timedelta
+from decimal import Decimal
+
+from warehouse import bench, datagen, loader, lookups
+
+# A lesson column stored as an integer: a DATE as days since 1970-01-01 and
+# a DECIMAL(10,2) as cents. The lesson column stays in place as a VIRTUAL
+# generated column that decodes the integer, so it takes no space and the
+# lessons' queries still read '2024-01-15' and 1234.5.
+Typed = namedtuple('Typed', ['table', 'column', 'stored', 'kind'])
+
+TYPED = {
+    'joins': [Typed('orders', 'order_date', 'order_day', 'date'),
+              Typed('orders', 'amount', 'amount_cents', 'money')],
+    'commands': [Typed('orders', 'order_date', 'order_day', 'date')],
+    'aggregation': [Typed('employees', 'hire_date', 'hire_day', 'date'),
+                    Typed('employees', 'salary', 'salary_cents', 'money')],
+    'tasks': [Typed('employees', 'hire_date', 'hire_day', 'date'),
+              Typed('employees', 'salary', 'salary_cents', 'money'),
+              Typed('projects', 'budget', 'budget_cents', 'money')],
+}
+
+EPOCH = date(1970, 1, 1)
+
+# Declared types of the stored columns. Python's sqlite3 looks converters up
+# by the first word; SQLite gives both INTEGER affinity.
+DECLARED = {'date': 'DAYS INTEGER', 'money': 'CENTS INTEGER'}
+
+# SQL that turns a lesson value into the stored integer, and back
+ENCODE = {
+    'date': 'CAST(julianday({}) - 2440587.5 AS INTEGER)',
+    'money': 'CAST(ROUND({} * 100) AS INTEGER)',
+}
+DECODE = {
+    'date': "date({} * 86400, 'unixepoch')",
+    'money': '{} / 100.0',
+}
+
+# Values that would not survive the round trip: dates with a time or in
+# another format, and money that is not a number or not a whole number of
+# cents. ROUND(x, 2) gives back the double nearest to the 2-decimal value,
+# so it equals x exactly where x * 100 would be off by a rounding error.
+INVALID = {
+    'date': "{0} IS NOT NULL AND (typeof({0}) <> 'text' OR date({0}) IS NOT {0})",
+    'money': "{0} IS NOT NULL AND (typeof({0}) NOT IN ('integer', 'real') OR ROUND({0}, 2) <> {0})",
+}
+
+def encode_day(value):
+    if isinstance(value, str):
+        value = date.fromisoformat(value)
+    return (value - EPOCH).days
+
+def encode_cents(value):
+    cents = Decimal(str(value)) * 100
+    if cents != cents.to_integral_value():
+        raise ValueError(f"Not a whole number of cents: {value!r}")
+    return int(cents)
+
+ENCODERS = {'date': encode_day, 'money': encode_cents}
+
+def encode_rows(typed, columns, rows):
+    # Column names and rows written with the lesson's columns, as the stored
+    # columns and their integers, for code that writes to converted tables
+    encoders = {t.column: t for t in typed}
+    names = [encoders[c].stored if c in encoders else c for c in columns]
+    functions = [ENCODERS[encoders[c].kind] if c in encoders else None for c in columns]
+    return names, [tuple(v if f is None or v is None else f(v) for f, v in zip(functions, row)) for row in rows]
+
+# =====================================
+# Adapters and converters
+# =====================================
+def register():
+    # Converters only run on connections opened with PARSE_DECLTYPES, but
+    # sqlite3 adapters are global: after this every date and Decimal passed
+    # as a parameter is written as a day number or cents. The lessons pass
+    # dates as ISO strings and money as floats, which are left alone.
+    sqlite3.register_converter('DAYS', lambda b: EPOCH + timedelta(days=int(b)))
+    sqlite3.register_converter('CENTS', lambda b: Decimal(int(b)).scaleb(-2))
+    sqlite3.register_adapter(date, encode_day)
+    sqlite3.register_adapter(Decimal, encode_cents)
+
+def connect(path, **overrides):
+    # loader.connect() on which day and cent columns read as date and Decimal
+    register()
+    return loader.connect(path, detect_types=sqlite3.PARSE_DECLTYPES, **overrides)
+
+# =====================================
+# Converting lesson tables
+# =====================================
+CREATE_TABLE_NAME = re.compile(r'^\s*CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?"?\w+"?', re.IGNORECASE)
+
+def is_converted(conn, t):
+    # PRAGMA table_info leaves generated columns out, table_xinfo does not
+    return t.stored in {row[1] for row in conn.execute(f'PRAGMA table_xinfo({t.table})')}
+
+def _definition_end(sql, start):
+    # Position of the comma or parenthesis that ends the column definition
+    # at start
+    depth = 0
+    for i in range(start, len(sql)):
+        if sql[i] == '(':
+            depth += 1
+        elif sql[i] == ')' and depth:
+            depth -= 1
+        elif sql[i] in ',)' and not depth:
+            return i
+    raise ValueError(f"Unterminated column definition: {sql[start:]!r}")
+
+def _typed_ddl(create_sql, table, typed):
+    # The table's CREATE TABLE with each typed column generated from a new
+    # integer column right after it
+    for t in typed:
+        match = re.search(rf'(?<![\w."]){t.column}\s+[A-Za-z]+(?:\s*\([^)]*\))?', create_sql)
+        end = len(create_sql[:_definition_end(create_sql, match.end())].rstrip())
+        create_sql = (f'{create_sql[:match.end()]} GENERATED ALWAYS AS ({DECODE[t.kind].format(t.stored)}) VIRTUAL'
+                      f'{create_sql[match.end():end]},\n        {t.stored} {DECLARED[t.kind]}{create_sql[end:]}')
+    return CREATE_TABLE_NAME.sub(f'CREATE TABLE {table}', create_sql, count=1)
+
+def _leading_columns(conn, table):
+    return {conn.execute(f'PRAGMA index_info({row[1]})').fetchone()[2]
+            for row in conn.execute(f'PRAGMA index_list({table})')}
+
+def convert(conn, table, typed):
+    # Rebuild a table with its typed columns stored as integers, keeping
+    # its indexes (on the integers instead) and triggers. Returns the number
+    # of rows converted.
+    kind, create_sql = conn.execute('SELECT type, sql FROM sqlite_master WHERE name = ?', (table,)).fetchone()
+    if kind != 'table':
+        raise ValueError(f"{table} is a {kind}, e.g. after warehouse.partition; convert it first")
+    for t in typed:
+        bad = conn.execute(f'SELECT COUNT(*) FROM {table} WHERE {INVALID[t.kind].format(t.column)}').fetchone()[0]
+        if bad:
+            raise ValueError(f"{bad:,} values of {table}.{t.column} cannot be stored as a {t.kind}")
+    scratch = f'{table}_typed'
+    others = [c for c in loader.table_columns(conn, table) if c not in {t.column for t in typed}]
+    index_sqls = [row[0] for row in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (table,))]
+    trigger_sqls = [row[0] for row in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ?", (table,))]
+    columns = others + [t.stored for t in typed]
+    values = others + [ENCODE[t.kind].format(t.column) for t in typed]
+    with loader.transaction(conn):
+        conn.execute(f'DROP TABLE IF EXISTS {scratch}')
+        conn.execute(_typed_ddl(create_sql, scratch, typed))
+        converted = conn.execute(f'INSERT INTO {scratch} ({", ".join(columns)}) '
+                                 f'SELECT {", ".join(values)} FROM {table} ORDER BY rowid').rowcount
+        conn.execute(f'DROP TABLE {table}')
+        conn.execute(f'ALTER TABLE {scratch} RENAME TO {table}')
+        for sql in index_sqls:
+            for t in typed:
+                sql = re.sub(rf'(?<![\w.]){t.column}\b', t.stored, sql)
+            conn.execute(sql)
+        for sql in trigger_sqls:
+            conn.execute(sql)
+        # Date ranges need an index on the day number
+        indexed = _leading_columns(conn, table)
+        for t in typed:
+            if t.kind == 'date' and t.stored not in indexed:
+                conn.execute(f'CREATE INDEX idx_{table}_{t.stored} ON {table} ({t.stored})')
+    return converted
+
+def install(conn, schema):
+    # Convert the typed columns of a lesson database; safe to re-run.
+    # Returns {table: rows converted}.
+    tables = {}
+    for t in TYPED[schema]:
+        tables.setdefault(t.table, []).append(t)
+    return {table: convert(conn, table, [t for t in typed if not is_converted(conn, t)])
+            for table, typed in tables.items() if not all(is_converted(conn, t) for t in typed)}
+
+# =====================================
+# Calendar dimension
+# =====================================
+# First month of the fiscal year; a fiscal year is named after the
+# calendar year it ends in
+FISCAL_YEAR_START = 7
+
+DIM_DATE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS dim_date (
+        day_number INTEGER PRIMARY KEY,   -- days since 1970-01-01, as in the typed columns
+        full_date DATE NOT NULL UNIQUE,
+        year INTEGER NOT NULL,
+        quarter INTEGER NOT NULL,
+        month INTEGER NOT NULL,
+        day INTEGER NOT NULL,
+        weekday INTEGER NOT NULL,         -- 0 = Sunday
+        fiscal_year INTEGER NOT NULL,
+        fiscal_quarter INTEGER NOT NULL,
+        fiscal_period INTEGER NOT NULL    -- month of the fiscal year, 1 to 12
+    );
+'''
+
+DIM_DATE_FILL = f'''
+    WITH RECURSIVE days(n) AS (
+        SELECT ?
+        UNION ALL
+        SELECT n + 1 FROM days WHERE n < ?
+    ),
+    dates AS (
+        SELECT n, date(n * 86400, 'unixepoch') AS d,
+               CAST(strftime('%Y', n * 86400, 'unixepoch') AS INTEGER) AS y,
+               CAST(strftime('%m', n * 86400, 'unixepoch') AS INTEGER) AS m
+        FROM days
+    )
+    INSERT OR IGNORE INTO dim_date (day_number, full_date, year, quarter, month, day, weekday,
+                                    fiscal_year, fiscal_quarter, fiscal_period)
+    SELECT n, d, y, (m + 2) / 3, m,
+           CAST(strftime('%d', d) AS INTEGER),
+           CAST(strftime('%w', d) AS INTEGER),
+           y + (m >= {FISCAL_YEAR_START} AND {FISCAL_YEAR_START} > 1),
+           ((m - {FISCAL_YEAR_START} + 12) % 12) / 3 + 1,
+           (m - {FISCAL_YEAR_START} + 12) % 12 + 1
+    FROM dates
+'''
+
+def fill_dim_date(conn, schema):
+    # Whole calendar years around the schema's typed dates. MIN/MAX of an
+    # indexed day number is a lookup, not a scan.
+    conn.executescript(DIM_DATE_SCHEMA)
+    bounds = []
+    for t in TYPED[schema]:
+        if t.kind == 'date' and is_converted(conn, t):
+            bounds.extend(conn.execute(f'SELECT MIN({t.stored}), MAX({t.stored}) FROM {t.table}').fetchone())
+    bounds = [b for b in bounds if b is not None]
+    if not bounds:
+        return 0
+    first = date(date.fromordinal(EPOCH.toordinal() + min(bounds)).year, 1, 1)
+    last = date(date.fromordinal(EPOCH.toordinal() + max(bounds)).year, 12, 31)
+    changes = conn.total_changes
+    with loader.transaction(conn):
+        conn.execute(DIM_DATE_FILL, (encode_day(first), encode_day(last)))
+    return conn.total_changes - changes
+
+# =====================================
+# Rewriting filters to the stored integers
+# =====================================
+DATE_LITERAL = r"'(\d{4}-\d{2}-\d{2})'"
+NUMBER_LITERAL = r'(-?\d+(?:\.\d+)?)(?![\w.]|\s*[-+*/%|])'
+ARITHMETIC = set('+-*/%|')
+
+def _integer_literal(t, text):
+    if t.kind == 'date':
+        return str(encode_day(text))
+    return format((Decimal(text) * 100).normalize(), 'f')
+
+def rewrite(sql, schema):
+    # sql with comparisons of a typed column to a literal turned into
+    # comparisons of its integer, e.g. order_date >= '2024-01-01' into
+    # order_day >= 19723. Like warehouse.generated.rewrite() it goes by the
+    # column names alone. Comparisons inside arithmetic are left alone.
+    for t in TYPED[schema]:
+        literal = DATE_LITERAL if t.kind == 'date' else NUMBER_LITERAL
+        name = rf'(?<![\w.])((?:\w+\.)?){t.column}'
+
+        def between(m, t=t):
+            if m.string[:m.start()].rstrip()[-1:] in ARITHMETIC:
+                return m.group(0)
+            return (f'{m.group(1)}{t.stored} BETWEEN {_integer_literal(t, m.group(2))} '
+                    f'AND {_integer_literal(t, m.group(3))}')
+
+        def compare(m, t=t):
+            if m.string[:m.start()].rstrip()[-1:] in ARITHMETIC:
+                return m.group(0)
+            return f'{m.group(1)}{t.stored} {m.group(2)} {_integer_literal(t, m.group(3))}'
+
+        sql = re.sub(rf'{name}\s+BETWEEN\s+{literal}\s+AND\s+{literal}', between, sql, flags=re.IGNORECASE)
+        sql = re.sub(rf'{name}\s*(>=|<=|<>|!=|=|>|<)\s*{literal}', compare, sql)
+    return sql
+
+# =====================================
+# Comparison against the TEXT and REAL columns
+# =====================================
+# (name, lesson query, the query on the stored integers). {orders} and
+# {employees} are the table: a scratch copy with the lesson's columns for
+# the first query, the converted table for the second. Filters of the
+# second are written like the first and go through rewrite().
+EXAMPLES = {
+    'joins': [
+        ('One month of revenue',
+         "SELECT COUNT(*), ROUND(SUM(amount), 2) FROM {orders} "
+         "WHERE order_date >= '2023-06-01' AND order_date < '2023-07-01'",
+         "SELECT COUNT(*), SUM(amount_cents) / 100.0 FROM {orders} "
+         "WHERE order_date >= '2023-06-01' AND order_date < '2023-07-01'"),
+        ('Revenue by fiscal quarter',
+         "SELECT d.fiscal_year, d.fiscal_quarter, ROUND(SUM(o.amount), 2) FROM {orders} o "
+         "JOIN dim_date d ON d.full_date = o.order_date GROUP BY 1, 2 ORDER BY 1, 2",
+         "SELECT d.fiscal_year, d.fiscal_quarter, SUM(o.amount_cents) / 100.0 FROM {orders} o "
+         "JOIN dim_date d ON d.day_number = o.order_day GROUP BY 1, 2 ORDER BY 1, 2"),
+        ('Weekend orders in 2024',
+         "SELECT COUNT(*) FROM {orders} o JOIN dim_date d ON d.full_date = o.order_date "
+         "WHERE d.weekday IN (0, 6) AND o.order_date BETWEEN '2024-01-01' AND '2024-12-31'",
+         "SELECT COUNT(*) FROM {orders} o JOIN dim_date d ON d.day_number = o.order_day "
+         "WHERE d.weekday IN (0, 6) AND o.order_date BETWEEN '2024-01-01' AND '2024-12-31'"),
+    ],
+    'commands': [
+        ('One month of orders',
+         "SELECT COUNT(*) FROM {orders} WHERE order_date >= '2024-06-01' AND order_date < '2024-07-01'",
+         "SELECT COUNT(*) FROM {orders} WHERE order_date >= '2024-06-01' AND order_date < '2024-07-01'"),
+        ('Orders by fiscal quarter',
+         "SELECT d.fiscal_year, d.fiscal_quarter, COUNT(*) FROM {orders} o "
+         "JOIN dim_date d ON d.full_date = o.order_date GROUP BY 1, 2 ORDER BY 1, 2",
+         "SELECT d.fiscal_year, d.fiscal_quarter, COUNT(*) FROM {orders} o "
+         "JOIN dim_date d ON d.day_number = o.order_day GROUP BY 1, 2 ORDER BY 1, 2"),
+    ],
+    'aggregation': [
+        ('Hired in 2020',
+         "SELECT COUNT(*), ROUND(AVG(salary), 2) FROM {employees} "
+         "WHERE hire_date BETWEEN '2020-01-01' AND '2020-12-31'",
+         "SELECT COUNT(*), ROUND(AVG(salary_cents) / 100.0, 2) FROM {employees} "
+         "WHERE hire_date BETWEEN '2020-01-01' AND '2020-12-31'"),
+        ('Payroll by fiscal year hired',
+         "SELECT d.fiscal_year, ROUND(SUM(e.salary), 2) FROM {employees} e "
+         "JOIN dim_date d ON d.full_date = e.hire_date GROUP BY 1 ORDER BY 1",
+         "SELECT d.fiscal_year, SUM(e.salary_cents) / 100.0 FROM {employees} e "
+         "JOIN dim_date d ON d.day_number = e.hire_day GROUP BY 1 ORDER BY 1"),
+    ],
+}
+EXAMPLES['tasks'] = EXAMPLES['aggregation']
+
+def _rows(conn, sql):
+    # Money summed as cents is exact; as REAL it is only right once rounded
+    return [tuple(round(v, 2) if isinstance(v, float) else v for v in row) for row in conn.execute(sql)]
+
+def _lesson_ddl(create_sql, table, typed):
+    # The reverse of _typed_ddl(): the table as the lesson created it
+    for t in typed:
+        create_sql = create_sql.replace(f' GENERATED ALWAYS AS ({DECODE[t.kind].format(t.stored)}) VIRTUAL', '')
+        create_sql = create_sql.replace(f',\n        {t.stored} {DECLARED[t.kind]}', '')
+    return CREATE_TABLE_NAME.sub(f'CREATE TABLE {table}', create_sql, count=1)
+
+def compare(conn, schema, runs=5):
+    # Copy each converted table as the lesson had it, TEXT and REAL columns
+    # with the same indexes, then time the examples on both and compare sizes
+    tables = sorted({t.table for t in TYPED[schema]})
+    scratch = {table: f'typed_compare_{table}' for table in tables}
+    try:
+        for table, copy in scratch.items():
+            typed = [t for t in TYPED[schema] if t.table == table]
+            create_sql = conn.execute("SELECT sql FROM sqlite_master WHERE name = ?", (table,)).fetchone()[0]
+            columns = loader.table_columns(conn, table)
+            columns = [c for c in columns if c not in {t.stored for t in typed}] + [t.column for t in typed]
+            conn.execute(f'DROP TABLE IF EXISTS {copy}')
+            conn.execute(_lesson_ddl(create_sql, copy, typed))
+            conn.execute(f'INSERT INTO {copy} ({", ".join(columns)}) SELECT {", ".join(columns)} FROM {table}')
+            for name, sql in conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' "
+                                          "AND tbl_name = ? AND sql IS NOT NULL", (table,)).fetchall():
+                for t in typed:
+                    sql = re.sub(rf'(?<![\w.]){t.stored}\b', t.column, sql)
+                sql = re.sub(rf'\b{name}\s+ON\s+"?{table}"?', f'{name}_{copy} ON {copy}', sql, count=1,
+                             flags=re.IGNORECASE)
+                conn.execute(sql)
+        conn.commit()
+        print(f"{'Query':<30} {'TEXT/REAL':>12} {'integers':>12} {'speedup':>9} {'agrees':>7}")
+        for name, before_sql, after_sql in EXAMPLES[schema]:
+            before_sql = before_sql.format(**scratch)
+            after_sql = rewrite(after_sql.format(**{table: table for table in tables}), schema)
+            agrees = _rows(conn, before_sql) == _rows(conn, after_sql)
+            before = bench.time_query(conn, before_sql, runs)['p50_ms']
+            after = bench.time_query(conn, after_sql, runs)['p50_ms']
+            print(f"{name:<30} {before:>9.2f} ms {after:>9.2f} ms {before / after:>8.1f}x "
+                  f"{'yes' if agrees else 'NO':>7}")
+        print()
+        for table, copy in scratch.items():
+            before, after = lookups.table_bytes(conn, copy), lookups.table_bytes(conn, table)
+            if before and after:
+                print(f"{table} with TEXT and REAL: {before / 1024 ** 2:.2f} MB, "
+                      f"with integers: {after / 1024 ** 2:.2f} MB ({1 - after / before:.0%} smaller)")
+    finally:
+        for copy in scratch.values():
+            conn.execute(f'DROP TABLE IF EXISTS {copy}')
+        conn.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description='Store dates as day numbers and money as cents.')
+    parser.add_argument('--schema', choices=TYPED, default='joins')
+    parser.add_argument('--db', help='lesson database (default: generated at --scale)')
+    parser.add_argument('--scale', type=datagen.parse_scale, default=200000)
+    parser.add_argument('--data-dir', default=bench.DATA_DIR)
+    parser.add_argument('--query', help='show how a query is rewritten and run it')
+    parser.add_argument('--compare', action='store_true', help='time the examples against TEXT and REAL columns')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    path = args.db or bench.database_for(args.schema, args.scale, args.data_dir)
+    conn = connect(path)
+    started = time.perf_counter()
+    for table, count in install(conn, args.schema).items():
+        print(f"{table}: {count:,} rows converted in {time.perf_counter() - started:.2f}s")
+    print(f"dim_date: {fill_dim_date(conn, args.schema):,} days added")
+
+    # The stored columns read back as Python dates and Decimals
+    typed = TYPED[args.schema]
+    table = typed[0].table
+    stored = ', '.join(t.stored for t in typed if t.table == table)
+    for row in conn.execute(f'SELECT {stored} FROM {table} LIMIT 3'):
+        print(f"  {row}")
+    if args.query:
+        rewritten = rewrite(args.query, args.schema)
+        print(f"\n{rewritten}")
+        for row in conn.execute(rewritten).fetchmany(20):
+            print(f"  {row}")
+    if args.compare:
+        print()
+        compare(conn, args.schema, args.runs)
+    conn.close()
+
+if __name__ == '__main__':
+    main()